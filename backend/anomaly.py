@@ -0,0 +1,159 @@
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+from pyod.models.knn import KNN
+
+from payroll_engine import OVERTIME_DIVISOR, OVERTIME_MULTIPLIER
+
+FEATURES = ["base_salary", "overtime_hours", "bonus_ratio", "deduction_ratio", "department_deviation"]
+FEATURE_REASONS = {
+    "base_salary": "Unusual base salary",
+    "overtime_hours": "Unusual overtime hours",
+    "bonus_ratio": "Unusual bonus relative to base salary",
+    "deduction_ratio": "Unusual deductions relative to base salary",
+    "department_deviation": "Net salary far from department norm",
+}
+SCORE_BATCH_SIZE = 10000
+
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator != 0)
+
+
+def department_medians(columns):
+    medians = {}
+    departments = np.asarray(columns["department"], dtype=object)
+    net = np.asarray(columns["net_salary"], dtype=np.float64)
+    for department in set(departments.tolist()):
+        medians[department] = float(np.median(net[departments == department]))
+    return medians
+
+
+def build_features(columns, medians, fallback_median):
+    """Turn columnar payroll data into the (n, len(FEATURES)) feature matrix."""
+    base = np.asarray(columns["base_salary"], dtype=np.float64)
+    overtime_pay = np.asarray(columns["overtime_pay"], dtype=np.float64)
+    bonuses = np.asarray(columns["bonuses"], dtype=np.float64)
+    deductions = np.asarray(columns["deductions"], dtype=np.float64)
+    net = np.asarray(columns["net_salary"], dtype=np.float64)
+    department_median = np.array(
+        [medians.get(department, fallback_median) for department in columns["department"]],
+        dtype=np.float64
+    )
+
+    hourly_overtime = base / OVERTIME_DIVISOR * OVERTIME_MULTIPLIER
+    return np.column_stack([
+        base,
+        _ratio(overtime_pay, hourly_overtime),
+        _ratio(bonuses, base),
+        _ratio(deductions, base),
+        _ratio(net - department_median, department_median),
+    ])
+
+
+def fit_and_save(columns, path, contamination=0.1, n_neighbors=5):
+    """Fit the KNN detector on the full history, persist it and return the training scores.
+
+    pyod's KNN queries a ball tree, so fitting is O(n log n) rather than the
+    brute-force O(n^2). Runs in a worker process.
+    """
+    medians = department_medians(columns)
+    fallback_median = float(np.median(np.asarray(columns["net_salary"], dtype=np.float64)))
+    features = build_features(columns, medians, fallback_median)
+
+    mean = features.mean(axis=0)
+    scale = features.std(axis=0)
+    scale[scale == 0] = 1.0
+    scaled = (features - mean) / scale
+
+    detector = KNN(contamination=contamination, n_neighbors=min(n_neighbors, len(scaled) - 1))
+    detector.fit(scaled)
+
+    model = {
+        "detector": detector,
+        "mean": mean,
+        "scale": scale,
+        "medians": medians,
+        "fallback_median": fallback_median,
+        "threshold": float(detector.threshold_),
+        "n_samples": len(scaled),
+        "fitted_at": datetime.now(timezone.utc).isoformat(),
+    }
+    joblib.dump(model, path)
+    return explain_scores(model, scaled, detector.decision_scores_)
+
+
+def load_model(path):
+    return joblib.load(path)
+
+
+def explain_scores(model, scaled, scores):
+    """Package raw scores with the anomaly flag, department deviation and dominant feature."""
+    department_deviation = scaled[:, -1] * model["scale"][-1] + model["mean"][-1]
+    dominant = np.abs(scaled).argmax(axis=1)
+    return {
+        "anomaly_score": np.asarray(scores, dtype=np.float64).tolist(),
+        "is_anomaly": (np.asarray(scores) > model["threshold"]).tolist(),
+        "deviation_percent": (department_deviation * 100).tolist(),
+        "reason": [FEATURE_REASONS[FEATURES[i]] for i in dominant.tolist()],
+    }
+
+
+def score_records(model, columns):
+    """Score new records against a fitted model in batches, without refitting."""
+    features = build_features(columns, model["medians"], model["fallback_median"])
+    scaled = (features - model["mean"]) / model["scale"]
+    scores = np.concatenate([
+        model["detector"].decision_function(scaled[start:start + SCORE_BATCH_SIZE])
+        for start in range(0, len(scaled), SCORE_BATCH_SIZE)
+    ]) if len(scaled) else np.array([])
+    return explain_scores(model, scaled, scores)
+
+
+class DepartmentBaseline:
+    """Exponentially weighted per-department mean and variance of net salary.
+
+    Cheap enough (a dict lookup and a few float ops) to run inline for every
+    payroll record, including inside month-end batches. The spread is floored
+    at `min_relative_std` of the mean, so a department with uniform salaries
+    does not hold every record that moves by a cent.
+    """
+
+    def __init__(self, alpha=0.05, threshold=4.0, min_samples=10, min_relative_std=0.05):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.min_relative_std = min_relative_std
+        self.stats = {}
+
+    def seed(self, department, count, mean, std):
+        self.stats[department] = [count, mean, std ** 2]
+
+    def score(self, department, value):
+        """Return the z-score of `value` against the department, or None while the baseline is too thin."""
+        stats = self.stats.get(department)
+        if stats is None or stats[0] < self.min_samples:
+            return None
+        std = max(stats[2] ** 0.5, self.min_relative_std * abs(stats[1]))
+        if std == 0:
+            return 0.0 if value == stats[1] else float("inf")
+        return abs(value - stats[1]) / std
+
+    def update(self, department, value):
+        stats = self.stats.get(department)
+        if stats is None:
+            self.stats[department] = [1, value, 0.0]
+            return
+        # Plain running averages until there are enough samples for the decay to take over.
+        alpha = max(self.alpha, 1 / (stats[0] + 1))
+        diff = value - stats[1]
+        increment = alpha * diff
+        stats[0] += 1
+        stats[1] += increment
+        stats[2] = (1 - alpha) * (stats[2] + diff * increment)
+
+    def check(self, department, value):
+        """Score a new value and report whether to hold it; call update() once an accepted value is stored."""
+        z = self.score(department, value)
+        return z, z is not None and z > self.threshold
@@ -1,36 +1,54 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, DeleteOne, InsertOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DocumentTooLarge, DuplicateKeyError, OperationFailure
 import os
 import logging
 from bson import ObjectId
 from datetime import datetime
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, EmailStr, ValidationError
+from typing import Annotated, Any, Dict, List, Optional
 import uuid
+import time
 from datetime import datetime, timezone, timedelta
 import jwt
 import httpx
 import json
+import hashlib
+import base64
+import codecs
+import csv
+import io
 from passlib.context import CryptContext
+from cachetools import LRUCache, TTLCache
 from neo4j import AsyncGraphDatabase
-import pandas as pd
-import numpy as np
-from prophet import Prophet
-from pyod.models.knn import KNN
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import asyncio
+import collections
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+from payroll_engine import (
+    OVERTIME_DIVISOR, OVERTIME_MULTIPLIER, TAX_RATE,
+    calculate_payroll, compute_payroll_columns, simulate_payroll
+)
+from forecasting import fit_forecast, monthly_points, series_fingerprint
+from notifications import send_batch
+import anomaly
+from metrics import (
+    DEPENDENCY_LATENCY, REQUEST_LATENCY, MongoCommandTimer, RequestTimingMiddleware, record_span, render_gauges, span
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandTimer()])
 db = client[os.environ['DB_NAME']]
 
 neo4j_driver = AsyncGraphDatabase.driver(
@@ -117,6 +135,12 @@ class PayrollRecord(BaseModel):
     deductions: float
     tax: float
     net_salary: float
+    department: Optional[str] = None
+    anomaly_score: Optional[float] = None
+    is_anomaly: Optional[bool] = None
+    anomaly_deviation: Optional[float] = None
+    anomaly_reason: Optional[str] = None
+    review_score: Optional[float] = None
     status: str = "processed" 
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -127,15 +151,72 @@ class PayrollProcess(BaseModel):
     bonuses: float = 0.0
     deductions: float = 0.0
 
+class PayrollAdjustment(BaseModel):
+    bonuses: float = 0.0
+    deductions: float = 0.0
+
+class PayrollRun(BaseModel):
+    month: str
+    year: int
+    department: Optional[str] = None
+    adjustments: Dict[str, PayrollAdjustment] = Field(default_factory=dict)
+
+class PayrollSimulation(BaseModel):
+    month: str
+    year: int
+    department: Optional[str] = None
+    overtime_divisor: float = Field(OVERTIME_DIVISOR, gt=0)
+    overtime_multiplier: float = Field(OVERTIME_MULTIPLIER, ge=0)
+    tax_rate: float = Field(TAX_RATE, ge=0, le=1)
+    # Percent of base salary per department; a cut can't take a salary to zero or below.
+    department_raises: Dict[str, Annotated[float, Field(gt=-100, le=100)]] = Field(default_factory=dict)
+
+class PayrollRecompute(BaseModel):
+    limit: Optional[int] = Field(None, gt=0)
+
+class PayrollReview(BaseModel):
+    approve: bool
+    note: Optional[str] = None
+
+class UserRoleUpdate(BaseModel):
+    role: str
+
+class JobCreate(BaseModel):
+    type: str
+    params: Dict[str, Any] = Field(default_factory=dict)
+
 class ChatMessage(BaseModel):
     message: str
     session_id: str
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+# while capping how many ~200ms hashes compete for CPU during a login spike.
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", "4"))
+password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
+password_queue_stats = {"in_flight": 0, "max_in_flight": 0, "completed": 0}
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def run_password_task(fn, *args):
+    password_queue_stats["in_flight"] += 1
+    password_queue_stats["max_in_flight"] = max(password_queue_stats["max_in_flight"], password_queue_stats["in_flight"])
+    try:
+        with span("bcrypt", fn.__name__):
+            return await asyncio.get_running_loop().run_in_executor(password_executor, fn, *args)
+    finally:
+        password_queue_stats["in_flight"] -= 1
+        password_queue_stats["completed"] += 1
+
+def password_queue_depth():
+    """Hashes waiting for a free worker thread."""
+    return max(0, password_queue_stats["in_flight"] - PASSWORD_HASH_WORKERS)
+
+async def get_password_hash(password):
+    return await run_password_task(pwd_context.hash, password)
+
+async def verify_password(plain_password, hashed_password):
+    return await run_password_task(pwd_context.verify, plain_password, hashed_password)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -144,6 +225,18 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, JWT_SECRET, algorithm=JWT_ALGORITHM)
     return encoded_jwt
 
+# Authenticated principals by token subject. Each worker process keeps its own
+# cache, so the TTL bounds how long a change made through another worker can lag.
+user_cache = TTLCache(
+    maxsize=int(os.environ.get("USER_CACHE_SIZE", "10000")),
+    ttl=float(os.environ.get("USER_CACHE_TTL", "60"))
+)
+user_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+def invalidate_cached_user(email):
+    if user_cache.pop(email, None) is not None:
+        user_cache_stats["invalidations"] += 1
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
         token = credentials.credentials
@@ -151,10 +244,16 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         email = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"email": email}, {"_id": 0})
+        user = user_cache.get(email)
         if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
+            user_cache_stats["misses"] += 1
+            user = await db.users.find_one({"email": email}, {"_id": 0})
+            if user is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache[email] = user
+        else:
+            user_cache_stats["hits"] += 1
+        return dict(user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except:
@@ -166,70 +265,183 @@ def require_roles(*allowed_roles):
             raise HTTPException(status_code=403, detail=f"Access denied for role: {role}")
         return current_user
     return role_checker
-async def send_welcome_email(email: str, full_name: str, role: str, event_type: str):
-    try:
-        smtp_host = os.environ['SMTP_HOST']
-        smtp_port = int(os.environ['SMTP_PORT'])
-        smtp_email = os.environ['SMTP_EMAIL']
-        smtp_password = os.environ['SMTP_PASSWORD'].replace(' ', '')
-
-        now_utc = datetime.now(timezone.utc)
-        current_time_utc = now_utc.strftime("%B %d, %Y at %I:%M %p UTC")
-
-        ist_offset = timedelta(hours=5, minutes=30)
-        now_ist = now_utc + ist_offset
-        current_time_ist = now_ist.strftime("%B %d, %Y at %I:%M %p (IST)")
-
-        if event_type == "register":
-            subject = "Welcome to Intelligent Payroll System"
-            greeting = f"Welcome <strong>{role.title()}, {full_name}</strong>!"
-            main_text = (
-                "Your registration to the <strong>Intelligent Payroll Management System</strong> "
-                "was successful. You can now securely access your HR and payroll dashboard."
-            )
-        else: 
-            subject = "Login Notification — Intelligent Payroll System"
-            greeting = f"Hello <strong>{role.title()}, {full_name}</strong>,"
-            main_text = (
-                "You have successfully logged in to your account on the "
-                "<strong>Intelligent Payroll Management System</strong>."
-            )
+QUEUE_LEASE_SECONDS = 300
+QUEUE_POLL_SECONDS = 5
 
-        message = MIMEMultipart("alternative")
-        message["Subject"] = subject
-        message["From"] = smtp_email
-        message["To"] = email
-
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 10px;">
-                    <h2 style="color: #2563eb;">{subject}</h2>
-                    <p>{greeting}</p>
-                    <p>{main_text}</p>
-                    <p><strong>Login/Action Time:</strong><br>
-                       {current_time_ist}<br>
-                       {current_time_utc}</p>
-                    <p>If you did not perform this action, please contact your administrator immediately.</p>
-                    <br>
-                    <p>Best regards,<br>Payroll System Team</p>
-                </div>
-            </body>
-        </html>
-        """
+def queue_entry(**fields):
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        "id": str(uuid.uuid4()),
+        **fields,
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": now,
+        "created_at": now
+    }
 
-        part = MIMEText(html_content, "html")
-        message.attach(part)
+async def claim_due(collection, limit, ordered_by=None):
+    """Lease up to `limit` due queue entries, including ones left claimed by a crashed worker.
+
+    With `ordered_by` (a field naming what an entry writes to), entries are taken in
+    created_at order and an entry is skipped while an earlier one for the same key
+    is still backing off or leased elsewhere, so a retried write never lands after
+    a newer one.
+    """
+    now = datetime.now(timezone.utc)
+    due = {"$or": [
+        {"status": "pending", "next_attempt_at": {"$lte": now.isoformat()}},
+        {"status": "claimed", "claimed_at": {"$lt": (now - timedelta(seconds=QUEUE_LEASE_SECONDS)).isoformat()}}
+    ]}
+    if ordered_by is None:
+        candidates = await collection.find(due, {"_id": 0, "id": 1}).sort("next_attempt_at", ASCENDING).to_list(limit)
+    elif await collection.find_one(due, {"_id": 1}) is None:
+        return []
+    else:
+        candidates, blocked = [], set()
+        cursor = collection.find(
+            {"status": {"$in": ["pending", "claimed"]}},
+            {"_id": 0, "id": 1, ordered_by: 1, "status": 1, "next_attempt_at": 1, "claimed_at": 1}
+        ).sort([("created_at", ASCENDING), ("_id", ASCENDING)])
+        async for doc in cursor:
+            key = doc.get(ordered_by) or doc["id"]
+            if key in blocked:
+                continue
+            if is_due(doc, now):
+                candidates.append(doc)
+                if len(candidates) == limit:
+                    break
+            else:
+                blocked.add(key)
+    if not candidates:
+        return []
+
+    claim_id = str(uuid.uuid4())
+    await collection.update_many(
+        {"$and": [due, {"id": {"$in": [doc["id"] for doc in candidates]}}]},
+        {"$set": {"status": "claimed", "claim_id": claim_id, "claimed_at": now.isoformat()}}
+    )
+    batch = await collection.find({"claim_id": claim_id, "status": "claimed"}, {"_id": 0}).sort(
+        [("created_at", ASCENDING), ("_id", ASCENDING)]
+    ).to_list(limit)
+    if ordered_by is not None:
+        # Another worker may have leased an earlier entry in between: hand back anything queued behind it.
+        claimed = {doc["id"] for doc in batch}
+        blocked = set()
+        for doc in candidates:
+            if doc["id"] not in claimed:
+                blocked.add(doc.get(ordered_by) or doc["id"])
+        released = [doc["id"] for doc in batch if (doc.get(ordered_by) or doc["id"]) in blocked]
+        if released:
+            await collection.update_many(
+                {"id": {"$in": released}, "claim_id": claim_id},
+                {"$set": {"status": "pending"}, "$unset": {"claim_id": "", "claimed_at": ""}}
+            )
+            batch = [doc for doc in batch if doc["id"] not in released]
+    return batch
+
+def is_due(doc, now):
+    if doc["status"] == "pending":
+        return doc["next_attempt_at"] <= now.isoformat()
+    return doc.get("claimed_at", "") < (now - timedelta(seconds=QUEUE_LEASE_SECONDS)).isoformat()
+
+def retry_operation(doc, error, retry_seconds, max_attempts):
+    """Schedule a failed entry again with exponential backoff, or park it as failed."""
+    attempts = doc["attempts"] + 1
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=retry_seconds * 2 ** (attempts - 1))
+    return UpdateOne({"id": doc["id"]}, {
+        "$set": {
+            "status": "failed" if attempts >= max_attempts else "pending",
+            "attempts": attempts,
+            "last_error": error,
+            "next_attempt_at": retry_at.isoformat()
+        },
+        "$unset": {"claim_id": ""}
+    })
 
-        with smtplib.SMTP(smtp_host, smtp_port) as server:
-            server.starttls()
-            server.login(smtp_email, smtp_password)
-            server.sendmail(smtp_email, email, message.as_string())
+async def run_queue_worker(name, wakeup, drain):
+    """Call `drain` until it reports an empty queue, then sleep until woken or the poll interval passes."""
+    while True:
+        wakeup.clear()
+        try:
+            if await drain():
+                continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"{name} worker error: {str(e)}")
+
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=QUEUE_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+async def queue_stats(collection):
+    counts = await collection.aggregate([
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(None)
+    failed = await collection.find(
+        {"status": "failed"}, {"_id": 0, "claim_id": 0, "claimed_at": 0}
+    ).sort("next_attempt_at", DESCENDING).to_list(20)
+    oldest = await collection.find_one({"status": "pending"}, {"_id": 0, "created_at": 1}, sort=[("created_at", ASCENDING)])
+    return {
+        "counts": {row["_id"]: row["count"] for row in counts},
+        "oldest_pending_at": oldest["created_at"] if oldest else None,
+        "recent_failures": failed
+    }
 
-        logging.info(f"Email ({event_type}) sent to {email}")
+NOTIFICATION_BATCH_SIZE = int(os.environ.get("NOTIFICATION_BATCH_SIZE", "50"))
+NOTIFICATION_MAX_ATTEMPTS = int(os.environ.get("NOTIFICATION_MAX_ATTEMPTS", "5"))
+NOTIFICATION_RETRY_SECONDS = 30
+notification_wakeup = asyncio.Event()
+notification_state = {"worker": None}
 
-    except Exception as e:
-        logging.error(f"Error sending {event_type} email: {str(e)}")
+def smtp_settings():
+    return {
+        "host": os.environ.get('SMTP_HOST'),
+        "port": int(os.environ.get('SMTP_PORT', '587')),
+        "email": os.environ.get('SMTP_EMAIL', ''),
+        "password": os.environ.get('SMTP_PASSWORD', '').replace(' ', ''),
+        "use_tls": os.environ.get('SMTP_USE_TLS', 'true').lower() != 'false',
+    }
+
+async def enqueue_notification(email: str, full_name: str, role: str, event_type: str):
+    """Persist an email event; the notification worker delivers it off the request path."""
+    await db.notifications.insert_one(queue_entry(type=event_type, email=email, full_name=full_name, role=role))
+    notification_wakeup.set()
+
+async def deliver_notifications(settings):
+    batch = await claim_due(db.notifications, NOTIFICATION_BATCH_SIZE)
+    if not batch:
+        return False
+    for doc in batch:
+        doc["created_at_dt"] = datetime.fromisoformat(doc["created_at"])
+    with span("smtp", "send_batch"):
+        results = await asyncio.to_thread(send_batch, settings, batch)
+
+    sent_at = datetime.now(timezone.utc).isoformat()
+    operations = []
+    for doc in batch:
+        error = results.get(doc["id"], "not attempted")
+        if error is None:
+            operations.append(UpdateOne({"id": doc["id"]}, {
+                "$set": {"status": "sent", "sent_at": sent_at},
+                "$inc": {"attempts": 1},
+                "$unset": {"claim_id": "", "last_error": ""}
+            }))
+        else:
+            operations.append(retry_operation(doc, error, NOTIFICATION_RETRY_SECONDS, NOTIFICATION_MAX_ATTEMPTS))
+            logging.error(f"Error sending {doc['type']} email to {doc['email']} (attempt {doc['attempts'] + 1}): {error}")
+    await db.notifications.bulk_write(operations, ordered=False)
+    return True
+
+def start_notification_worker():
+    if not os.environ.get('SMTP_HOST'):
+        logging.warning("SMTP_HOST is not set; notifications will queue without being sent")
+        return
+    settings = smtp_settings()
+    notification_state["worker"] = asyncio.create_task(
+        run_queue_worker("Notification", notification_wakeup, lambda: deliver_notifications(settings))
+    )
 
 @api_router.post("/auth/register")
 async def register(user_data: UserRegister):
@@ -238,7 +450,7 @@ async def register(user_data: UserRegister):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     user_id = str(uuid.uuid4())
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash(user_data.password)
     
     user_dict = {
         "id": user_id,
@@ -250,10 +462,10 @@ async def register(user_data: UserRegister):
     }
     
     await db.users.insert_one(user_dict)
+    invalidate_cached_user(user_data.email)
     
     token = create_access_token({"sub": user_data.email, "role": user_data.role})
-    asyncio.create_task(send_welcome_email(user_data.email, user_data.full_name, user_data.role, "register"))
-
+    await enqueue_notification(user_data.email, user_data.full_name, user_data.role, "register")
     
     return {
         "token": token,
@@ -268,12 +480,12 @@ async def register(user_data: UserRegister):
 @api_router.post("/auth/login")
 async def login(user_data: UserLogin):
     user = await db.users.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user["password"]):
+    if not user or not await verify_password(user_data.password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_access_token({"sub": user_data.email, "role": user["role"]})
     
-    asyncio.create_task(send_welcome_email(user["email"], user["full_name"], user["role"], "login"))
+    await enqueue_notification(user["email"], user["full_name"], user["role"], "login")
     
     return {
         "token": token,
@@ -288,32 +500,659 @@ async def login(user_data: UserLogin):
 @api_router.get("/auth/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
     return current_user
+
+@api_router.put("/admin/users/{email}/role")
+async def update_user_role(email: str, role_data: UserRoleUpdate, current_user: dict = Depends(require_roles("admin"))):
+    if role_data.role not in ["admin", "hr", "employee"]:
+        raise HTTPException(status_code=400, detail="Role must be admin, hr or employee")
+    result = await db.users.update_one({"email": email}, {"$set": {"role": role_data.role}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    invalidate_cached_user(email)
+    return {"email": email, "role": role_data.role}
+
+@api_router.get("/admin/password-hashing")
+async def get_password_hashing_stats(current_user: dict = Depends(require_roles("admin"))):
+    return {
+        **password_queue_stats,
+        "queue_depth": password_queue_depth(),
+        "concurrency": PASSWORD_HASH_WORKERS
+    }
+
+@api_router.get("/admin/notifications")
+async def get_notification_stats(current_user: dict = Depends(require_roles("admin"))):
+    worker = notification_state["worker"]
+    return {
+        **await queue_stats(db.notifications),
+        "worker_running": worker is not None and not worker.done()
+    }
+
+@api_router.get("/admin/auth-cache")
+async def get_auth_cache_stats(current_user: dict = Depends(require_roles("admin"))):
+    lookups = user_cache_stats["hits"] + user_cache_stats["misses"]
+    return {
+        **user_cache_stats,
+        "hit_ratio": round(user_cache_stats["hits"] / lookups, 4) if lookups else None,
+        "size": len(user_cache),
+        "maxsize": user_cache.maxsize,
+        "ttl": user_cache.ttl
+    }
 def serialize_doc(doc):
     doc["_id"] = str(doc["_id"])
     if "user_id" in doc:
         doc["user_id"] = str(doc["user_id"])
     return doc
 
-@api_router.get("/chatbot/history")
-async def get_chat_history(current_user: dict = Depends(get_current_user)):
+PAGE_SIZE_LIMIT = 1000
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, sort_keys):
     try:
-        user_id = current_user.get("_id") or current_user.get("id")
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort_keys):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(sort_keys, values, op="$gt"):
+    """Match documents strictly after `values` in (k1, k2, ...) order; op="$lt" walks descending."""
+    clauses = []
+    for i, key in enumerate(sort_keys):
+        clause = {sort_keys[j]: values[j] for j in range(i)}
+        clause[key] = {op: values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+def parse_projection(fields, model, sort_keys):
+    if not fields:
+        return {"_id": 0}
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in model.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    projection = {"_id": 0}
+    for field in list(requested) + list(sort_keys):
+        projection[field] = 1
+    return projection
+
+def payroll_period_filter(period_from=None, period_to=None):
+    """Build a (year, month) range filter from inclusive YYYY-MM bounds."""
+    clauses = []
+    for period, op in ((period_from, "$gt"), (period_to, "$lt")):
+        if not period:
+            continue
+        try:
+            year, month = period.split("-")
+            year, month = int(year), f"{int(month):02d}"
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid period '{period}', expected YYYY-MM")
+        clauses.append({"$or": [
+            {"year": {op: year}},
+            {"year": year, "month": {op + "e": month}}
+        ]})
+    return clauses
+
+async def fetch_page(collection, query, sort_keys, limit, cursor, projection):
+    """Keyset-paginate `query`, returning a JSON list and the next cursor in X-Next-Cursor."""
+    if cursor:
+        after = keyset_filter(sort_keys, decode_cursor(cursor, sort_keys))
+        query = {"$and": [query, after]} if query else after
+
+    docs = await collection.find(query, projection).sort(
+        [(key, 1) for key in sort_keys]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    headers = {}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers["X-Next-Cursor"] = encode_cursor([docs[-1].get(key) for key in sort_keys])
+    return JSONResponse(content=jsonable_encoder(docs), headers=headers)
+
+def department_stages():
+    """Resolve each payroll record's department, falling back to the employee record for older rows."""
+    return [
+        {"$lookup": {
+            "from": "employees",
+            "localField": "employee_id",
+            "foreignField": "employee_id",
+            "as": "employee"
+        }},
+        {"$addFields": {"department": {"$ifNull": [
+            "$department",
+            {"$ifNull": [{"$arrayElemAt": ["$employee.department", 0]}, "Unknown"]}
+        ]}}},
+        {"$project": {"employee": 0}}
+    ]
+
+def payroll_aggregate_key(year, month, department):
+    return f"payroll:{year}:{month}:{department}"
+
+class AggregateGate:
+    """Keeps aggregate $inc writers and rebuild_payroll_aggregates apart within this process.
+
+    Writers share the gate; a rebuild waits for the writers in flight and holds new
+    ones off until its snapshot is swapped in, so no increment lands in the
+    collection the swap is about to replace.
+    """
+
+    def __init__(self):
+        self.writers = 0
+        self.rebuilding = False
+        self.changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.rebuilding)
+            self.writers += 1
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.writers -= 1
+                self.changed.notify_all()
+
+    @asynccontextmanager
+    async def rebuild(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.rebuilding)
+            self.rebuilding = True
+            await self.changed.wait_for(lambda: self.writers == 0)
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.rebuilding = False
+                self.changed.notify_all()
+
+aggregate_gate = AggregateGate()
+
+async def apply_payroll_aggregates(payroll_docs, sign=1):
+    """Fold processed payroll records into the per-month, per-department totals."""
+    increments = {}
+    for doc in payroll_docs:
+        department = doc.get("department") or "Unknown"
+        key = payroll_aggregate_key(doc["year"], doc["month"], department)
+        if key not in increments:
+            increments[key] = {
+                "fields": {"year": doc["year"], "month": doc["month"], "department": department},
+                "net_salary": 0, "overtime_pay": 0, "record_count": 0
+            }
+        increments[key]["net_salary"] += sign * doc["net_salary"]
+        increments[key]["overtime_pay"] += sign * doc["overtime_pay"]
+        increments[key]["record_count"] += sign
+    if not increments:
+        return
+
+    operations = [
+        UpdateOne(
+            {"_id": key},
+            {
+                "$inc": {field: values[field] for field in ("net_salary", "overtime_pay", "record_count")},
+                "$setOnInsert": {"kind": "payroll", **values["fields"]}
+            },
+            upsert=True
+        )
+        for key, values in increments.items()
+    ]
+    operations.append(UpdateOne(
+        {"_id": "totals"},
+        {"$inc": {"payroll_records": sign * len(payroll_docs)}, "$setOnInsert": {"kind": "totals"}},
+        upsert=True
+    ))
+    await db.payroll_aggregates.bulk_write(operations, ordered=False)
+
+async def apply_headcount_change(department, delta):
+    await db.payroll_aggregates.update_one(
+        {"_id": f"headcount:{department or 'Unknown'}"},
+        {"$inc": {"active_employees": delta}, "$setOnInsert": {"kind": "headcount", "department": department or "Unknown"}},
+        upsert=True
+    )
 
-        if isinstance(user_id, str) and len(user_id) == 24:
-            try:
-                user_id = ObjectId(user_id)
-            except Exception:
-                pass
+async def rebuild_payroll_aggregates():
+    """Recompute payroll_aggregates from payroll_records and employees, then swap it in.
+
+    Records whose aggregates step is still pending are left out: their writer
+    applies the increment once the gate reopens, on top of the new snapshot.
+    """
+    async with aggregate_gate.rebuild():
+        return await build_payroll_aggregates()
+
+async def build_payroll_aggregates():
+    docs = []
+    payroll_groups = db.payroll_records.aggregate([
+        {"$match": {"$and": [SETTLED_PAYROLL, {"pending_side_effects": {"$ne": "aggregates"}}]}}
+    ] + department_stages() + [
+        {"$group": {
+            "_id": {"year": "$year", "month": "$month", "department": "$department"},
+            "net_salary": {"$sum": "$net_salary"},
+            "overtime_pay": {"$sum": "$overtime_pay"},
+            "record_count": {"$sum": 1}
+        }}
+    ])
+    payroll_records = 0
+    async for group in payroll_groups:
+        key = group["_id"]
+        payroll_records += group["record_count"]
+        docs.append({
+            "_id": payroll_aggregate_key(key["year"], key["month"], key["department"]),
+            "kind": "payroll",
+            **key,
+            "net_salary": group["net_salary"],
+            "overtime_pay": group["overtime_pay"],
+            "record_count": group["record_count"]
+        })
 
-        chats = await db.chat_history.find({"user_id": user_id}).sort("timestamp", 1).to_list(None)
+    headcounts = db.employees.aggregate([
+        {"$match": {"status": "active"}},
+        {"$group": {"_id": {"$ifNull": ["$department", "Unknown"]}, "active_employees": {"$sum": 1}}}
+    ])
+    async for group in headcounts:
+        docs.append({
+            "_id": f"headcount:{group['_id']}",
+            "kind": "headcount",
+            "department": group["_id"],
+            "active_employees": group["active_employees"]
+        })
+    docs.append({"_id": "totals", "kind": "totals", "payroll_records": payroll_records})
+
+    staging = db["payroll_aggregates_rebuild"]
+    await staging.drop()
+    await staging.insert_many(docs)
+    await staging.rename("payroll_aggregates", dropTarget=True)
+    return {"aggregates": len(docs), "payroll_records": payroll_records}
+
+@api_router.post("/admin/aggregates/rebuild")
+async def rebuild_aggregates(background: bool = False, current_user: dict = Depends(require_roles("admin"))):
+    if background:
+        return job_accepted(await submit_job("aggregates_rebuild", {}, current_user))
+    return await rebuild_payroll_aggregates()
+
+GRAPH_SYNC_BATCH_SIZE = int(os.environ.get("GRAPH_SYNC_BATCH_SIZE", "500"))
+GRAPH_SYNC_MAX_ATTEMPTS = int(os.environ.get("GRAPH_SYNC_MAX_ATTEMPTS", "10"))
+GRAPH_SYNC_RETRY_SECONDS = 15
+GRAPH_WRITES = {
+    "employee_upsert": """
+        UNWIND $rows AS row
+        MERGE (e:Employee {id: row.employee_id})
+        SET e.name = row.name,
+            e.department = row.department,
+            e.designation = row.designation
+    """,
+    "payroll_upsert": """
+        UNWIND $rows AS row
+        MERGE (e:Employee {id: row.employee_id})
+        MERGE (p:Payroll {employee_id: row.employee_id, month: row.month, year: row.year})
+        SET p.net_salary = row.net_salary,
+            p.base_salary = row.base_salary,
+            p.bonuses = row.bonuses,
+            p.deductions = row.deductions,
+            p.tax = row.tax
+        MERGE (e)-[:HAS_PAYROLL]->(p)
+    """,
+    "employee_delete": """
+        UNWIND $rows AS row
+        MATCH (e:Employee {id: row.employee_id})
+        OPTIONAL MATCH (e)-[:HAS_PAYROLL]->(p:Payroll)
+        DETACH DELETE e, p
+    """,
+    "employee_dedupe": """
+        UNWIND $rows AS row
+        MATCH (e:Employee {id: row.employee_id})
+        WITH row, collect(e) AS nodes
+        WHERE size(nodes) > 1
+        UNWIND nodes[1..] AS duplicate
+        DETACH DELETE duplicate
+    """,
+    "payroll_delete": """
+        UNWIND $rows AS row
+        MATCH (p:Payroll {employee_id: row.employee_id, month: row.month, year: row.year})
+        DETACH DELETE p
+    """,
+}
+GRAPH_EMPLOYEE_FIELDS = ("employee_id", "name", "department", "designation")
+GRAPH_PAYROLL_FIELDS = ("employee_id", "month", "year", "net_salary", "base_salary", "bonuses", "deductions", "tax")
+graph_sync_wakeup = asyncio.Event()
+graph_sync_state = {"worker": None, "flushed": 0, "batches": 0}
+
+async def enqueue_graph_writes(kind, rows):
+    """Record graph mutations in the outbox; the graph sync worker applies them in UNWIND batches."""
+    if not rows:
+        return
+    await db.graph_outbox.insert_many(
+        [queue_entry(kind=kind, row=row, node=row["employee_id"]) for row in rows], ordered=False
+    )
+    graph_sync_wakeup.set()
+
+async def run_graph_write(tx, statement, rows):
+    result = await tx.run(statement, rows=rows)
+    await result.consume()
+
+async def flush_graph_outbox():
+    # Every graph write is keyed by employee, so writes for one employee apply strictly in outbox order.
+    batch = await claim_due(db.graph_outbox, GRAPH_SYNC_BATCH_SIZE, ordered_by="node")
+    if not batch:
+        return False
+
+    # Apply consecutive runs of the same kind as one UNWIND each, in outbox order, so a later
+    # mutation of the same node still lands after an earlier one.
+    groups = []
+    for entry in batch:
+        if groups and groups[-1][0] == entry["kind"]:
+            groups[-1][1].append(entry)
+        else:
+            groups.append((entry["kind"], [entry]))
+
+    applied, error = [], None
+    try:
+        async with neo4j_driver.session() as session:
+            for kind, entries in groups:
+                with span("neo4j", kind):
+                    await session.execute_write(run_graph_write, GRAPH_WRITES[kind], [entry["row"] for entry in entries])
+                applied.extend(entries)
+    except Exception as e:
+        error = str(e)
+        logging.error(f"Graph sync batch failed after {len(applied)}/{len(batch)} entries: {error}")
+
+    if applied:
+        await db.graph_outbox.delete_many({"id": {"$in": [entry["id"] for entry in applied]}})
+        graph_sync_state["flushed"] += len(applied)
+        graph_sync_state["batches"] += 1
+    remaining = batch[len(applied):]
+    if remaining:
+        await db.graph_outbox.bulk_write(
+            [retry_operation(entry, error, GRAPH_SYNC_RETRY_SECONDS, GRAPH_SYNC_MAX_ATTEMPTS) for entry in remaining],
+            ordered=False
+        )
+        return False
+    return True
 
-        chats = [serialize_doc(chat) for chat in chats]
+def start_graph_sync_worker():
+    graph_sync_state["worker"] = asyncio.create_task(
+        run_queue_worker("Graph sync", graph_sync_wakeup, flush_graph_outbox)
+    )
 
-        return chats
+@api_router.get("/admin/graph-sync")
+async def get_graph_sync_stats(current_user: dict = Depends(require_roles("admin"))):
+    worker = graph_sync_state["worker"]
+    return {
+        **await queue_stats(db.graph_outbox),
+        "flushed": graph_sync_state["flushed"],
+        "batches": graph_sync_state["batches"],
+        "worker_running": worker is not None and not worker.done()
+    }
 
+RECONCILE_CHUNK_SIZE = int(os.environ.get("RECONCILE_CHUNK_SIZE", "1000"))
+GRAPH_SCHEMA = [
+    "CREATE INDEX employee_id IF NOT EXISTS FOR (e:Employee) ON (e.id)",
+    "CREATE INDEX payroll_key IF NOT EXISTS FOR (p:Payroll) ON (p.employee_id, p.year, p.month)",
+]
+# Expects `id` bound to the employee ids to report; collects each id's nodes, duplicates included.
+GRAPH_EMPLOYEE_RETURN = """
+    MATCH (e:Employee {id: id})
+    WITH id AS employee_id, collect(e) AS nodes
+    ORDER BY employee_id
+    RETURN employee_id, size(nodes) AS copies, nodes[0].name AS name,
+           nodes[0].department AS department, nodes[0].designation AS designation
+"""
+GRAPH_PAYROLL_RETURN = """
+    OPTIONAL MATCH (e:Employee {id: p.employee_id})-[:HAS_PAYROLL]->(p)
+    WITH p, count(e) > 0 AS linked
+    ORDER BY p.employee_id, p.year, p.month
+    RETURN p.employee_id AS employee_id, p.year AS year, p.month AS month, p.net_salary AS net_salary,
+           p.base_salary AS base_salary, p.bonuses AS bonuses, p.deductions AS deductions, p.tax AS tax, linked
+"""
+GRAPH_READS = {
+    # The page of ids is cut on the employee_id index before any nodes are collected.
+    "employees": """
+        MATCH (e:Employee) WHERE e.id > $after
+        WITH DISTINCT e.id AS id ORDER BY id LIMIT $limit
+    """ + GRAPH_EMPLOYEE_RETURN,
+    "employees_by_id": "UNWIND $ids AS id" + GRAPH_EMPLOYEE_RETURN,
+    "payroll": """
+        MATCH (p:Payroll)
+        WHERE p.employee_id > $employee_id
+           OR (p.employee_id = $employee_id AND (p.year > $year OR (p.year = $year AND p.month > $month)))
+        WITH p ORDER BY p.employee_id, p.year, p.month LIMIT $limit
+    """ + GRAPH_PAYROLL_RETURN,
+    "payroll_by_key": """
+        UNWIND $keys AS key
+        MATCH (p:Payroll {employee_id: key.employee_id, month: key.month, year: key.year})
+    """ + GRAPH_PAYROLL_RETURN,
+    "legacy_payroll": "MATCH (p:Payroll) WHERE p.employee_id IS NULL RETURN count(p) AS count",
+}
+GRAPH_LEGACY_PAYROLL_DELETE = "MATCH (p:Payroll) WHERE p.employee_id IS NULL DETACH DELETE p"
+
+async def ensure_graph_schema():
+    try:
+        async with neo4j_driver.session() as session:
+            for statement in GRAPH_SCHEMA:
+                await session.run(statement)
     except Exception as e:
-        logging.error(f"Error fetching chat history: {e}")
-        raise HTTPException(status_code=500, detail="Error retrieving chat history")
+        logging.error(f"Could not create Neo4j indexes: {str(e)}")
+
+async def run_graph_read(tx, statement, params):
+    result = await tx.run(statement, **params)
+    return await result.data()
+
+async def read_graph(session, name, **params):
+    with span("neo4j", name):
+        return await session.execute_read(run_graph_read, GRAPH_READS[name], params)
+
+def payroll_graph_key(row):
+    return (row["employee_id"], row["year"], row["month"])
+
+async def stream_graph_employees(session):
+    after = ""
+    while True:
+        rows = await read_graph(session, "employees", after=after, limit=RECONCILE_CHUNK_SIZE)
+        for row in rows:
+            yield row
+        if len(rows) < RECONCILE_CHUNK_SIZE:
+            return
+        after = rows[-1]["employee_id"]
+
+async def stream_graph_payroll(session):
+    employee_id, year, month = "", 0, ""
+    while True:
+        rows = await read_graph(
+            session, "payroll", employee_id=employee_id, year=year, month=month, limit=RECONCILE_CHUNK_SIZE
+        )
+        for row in rows:
+            yield row
+        if len(rows) < RECONCILE_CHUNK_SIZE:
+            return
+        employee_id, year, month = payroll_graph_key(rows[-1])
+
+async def merge_join(left, right, key):
+    """Walk two async streams sorted by `key` and yield (left_row, right_row) pairs, None on the missing side."""
+    left_row = await anext(left, None)
+    right_row = await anext(right, None)
+    while left_row is not None or right_row is not None:
+        if right_row is None or (left_row is not None and key(left_row) < key(right_row)):
+            yield left_row, None
+            left_row = await anext(left, None)
+        elif left_row is None or key(right_row) < key(left_row):
+            yield None, right_row
+            right_row = await anext(right, None)
+        else:
+            yield left_row, right_row
+            left_row = await anext(left, None)
+            right_row = await anext(right, None)
+
+def graph_row_differs(expected, actual, fields):
+    for field in fields:
+        value, graph_value = expected.get(field), actual.get(field)
+        if isinstance(value, (int, float)) and isinstance(graph_value, (int, float)):
+            if abs(value - graph_value) > 0.005:
+                return True
+        elif value != graph_value:
+            return True
+    return False
+
+class GraphCorrections:
+    """Buffers reconciliation fixes per kind and applies them in UNWIND batches."""
+
+    def __init__(self, session, dry_run):
+        self.session = session
+        self.dry_run = dry_run
+        self.pending = {}
+        self.applied = 0
+
+    async def add(self, kind, row):
+        rows = self.pending.setdefault(kind, [])
+        rows.append(row)
+        if len(rows) >= RECONCILE_CHUNK_SIZE:
+            await self.flush(kind)
+
+    async def flush(self, kind=None):
+        for name in ([kind] if kind else list(self.pending)):
+            rows = self.pending.pop(name, [])
+            if rows and not self.dry_run:
+                with span("neo4j", name):
+                    await self.session.execute_write(run_graph_write, GRAPH_WRITES[name], rows)
+                self.applied += len(rows)
+
+async def reconcile_employee(corrections, report, expected, actual):
+    report["checked"] += 1
+    if actual is None:
+        report["missing"] += 1
+        await corrections.add("employee_upsert", expected)
+        return
+    if expected is None:
+        report["extra"] += 1
+        await corrections.add("employee_delete", {"employee_id": actual["employee_id"]})
+        return
+    if actual["copies"] > 1:
+        report["duplicates"] += actual["copies"] - 1
+        await corrections.add("employee_dedupe", {"employee_id": expected["employee_id"]})
+    if graph_row_differs(expected, actual, GRAPH_EMPLOYEE_FIELDS):
+        report["changed"] += 1
+        await corrections.add("employee_upsert", expected)
+
+async def reconcile_payroll(corrections, report, expected, actual):
+    report["checked"] += 1
+    if actual is None:
+        report["missing"] += 1
+        await corrections.add("payroll_upsert", expected)
+    elif expected is None:
+        report["extra"] += 1
+        await corrections.add("payroll_delete", {key: actual[key] for key in ("employee_id", "month", "year")})
+    elif not actual["linked"] or graph_row_differs(expected, actual, GRAPH_PAYROLL_FIELDS):
+        report["changed"] += 1
+        await corrections.add("payroll_upsert", expected)
+
+async def iter_chunks(cursor, size):
+    chunk = []
+    async for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+async def with_known_employees(payroll_docs):
+    """Drop payroll of deleted employees: it stays in Mongo but leaves the graph with the employee."""
+    employee_ids = list({doc["employee_id"] for doc in payroll_docs})
+    known = set(await db.employees.distinct("employee_id", {"employee_id": {"$in": employee_ids}}))
+    return [doc for doc in payroll_docs if doc["employee_id"] in known]
+
+async def reconcile_graph(full=False, dry_run=False):
+    """Diff Neo4j against Mongo by employee_id and payroll (employee, month, year) and fix the drift.
+
+    Incremental runs only look at employees and payroll records written since the
+    last run's watermark; deletions reach the graph through the outbox, so only a
+    full run hunts for extra or duplicate nodes.
+    """
+    started_at = datetime.now(timezone.utc).isoformat()
+    state = await db.sync_state.find_one({"_id": "graph_reconcile"}) or {}
+    watermark = None if full else state.get("watermark")
+    employee_report = {"checked": 0, "missing": 0, "extra": 0, "changed": 0, "duplicates": 0}
+    payroll_report = {"checked": 0, "missing": 0, "extra": 0, "changed": 0, "legacy": 0}
+    employee_projection = {"_id": 0, **{field: 1 for field in GRAPH_EMPLOYEE_FIELDS}}
+    payroll_projection = {"_id": 0, **{field: 1 for field in GRAPH_PAYROLL_FIELDS}}
+    payroll_sort = [("employee_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)]
+
+    async with neo4j_driver.session() as session:
+        corrections = GraphCorrections(session, dry_run)
+        if watermark is None:
+            cursor = db.employees.find({}, employee_projection).sort("employee_id", ASCENDING).batch_size(RECONCILE_CHUNK_SIZE)
+            async for expected, actual in merge_join(cursor, stream_graph_employees(session), lambda row: row["employee_id"]):
+                await reconcile_employee(corrections, employee_report, expected, actual)
+            await corrections.flush()
+
+            async def mongo_payroll():
+                cursor = db.payroll_records.find(SETTLED_PAYROLL, payroll_projection).sort(payroll_sort).batch_size(RECONCILE_CHUNK_SIZE)
+                async for chunk in iter_chunks(cursor, RECONCILE_CHUNK_SIZE):
+                    for doc in await with_known_employees(chunk):
+                        yield doc
+
+            async for expected, actual in merge_join(mongo_payroll(), stream_graph_payroll(session), payroll_graph_key):
+                await reconcile_payroll(corrections, payroll_report, expected, actual)
+
+            legacy = await read_graph(session, "legacy_payroll")
+            payroll_report["legacy"] = legacy[0]["count"] if legacy else 0
+            if payroll_report["legacy"] and not dry_run:
+                await session.execute_write(run_graph_write, GRAPH_LEGACY_PAYROLL_DELETE, [])
+        else:
+            changed_since = {"$or": [
+                {"updated_at": {"$gte": watermark}},
+                {"updated_at": {"$exists": False}, "created_at": {"$gte": watermark}}
+            ]}
+            cursor = db.employees.find(changed_since, employee_projection).batch_size(RECONCILE_CHUNK_SIZE)
+            async for chunk in iter_chunks(cursor, RECONCILE_CHUNK_SIZE):
+                graph_rows = await read_graph(session, "employees_by_id", ids=[doc["employee_id"] for doc in chunk])
+                by_id = {row["employee_id"]: row for row in graph_rows}
+                for doc in chunk:
+                    await reconcile_employee(corrections, employee_report, doc, by_id.get(doc["employee_id"]))
+            await corrections.flush()
+
+            cursor = db.payroll_records.find(
+                {"$and": [changed_since, SETTLED_PAYROLL]}, payroll_projection
+            ).batch_size(RECONCILE_CHUNK_SIZE)
+            async for chunk in iter_chunks(cursor, RECONCILE_CHUNK_SIZE):
+                chunk = await with_known_employees(chunk)
+                graph_rows = await read_graph(
+                    session, "payroll_by_key",
+                    keys=[{key: doc[key] for key in ("employee_id", "month", "year")} for doc in chunk]
+                )
+                by_key = {payroll_graph_key(row): row for row in graph_rows}
+                for doc in chunk:
+                    await reconcile_payroll(corrections, payroll_report, doc, by_key.get(payroll_graph_key(doc)))
+        await corrections.flush()
+
+    report = {
+        "mode": "incremental" if watermark else "full",
+        "dry_run": dry_run,
+        "since": watermark,
+        "employees": employee_report,
+        "payroll": payroll_report,
+        "corrections_applied": corrections.applied,
+        "started_at": started_at,
+        "finished_at": datetime.now(timezone.utc).isoformat()
+    }
+    if not dry_run:
+        await db.sync_state.update_one(
+            {"_id": "graph_reconcile"},
+            {"$set": {"watermark": started_at, "last_report": report}},
+            upsert=True
+        )
+    return report
+
+@api_router.post("/admin/graph/reconcile")
+async def reconcile_graph_endpoint(
+    full: bool = False,
+    dry_run: bool = False,
+    background: bool = False,
+    current_user: dict = Depends(require_roles("admin"))
+):
+    if background:
+        return job_accepted(await submit_job("graph_reconcile", {"full": full, "dry_run": dry_run}, current_user))
+    return await reconcile_graph(full=full, dry_run=dry_run)
 
 @api_router.post("/employees", response_model=Employee)
 async def create_employee(
@@ -327,33 +1166,32 @@ async def create_employee(
     employee = Employee(**employee_data.model_dump())
     doc = employee.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
+    doc["updated_at"] = doc["created_at"]
 
-    await db.employees.insert_one(doc)
-    async with neo4j_driver.session() as session:
-        await session.run(
-            """
-            CREATE (e:Employee {
-                id: $id,
-                name: $name,
-                department: $department,
-                designation: $designation
-            })
-            """,
-            id=employee.employee_id,  
-            name=employee.name,
-            department=employee.department,
-            designation=employee.designation
-        )
+    async with aggregate_gate.write():
+        await db.employees.insert_one(doc)
+        await apply_headcount_change(employee.department, 1)
+    await enqueue_graph_writes("employee_upsert", [{key: doc[key] for key in GRAPH_EMPLOYEE_FIELDS}])
     return employee
 
 
 @api_router.get("/employees", response_model=List[Employee])
-async def get_employees(current_user: dict = Depends(get_current_user)):
-    employees = await db.employees.find({}, {"_id": 0}).to_list(1000)
-    for emp in employees:
-        if isinstance(emp['created_at'], str):
-            emp['created_at'] = datetime.fromisoformat(emp['created_at'])
-    return employees
+async def get_employees(
+    department: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_LIMIT, ge=1, le=PAGE_SIZE_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    query = {}
+    if department:
+        query["department"] = department
+    if status:
+        query["status"] = status
+    sort_keys = ["employee_id", "id"]
+    projection = parse_projection(fields, Employee, sort_keys)
+    return await fetch_page(db.employees, query, sort_keys, limit, cursor, projection)
 
 @api_router.get("/employees/{employee_id}", response_model=Employee)
 async def get_employee(employee_id: str, current_user: dict = Depends(get_current_user)):
@@ -374,7 +1212,15 @@ async def update_employee(employee_id: str, employee_data: EmployeeCreate, curre
         raise HTTPException(status_code=404, detail="Employee not found")
     
     update_data = employee_data.model_dump()
-    await db.employees.update_one({"employee_id": employee_id}, {"$set": update_data})
+    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
+    async with aggregate_gate.write():
+        await db.employees.update_one({"employee_id": employee_id}, {"$set": update_data})
+        if existing.get("status") == "active" and existing.get("department") != update_data["department"]:
+            await apply_headcount_change(existing.get("department"), -1)
+            await apply_headcount_change(update_data["department"], 1)
+    if update_data["employee_id"] != employee_id:
+        await enqueue_graph_writes("employee_delete", [{"employee_id": employee_id}])
+    await enqueue_graph_writes("employee_upsert", [{key: update_data[key] for key in GRAPH_EMPLOYEE_FIELDS}])
     
     updated = await db.employees.find_one({"employee_id": employee_id}, {"_id": 0})
     if isinstance(updated['created_at'], str):
@@ -386,12 +1232,72 @@ async def delete_employee(employee_id: str, current_user: dict = Depends(get_cur
     if current_user["role"] not in ["admin", "hr"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    result = await db.employees.delete_one({"employee_id": employee_id})
-    if result.deleted_count == 0:
+    async with aggregate_gate.write():
+        deleted = await db.employees.find_one_and_delete({"employee_id": employee_id})
+        if deleted is not None and deleted.get("status") == "active":
+            await apply_headcount_change(deleted.get("department"), -1)
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Employee not found")
+    await enqueue_graph_writes("employee_delete", [{"employee_id": employee_id}])
     
     return {"message": "Employee deleted successfully"}
 
+def payroll_dirty_key(employee_id, year, month):
+    return f"{employee_id}:{year}:{month}"
+
+async def mark_payroll_dirty(attendance_docs, source):
+    """Flag already-processed (employee, month) pairs whose attendance changed; returns how many were marked."""
+    pairs = set()
+    for doc in attendance_docs:
+        date = doc.get("date") or ""
+        if len(date) >= 7 and date[:4].isdigit():
+            pairs.add((doc["employee_id"], int(date[:4]), date[5:7]))
+    if not pairs:
+        return 0
+    processed = await db.payroll_records.find(
+        {"$or": [{"employee_id": employee_id, "year": year, "month": month} for employee_id, year, month in pairs]},
+        {"_id": 0, "employee_id": 1, "year": 1, "month": 1}
+    ).to_list(None)
+    if not processed:
+        return 0
+    marked_at = datetime.now(timezone.utc).isoformat()
+    await db.payroll_dirty.bulk_write([
+        UpdateOne(
+            {"_id": payroll_dirty_key(record["employee_id"], record["year"], record["month"])},
+            {
+                "$set": {"marked_at": marked_at, "source": source},
+                "$setOnInsert": {"employee_id": record["employee_id"], "year": record["year"], "month": record["month"]}
+            },
+            upsert=True
+        )
+        for record in processed
+    ], ordered=False)
+    return len(processed)
+
+# Attendance writes stamp updated_at just before they land, so changes are looked for
+# from a little before the snapshot; an extra mark only costs an "unchanged" recompute.
+ATTENDANCE_WRITE_SLACK_SECONDS = 60
+
+async def mark_attendance_changed_since(records, source):
+    """Mark new payroll records whose attendance was written after their attendance_as_of snapshot.
+
+    mark_payroll_dirty only marks pairs that already have a record, so a write that
+    lands while process/run sits between its attendance read and its upsert is
+    caught here instead.
+    """
+    if not records:
+        return 0
+    since = min(record["attendance_as_of"] for record in records)
+    since = (datetime.fromisoformat(since) - timedelta(seconds=ATTENDANCE_WRITE_SLACK_SECONDS)).isoformat()
+    year, month = records[0]["year"], records[0]["month"]
+    month_start, month_end = month_date_range(year, month)
+    changed = await db.attendance_logs.find({
+        "employee_id": {"$in": [record["employee_id"] for record in records]},
+        "date": {"$gte": month_start, "$lt": month_end},
+        "updated_at": {"$gt": since}
+    }, {"_id": 0, "employee_id": 1, "date": 1}).to_list(None)
+    return await mark_payroll_dirty(changed, source)
+
 @api_router.post("/attendance", response_model=AttendanceLog)
 async def create_attendance(attendance_data: AttendanceCreate, current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "hr"]:
@@ -400,78 +1306,492 @@ async def create_attendance(attendance_data: AttendanceCreate, current_user: dic
     attendance = AttendanceLog(**attendance_data.model_dump())
     doc = attendance.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    doc['updated_at'] = doc['created_at']
     
     await db.attendance_logs.insert_one(doc)
+    await mark_payroll_dirty([doc], "attendance_create")
     return attendance
 
+INGEST_CHUNK_SIZE = 64 * 1024
+INGEST_BATCH_SIZE = 1000
+INGEST_MAX_ERRORS = 1000
+INGEST_MAX_PENDING_JSON = 1024 * 1024
+INGEST_MAX_LINE = 64 * 1024
+
+async def iter_text_chunks(byte_chunks):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    async for chunk in byte_chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+async def iter_lines(text_chunks):
+    """Split text into lines, yielding a ValueError in place of any line over INGEST_MAX_LINE characters."""
+    pending = ""
+    overflow = False
+    async for text in text_chunks:
+        pending += text
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            if overflow:
+                # The rest of a line that was already reported as too long.
+                overflow = False
+            elif len(line) > INGEST_MAX_LINE:
+                yield ValueError(f"Line longer than {INGEST_MAX_LINE} characters")
+            else:
+                yield line.rstrip("\r")
+        if len(pending) > INGEST_MAX_LINE:
+            if not overflow:
+                yield ValueError(f"Line longer than {INGEST_MAX_LINE} characters")
+            overflow = True
+            pending = ""
+    if pending and not overflow:
+        yield pending.rstrip("\r")
+
+class LineQueue:
+    """Lines handed over from async code to a long-lived csv.reader, which pulls them on demand."""
+
+    def __init__(self):
+        self.lines = collections.deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+async def iter_csv_records(text_chunks):
+    """Group lines into CSV records, carrying on to the next line while a quoted field is open.
+
+    A record whose quote is still open at the end of the input, or after INGEST_MAX_LINE characters,
+    is yielded as a ValueError and the lines after its first are read again as records of their own.
+    """
+    source = iter_lines(text_chunks)
+    replay = collections.deque()
+    record = []
+    record_size = 0
+    while True:
+        line = replay.popleft() if replay else await anext(source, None)
+        if record and (line is None or isinstance(line, Exception)):
+            yield ValueError("Unterminated quoted field")
+            replay.extendleft(reversed(record[1:] + ([] if line is None else [line])))
+            record = []
+            record_size = 0
+            continue
+        if line is None:
+            return
+        if isinstance(line, Exception):
+            yield line
+            continue
+        if not record and not line.strip():
+            continue
+        record.append(line + "\n")
+        record_size += len(line) + 1
+        # An odd number of quotes so far means a quoted field carries on to the next line.
+        if sum(part.count('"') for part in record) % 2 == 0:
+            yield record
+            record = []
+            record_size = 0
+        elif record_size > INGEST_MAX_LINE:
+            yield ValueError("Unterminated quoted field")
+            replay.extendleft(reversed(record[1:]))
+            record = []
+            record_size = 0
+
+async def iter_csv_rows(text_chunks):
+    lines = LineQueue()
+    reader = csv.reader(lines)
+    header = None
+    row_number = 0
+    async for record in iter_csv_records(text_chunks):
+        if isinstance(record, Exception):
+            row_number += 1
+            yield row_number, record
+            continue
+        lines.lines.extend(record)
+        values = next(reader)
+        if header is None:
+            header = [value.strip() for value in values]
+            continue
+        row_number += 1
+        if len(values) != len(header):
+            yield row_number, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        yield row_number, {key: value for key, value in zip(header, values) if value != ""}
+
+async def iter_ndjson_rows(text_chunks):
+    row_number = 0
+    async for line in iter_lines(text_chunks):
+        if isinstance(line, Exception):
+            row_number += 1
+            yield row_number, line
+            continue
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            yield row_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, e
+
+async def iter_json_array_rows(text_chunks):
+    """Incrementally decode the elements of a top-level JSON array."""
+    decoder = json.JSONDecoder()
+    pending = ""
+    started = finished = False
+    row_number = 0
+    async for text in text_chunks:
+        pending += text
+        pos = 0
+        while True:
+            while pos < len(pending) and (pending[pos].isspace() or (started and pending[pos] == ",")):
+                pos += 1
+            if pos == len(pending) or finished:
+                break
+            if not started:
+                if pending[pos] != "[":
+                    raise HTTPException(status_code=400, detail="Expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if pending[pos] == "]":
+                finished = True
+                break
+            try:
+                item, pos = decoder.raw_decode(pending, pos)
+            except json.JSONDecodeError:
+                break
+            row_number += 1
+            yield row_number, item
+        pending = pending[pos:]
+        if len(pending) > INGEST_MAX_PENDING_JSON:
+            break
+    if not finished:
+        yield row_number + 1, ValueError("Malformed JSON, ingestion stopped at this row")
+
+async def iter_upload_chunks(upload):
+    while True:
+        chunk = await upload.read(INGEST_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def attendance_row_parser(format_name):
+    parsers = {"csv": iter_csv_rows, "ndjson": iter_ndjson_rows, "json": iter_json_array_rows}
+    if format_name not in parsers:
+        raise HTTPException(status_code=400, detail="Unsupported format, use csv, ndjson or json")
+    return parsers[format_name]
+
+@api_router.post("/attendance/bulk")
+async def bulk_create_attendance(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson|json)$"),
+    mode: str = Query("upsert", pattern="^(upsert|insert)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Missing 'file' upload")
+        format_name = format or Path(upload.filename or "").suffix.lstrip(".").lower()
+        byte_chunks = iter_upload_chunks(upload)
+    else:
+        if "csv" in content_type:
+            default_format = "csv"
+        elif "ndjson" in content_type or "jsonl" in content_type:
+            default_format = "ndjson"
+        else:
+            default_format = "json"
+        format_name = format or default_format
+        byte_chunks = request.stream()
+    rows = attendance_row_parser(format_name)(iter_text_chunks(byte_chunks))
+
+    report = {"received": 0, "inserted": 0, "updated": 0, "failed": 0, "payroll_marked_for_recompute": 0, "errors": []}
+
+    def record_error(row_number, message):
+        report["failed"] += 1
+        if len(report["errors"]) < INGEST_MAX_ERRORS:
+            report["errors"].append({"row": row_number, "error": message})
+
+    async def flush(batch):
+        updated_at = datetime.now(timezone.utc).isoformat()
+        if mode == "insert":
+            operations = [InsertOne({**doc, "updated_at": updated_at}) for _, doc in batch]
+        else:
+            operations = []
+            for _, doc in batch:
+                operations.append(UpdateOne(
+                    {"employee_id": doc["employee_id"], "date": doc["date"]},
+                    {
+                        "$set": {
+                            **{key: doc[key] for key in ("hours_worked", "overtime_hours", "leaves")},
+                            "updated_at": updated_at
+                        },
+                        "$setOnInsert": {"id": doc["id"], "created_at": doc["created_at"]}
+                    },
+                    upsert=True
+                ))
+        failed = set()
+        try:
+            result = await db.attendance_logs.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for error in details.get("writeErrors", []):
+                failed.add(error["index"])
+                record_error(batch[error["index"]][0], error.get("errmsg", "Write failed"))
+        report["inserted"] += details.get("nInserted", 0) + details.get("nUpserted", 0)
+        report["updated"] += details.get("nModified", 0)
+        report["payroll_marked_for_recompute"] += await mark_payroll_dirty(
+            [doc for i, (_, doc) in enumerate(batch) if i not in failed], "attendance_bulk"
+        )
+
+    batch = []
+    async for row_number, row in rows:
+        report["received"] += 1
+        if isinstance(row, Exception):
+            record_error(row_number, str(row))
+            continue
+        if not isinstance(row, dict):
+            record_error(row_number, "Row must be an object")
+            continue
+        try:
+            attendance = AttendanceLog(**AttendanceCreate(**row).model_dump())
+        except ValidationError as e:
+            record_error(row_number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        doc = attendance.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        batch.append((row_number, doc))
+        if len(batch) >= INGEST_BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    report["errors_truncated"] = report["failed"] > len(report["errors"])
+    return report
+
 @api_router.get("/attendance", response_model=List[AttendanceLog])
-async def get_attendance(employee_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_attendance(
+    employee_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_LIMIT, ge=1, le=PAGE_SIZE_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
     query = {"employee_id": employee_id} if employee_id else {}
-    logs = await db.attendance_logs.find(query, {"_id": 0}).to_list(1000)
-    for log in logs:
-        if isinstance(log['created_at'], str):
-            log['created_at'] = datetime.fromisoformat(log['created_at'])
-    return logs
+    if date_from or date_to:
+        query["date"] = {}
+        if date_from:
+            query["date"]["$gte"] = date_from
+        if date_to:
+            query["date"]["$lte"] = date_to
+    sort_keys = ["date", "id"]
+    projection = parse_projection(fields, AttendanceLog, sort_keys)
+    return await fetch_page(db.attendance_logs, query, sort_keys, limit, cursor, projection)
+
+def month_date_range(year, month):
+    """Return the [start, end) ISO date strings bounding a payroll month."""
+    year = int(year)
+    month = int(month)
+    month_start = datetime(year, month, 1)
+    if month == 12:
+        month_end = datetime(year + 1, 1, 1)
+    else:
+        month_end = datetime(year, month + 1, 1)
+    return month_start.strftime("%Y-%m-%d"), month_end.strftime("%Y-%m-%d")
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_LEASE_SECONDS = 600
+
+def idempotency_key_id(scope, key, current_user):
+    return f"{scope}:{current_user['email']}:{key}" if key else None
+
+async def run_idempotent(scope, key, current_user, payload, handler):
+    """Run `handler()` at most once per (user, scope, Idempotency-Key) and replay its response to retries.
+
+    A key reused with a different payload is rejected, and a retry that arrives
+    while the first request is still running gets 409. Failed requests release
+    the key so they can be retried; an abandoned claim is taken over after
+    IDEMPOTENCY_LEASE_SECONDS. Without a key the handler simply runs.
+    """
+    if not key:
+        return await handler()
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+
+    key_id = idempotency_key_id(scope, key, current_user)
+    request_hash = hashlib.sha256(json.dumps(jsonable_encoder(payload), sort_keys=True).encode()).hexdigest()
+    claim_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": key_id,
+            "scope": scope,
+            "key": key,
+            "user": current_user["email"],
+            "request_hash": request_hash,
+            "status": "in_progress",
+            "claim_id": claim_id,
+            "claimed_at": now.isoformat(),
+            # A BSON date, not an ISO string, so the TTL index can expire it.
+            "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+        })
+    except DuplicateKeyError:
+        existing = await db.idempotency_keys.find_one({"_id": key_id})
+        if existing is None:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        if existing["request_hash"] != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        if existing["status"] == "completed":
+            return JSONResponse(
+                status_code=existing["status_code"], content=existing["response"],
+                headers={"Idempotent-Replayed": "true"}
+            )
+        stale_before = (now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)).isoformat()
+        taken_over = await db.idempotency_keys.update_one(
+            {"_id": key_id, "status": "in_progress", "claimed_at": {"$lt": stale_before}},
+            {"$set": {"claim_id": claim_id, "claimed_at": now.isoformat()}}
+        )
+        if not taken_over.modified_count:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+
+    try:
+        result = await handler()
+    except BaseException:
+        await db.idempotency_keys.delete_one({"_id": key_id, "claim_id": claim_id})
+        raise
+
+    if isinstance(result, Response):
+        status_code, response = result.status_code, json.loads(result.body)
+    else:
+        status_code, response = 200, jsonable_encoder(result)
+    try:
+        await db.idempotency_keys.update_one(
+            {"_id": key_id, "claim_id": claim_id},
+            {"$set": {"status": "completed", "status_code": status_code, "response": response,
+                      "completed_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    except DocumentTooLarge:
+        logging.warning(f"Response for Idempotency-Key {key!r} is too large to store; retries will be re-run")
+        await db.idempotency_keys.delete_one({"_id": key_id, "claim_id": claim_id})
+    return result
+
+def payroll_key(doc):
+    return {"employee_id": doc["employee_id"], "month": doc["month"], "year": doc["year"]}
+
+# Records held for review stay out of the aggregates, the audit trail and the graph until approved;
+# "rejected" only matches records rejected before rejections were moved to rejected_payroll.
+SETTLED_PAYROLL = {"status": {"$nin": ["held_for_review", "rejected"]}}
+PAYROLL_SIDE_EFFECTS = ("aggregates", "audit", "graph")
+
+def initial_side_effects(doc):
+    return [] if doc.get("status") in ("held_for_review", "rejected") else list(PAYROLL_SIDE_EFFECTS)
+
+async def apply_payroll_side_effects(docs, performed_by):
+    """Run the follow-up writes still listed in each record's pending_side_effects, pulling each step once done.
+
+    Records are stored with their steps pending, so a request or job that dies
+    part-way leaves exactly the unfinished steps for its retry to complete.
+    Audit entries have deterministic ids and graph upserts are idempotent; an
+    interruption between the aggregate $inc and its $pull is the one case a
+    retry repeats, and rebuild-aggregates corrects it.
+    """
+    for step in PAYROLL_SIDE_EFFECTS:
+        batch = [doc for doc in docs if step in (doc.get("pending_side_effects") or [])]
+        if not batch:
+            continue
+        if step == "aggregates":
+            # The $pull stays inside the gate so a rebuild sees each record either counted and
+            # marked done, or still pending.
+            async with aggregate_gate.write():
+                await apply_payroll_aggregates(batch)
+                await pull_side_effect(batch, step)
+            for doc in batch:
+                payroll_baseline.update(doc.get("department") or "Unknown", doc["net_salary"])
+            continue
+        elif step == "audit":
+            timestamp = datetime.now(timezone.utc).isoformat()
+            try:
+                await db.audit_trail.insert_many([
+                    {
+                        "_id": f"payroll_processed:{doc['id']}",
+                        "id": str(uuid.uuid4()),
+                        "action": "payroll_processed",
+                        "employee_id": doc["employee_id"],
+                        "performed_by": performed_by,
+                        "details": {"month": doc["month"], "year": doc["year"], "net_salary": doc["net_salary"]},
+                        "timestamp": timestamp
+                    }
+                    for doc in batch
+                ], ordered=False)
+            except BulkWriteError as e:
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+        else:
+            await enqueue_graph_writes("payroll_upsert", [{key: doc[key] for key in GRAPH_PAYROLL_FIELDS} for doc in batch])
+        await pull_side_effect(batch, step)
+
+async def pull_side_effect(docs, step):
+    await db.payroll_records.update_many(
+        {"id": {"$in": [doc["id"] for doc in docs]}}, {"$pull": {"pending_side_effects": step}}
+    )
+    for doc in docs:
+        doc["pending_side_effects"].remove(step)
 
 @api_router.post("/payroll/process", response_model=PayrollRecord)
-async def process_payroll(payroll_data: PayrollProcess, current_user: dict = Depends(get_current_user)):
+async def process_payroll(
+    payroll_data: PayrollProcess,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user["role"] not in ["admin", "hr"]:
         raise HTTPException(status_code=403, detail="Not authorized")
-    
+    return await run_idempotent(
+        "payroll_process", idempotency_key, current_user, payroll_data.model_dump(),
+        lambda: create_payroll_record(
+            payroll_data, current_user["email"], idempotency_key_id("payroll_process", idempotency_key, current_user)
+        )
+    )
+
+async def create_payroll_record(payroll_data: PayrollProcess, performed_by: str, request_key: Optional[str] = None):
     employee = await db.employees.find_one({"employee_id": payroll_data.employee_id})
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
-    existing_payroll = await db.payroll_records.find_one({
-    "employee_id": payroll_data.employee_id,
-    "month": payroll_data.month,
-    "year": payroll_data.year
-    })
-    if existing_payroll:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Payroll for {payroll_data.month}-{payroll_data.year} already exists for this employee"
-            )
     
-    # month_num = int(payroll_data.month)
-    # month_str = f"{payroll_data.year}-{month_num:02d}"
-
-    # attendance_logs = await db.attendance_logs.find({
-    #     "employee_id": payroll_data.employee_id,
-    #     "date": {"$regex": f"^{month_str}-"} }).to_list(1000)
-    from datetime import datetime, timedelta
-    year = int(payroll_data.year)
-    month = int(payroll_data.month)
-    month_start = datetime(year, month, 1)
-    if month == 12:
-        month_end = datetime(year + 1, 1, 1)
-    else:
-        month_end = datetime(year, month + 1, 1)
+    month_start, month_end = month_date_range(payroll_data.year, payroll_data.month)
 
+    attendance_as_of = datetime.now(timezone.utc).isoformat()
     attendance_logs = await db.attendance_logs.find({
         "employee_id": payroll_data.employee_id,
         "date": {
-        "$gte": month_start.strftime("%Y-%m-%d"),
-        "$lt": month_end.strftime("%Y-%m-%d")
+        "$gte": month_start,
+        "$lt": month_end
     }}).to_list(None)
 
     if not attendance_logs:
-        print(f"No attendance found for {payroll_data.employee_id} in {month}/{year}")
+        print(f"No attendance found for {payroll_data.employee_id} in {payroll_data.month}/{payroll_data.year}")
     total_overtime = sum(log.get("overtime_hours", 0) for log in attendance_logs)
     base_salary = employee["base_salary"]
-    if total_overtime > 0:
-        overtime_rate = base_salary / 160
-        overtime_pay = round(total_overtime * overtime_rate * 1.5, 2)
-    else:
-        overtime_pay = 0
-
-    
-    # base_salary = employee["base_salary"]
-    # overtime_rate = base_salary / 160 
-    # overtime_pay = total_overtime * overtime_rate * 1.5
-    
-    gross_salary = base_salary + overtime_pay + payroll_data.bonuses
-    tax = gross_salary * 0.15 
-    net_salary = gross_salary - tax - payroll_data.deductions
+    amounts = calculate_payroll(base_salary, total_overtime, payroll_data.bonuses, payroll_data.deductions)
+    overtime_pay = amounts["overtime_pay"]
+    tax = amounts["tax"]
+    net_salary = amounts["net_salary"]
     
     payroll_record = PayrollRecord(
         employee_id=payroll_data.employee_id,
@@ -483,57 +1803,517 @@ async def process_payroll(payroll_data: PayrollProcess, current_user: dict = Dep
         bonuses=payroll_data.bonuses,
         deductions=payroll_data.deductions,
         tax=tax,
-        net_salary=net_salary
+        net_salary=net_salary,
+        department=employee.get("department")
     )
     
     doc = payroll_record.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
+    await score_payroll_docs([doc])
+    hold_for_review([doc])
+    payroll_record = payroll_record.model_copy(
+        update={field: doc.get(field) for field in list(ANOMALY_FIELDS.values()) + ["review_score", "status"]}
+    )
     
-    await db.payroll_records.insert_one(doc)
+    doc["pending_side_effects"] = initial_side_effects(doc)
+    doc["request_key"] = request_key
+    doc["attendance_as_of"] = attendance_as_of
 
-    audit_doc = {
-        "id": str(uuid.uuid4()),
-        "action": "payroll_processed",
-        "employee_id": payroll_data.employee_id,
-        "performed_by": current_user["email"],
-        "details": {"month": payroll_data.month, "year": payroll_data.year, "net_salary": net_salary},
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-    await db.audit_trail.insert_one(audit_doc)
+    # Only the request that inserts the record (or its retry) writes aggregates, audit and graph entries.
     try:
-        async with neo4j_driver.session() as session:
-            await session.run(
-            """
-            MERGE (e:Employee {id: $employee_id})
-            MERGE (p:Payroll {month: $month, year: $year})
-            SET p.net_salary = $net_salary,
-                p.base_salary = $base_salary,
-                p.bonuses = $bonuses,
-                p.deductions = $deductions,
-                p.tax = $tax
-            MERGE (e)-[:HAS_PAYROLL]->(p)
-            """,
-            {
-                "employee_id": payroll_record.employee_id,
-                "month": payroll_record.month,
-                "year": payroll_record.year,
-                "net_salary": payroll_record.net_salary,
-                "base_salary": payroll_record.base_salary,
-                "bonuses": payroll_record.bonuses,
-                "deductions": payroll_record.deductions,
-                "tax": payroll_record.tax,
-            },
+        result = await db.payroll_records.update_one(payroll_key(doc), {"$setOnInsert": doc}, upsert=True)
+    except DuplicateKeyError:
+        result = None
+    if result is not None and result.upserted_id is not None:
+        await mark_attendance_changed_since([doc], "attendance_during_processing")
+        await apply_payroll_side_effects([doc], performed_by)
+        return payroll_record
+
+    existing = await db.payroll_records.find_one(payroll_key(doc), {"_id": 0})
+    if existing is not None and existing.get("pending_side_effects"):
+        await apply_payroll_side_effects([existing], performed_by)
+    if existing is not None and request_key and existing.get("request_key") == request_key:
+        return PayrollRecord(**existing)
+    raise HTTPException(
+        status_code=400,
+        detail=f"Payroll for {payroll_data.month}-{payroll_data.year} already exists for this employee"
+        )
+
+@api_router.post("/payroll/run")
+async def run_payroll(
+    run_data: PayrollRun,
+    background: bool = False,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    async def handler():
+        if background:
+            return job_accepted(await submit_job("payroll_run", run_data.model_dump(), current_user))
+        return await execute_payroll_run(
+            run_data, current_user["email"], request_key=idempotency_key_id("payroll_run", idempotency_key, current_user)
+        )
+
+    payload = dict(run_data.model_dump(), background=background)
+    return await run_idempotent("payroll_run", idempotency_key, current_user, payload, handler)
+
+async def execute_payroll_run(run_data: PayrollRun, performed_by: str, progress=None, request_key=None):
+    """Process a month for active employees.
+
+    Records this run (same request_key) created before an interruption are
+    reported as processed again, and any record found with unfinished side
+    effects has them completed; records from other requests are reported as
+    already existing.
+    """
+    employee_query = {"status": "active"}
+    if run_data.department:
+        employee_query["department"] = run_data.department
+    employees = await db.employees.find(
+        employee_query,
+        {"_id": 0, "employee_id": 1, "name": 1, "base_salary": 1, "department": 1}
+    ).to_list(None)
+    employee_ids = [emp["employee_id"] for emp in employees]
+    if progress:
+        await progress(0, len(employees), "Loaded employees", force=True)
+
+    existing_cursor = db.payroll_records.find(
+        {"employee_id": {"$in": employee_ids}, "month": run_data.month, "year": run_data.year},
+        {"_id": 0}
+    )
+    already_processed = {record["employee_id"]: record async for record in existing_cursor}
+    await apply_payroll_side_effects(
+        [record for record in already_processed.values() if record.get("pending_side_effects")], performed_by
+    )
+    resumed_docs = [
+        record for record in already_processed.values() if request_key and record.get("request_key") == request_key
+    ]
+
+    # Summed in Python, in natural order, so totals match process_payroll exactly.
+    month_start, month_end = month_date_range(run_data.year, run_data.month)
+    attendance_as_of = datetime.now(timezone.utc).isoformat()
+    attendance_cursor = db.attendance_logs.find(
+        {"employee_id": {"$in": employee_ids}, "date": {"$gte": month_start, "$lt": month_end}},
+        {"_id": 0, "employee_id": 1, "overtime_hours": 1}
+    )
+    overtime_by_employee = {}
+    async for log in attendance_cursor:
+        employee_id = log["employee_id"]
+        overtime_by_employee[employee_id] = overtime_by_employee.get(employee_id, 0) + log.get("overtime_hours", 0)
+
+    results = []
+    eligible = []
+    for employee in employees:
+        employee_id = employee["employee_id"]
+        if employee_id in already_processed:
+            record = already_processed[employee_id]
+            if request_key and record.get("request_key") == request_key:
+                results.append({"employee_id": employee_id, "status": record["status"], "net_salary": record["net_salary"]})
+                continue
+            results.append({
+                "employee_id": employee_id,
+                "status": "failed",
+                "detail": f"Payroll for {run_data.month}-{run_data.year} already exists for this employee"
+            })
+            continue
+        if not isinstance(employee.get("base_salary"), (int, float)):
+            results.append({"employee_id": employee_id, "status": "failed", "detail": "Employee has no valid base salary"})
+            continue
+        eligible.append(employee)
+
+    adjustments = [run_data.adjustments.get(emp["employee_id"], PayrollAdjustment()) for emp in eligible]
+    columns = compute_payroll_columns(
+        [emp["base_salary"] for emp in eligible],
+        [overtime_by_employee.get(emp["employee_id"], 0) for emp in eligible],
+        [adj.bonuses for adj in adjustments],
+        [adj.deductions for adj in adjustments]
+    )
+    overtime_pay = columns["overtime_pay"].tolist()
+    tax = columns["tax"].tolist()
+    net_salary = columns["net_salary"].tolist()
+
+    payroll_docs = []
+    for i, (employee, adjustment) in enumerate(zip(eligible, adjustments)):
+        payroll_record = PayrollRecord(
+            employee_id=employee["employee_id"],
+            employee_name=employee["name"],
+            month=run_data.month,
+            year=run_data.year,
+            base_salary=employee["base_salary"],
+            overtime_pay=overtime_pay[i],
+            bonuses=adjustment.bonuses,
+            deductions=adjustment.deductions,
+            tax=tax[i],
+            net_salary=net_salary[i],
+            department=employee.get("department")
+        )
+        doc = payroll_record.model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        payroll_docs.append(doc)
+
+    if progress:
+        await progress(0, len(employees), "Computed payroll", force=True)
+    await score_payroll_docs(payroll_docs)
+    hold_for_review(payroll_docs)
+    for doc in payroll_docs:
+        doc["pending_side_effects"] = initial_side_effects(doc)
+        doc["request_key"] = request_key
+        doc["attendance_as_of"] = attendance_as_of
+
+    # Upserts rather than inserts: a record created since the check above (a concurrent or retried run)
+    # is left untouched and reported as already existing instead of being processed twice.
+    failed_inserts = {}
+    if payroll_docs:
+        try:
+            upserted = (await db.payroll_records.bulk_write(
+                [UpdateOne(payroll_key(doc), {"$setOnInsert": doc}, upsert=True) for doc in payroll_docs],
+                ordered=False
+            )).upserted_ids
+        except BulkWriteError as e:
+            upserted = {entry["index"]: entry["_id"] for entry in e.details.get("upserted", [])}
+            for error in e.details.get("writeErrors", []):
+                failed_inserts[payroll_docs[error["index"]]["employee_id"]] = error.get("errmsg", "Write failed")
+        for i, doc in enumerate(payroll_docs):
+            if i not in upserted:
+                failed_inserts.setdefault(
+                    doc["employee_id"], f"Payroll for {run_data.month}-{run_data.year} already exists for this employee"
+                )
+
+    processed_docs = []
+    for doc in payroll_docs:
+        if doc["employee_id"] in failed_inserts:
+            results.append({"employee_id": doc["employee_id"], "status": "failed", "detail": failed_inserts[doc["employee_id"]]})
+        else:
+            processed_docs.append(doc)
+            results.append({"employee_id": doc["employee_id"], "status": doc["status"], "net_salary": doc["net_salary"]})
+
+    if progress:
+        await progress(len(results), len(employees), "Inserted payroll records", force=True)
+    await mark_attendance_changed_since(processed_docs, "attendance_during_processing")
+    await apply_payroll_side_effects(processed_docs, performed_by)
+    processed_docs += resumed_docs
+
+    return {
+        "month": run_data.month,
+        "year": run_data.year,
+        "department": run_data.department,
+        "processed": len(processed_docs),
+        "held_for_review": sum(1 for doc in processed_docs if doc["status"] == "held_for_review"),
+        "failed": len(results) - len(processed_docs),
+        "results": results
+    }
+
+
+PAYROLL_RECOMPUTE_BATCH_SIZE = int(os.environ.get("PAYROLL_RECOMPUTE_BATCH_SIZE", "500"))
+RECOMPUTED_FIELDS = ("overtime_pay", "tax", "net_salary")
+ADJUSTMENT_STEPS = ("record", "audit", "graph")
+payroll_recompute_lock = asyncio.Lock()
+
+async def apply_adjustment_steps(adjustments, performed_by):
+    """Carry out the steps still listed in each adjustment's pending_steps, pulling each once done.
+
+    The adjustment is stored first, so a recompute interrupted part-way is
+    finished from it on the next run rather than re-derived from a record
+    that may already hold the new values.
+    """
+    for step in ADJUSTMENT_STEPS:
+        batch = [adjustment for adjustment in adjustments if step in adjustment["pending_steps"]]
+        if not batch:
+            continue
+        if step == "record":
+            async with aggregate_gate.write():
+                await db.payroll_records.bulk_write([
+                    UpdateOne({"id": adjustment["payroll_id"]}, {"$set": {
+                        **adjustment["current"],
+                        **adjustment["scores"],
+                        "attendance_as_of": adjustment["attendance_as_of"],
+                        "updated_at": adjustment["created_at"]
+                    }})
+                    for adjustment in batch
+                ], ordered=False)
+                counted = [adjustment for adjustment in batch if adjustment["counted"]]
+                key = ("year", "month", "department")
+                await apply_payroll_aggregates(
+                    [{**{field: adjustment[field] for field in key}, **adjustment["previous"]} for adjustment in counted],
+                    sign=-1
+                )
+                await apply_payroll_aggregates(
+                    [{**{field: adjustment[field] for field in key}, **adjustment["current"]} for adjustment in counted]
+                )
+                await pull_adjustment_step(batch, step)
+            continue
+        if step == "audit":
+            try:
+                await db.audit_trail.insert_many([
+                    {
+                        "_id": f"payroll_adjusted:{adjustment['id']}",
+                        "id": str(uuid.uuid4()),
+                        "action": "payroll_adjusted",
+                        "employee_id": adjustment["employee_id"],
+                        "performed_by": performed_by,
+                        "details": {
+                            "month": adjustment["month"],
+                            "year": adjustment["year"],
+                            "adjustment_id": adjustment["id"],
+                            "previous_net_salary": adjustment["previous"]["net_salary"],
+                            "net_salary": adjustment["current"]["net_salary"]
+                        },
+                        "timestamp": adjustment["created_at"]
+                    }
+                    for adjustment in batch
+                ], ordered=False)
+            except BulkWriteError as e:
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+        else:
+            records = await db.payroll_records.find(
+                {"id": {"$in": [adjustment["payroll_id"] for adjustment in batch if adjustment["graphed"]]}},
+                {"_id": 0, **{field: 1 for field in GRAPH_PAYROLL_FIELDS}}
+            ).to_list(None)
+            await enqueue_graph_writes("payroll_upsert", records)
+        await pull_adjustment_step(batch, step)
+
+async def pull_adjustment_step(adjustments, step):
+    await db.payroll_adjustments.update_many(
+        {"_id": {"$in": [adjustment["_id"] for adjustment in adjustments]}}, {"$pull": {"pending_steps": step}}
+    )
+    for adjustment in adjustments:
+        adjustment["pending_steps"].remove(step)
+
+async def recompute_payroll_batch(marks, performed_by, summary):
+    keys = [(mark["employee_id"], mark["year"], mark["month"]) for mark in marks]
+    records = await db.payroll_records.find(
+        {"$or": [{"employee_id": employee_id, "year": year, "month": month} for employee_id, year, month in keys]},
+        {"_id": 0}
+    ).to_list(None)
+    records_by_key = {(record["employee_id"], record["year"], record["month"]): record for record in records}
+
+    date_clauses = []
+    for employee_id, year, month in keys:
+        month_start, month_end = month_date_range(year, month)
+        date_clauses.append({"employee_id": employee_id, "date": {"$gte": month_start, "$lt": month_end}})
+    overtime = {}
+    attendance_as_of = datetime.now(timezone.utc).isoformat()
+    async for log in db.attendance_logs.find(
+        {"$or": date_clauses}, {"_id": 0, "employee_id": 1, "date": 1, "overtime_hours": 1}
+    ):
+        key = (log["employee_id"], int(log["date"][:4]), log["date"][5:7])
+        overtime[key] = overtime.get(key, 0) + log.get("overtime_hours", 0)
+
+    found = [(mark, key, records_by_key[key]) for mark, key in zip(marks, keys) if key in records_by_key]
+    summary["missing"] += len(marks) - len(found)
+    columns = compute_payroll_columns(
+        [record["base_salary"] for _, _, record in found],
+        [overtime.get(key, 0) for _, key, _ in found],
+        [record.get("bonuses", 0) for _, _, record in found],
+        [record.get("deductions", 0) for _, _, record in found]
+    )
+    recomputed = {field: columns[field].tolist() for field in RECOMPUTED_FIELDS}
+
+    now = datetime.now(timezone.utc).isoformat()
+    changed = []
+    for i, (mark, _, record) in enumerate(found):
+        current = {field: recomputed[field][i] for field in RECOMPUTED_FIELDS}
+        if all(record.get(field) == current[field] for field in RECOMPUTED_FIELDS):
+            summary["unchanged"] += 1
+            continue
+        changed.append((mark, record, {**record, **current, "updated_at": now}))
+
+    if changed:
+        new_docs = [new for _, _, new in changed]
+        await score_payroll_docs(new_docs)
+        adjustments = []
+        for mark, old, new in changed:
+            settled = old.get("status") not in ("held_for_review", "rejected")
+            adjustments.append({
+                "_id": f"{old['id']}:{mark['marked_at']}",
+                "id": str(uuid.uuid4()),
+                "payroll_id": old["id"],
+                "employee_id": old["employee_id"],
+                "month": old["month"],
+                "year": old["year"],
+                "department": old.get("department") or "Unknown",
+                "reason": "attendance_changed",
+                "source": mark.get("source"),
+                "previous": {field: old.get(field) or 0 for field in RECOMPUTED_FIELDS},
+                "current": {field: new[field] for field in RECOMPUTED_FIELDS},
+                "difference": {field: round(new[field] - (old.get(field) or 0), 2) for field in RECOMPUTED_FIELDS},
+                "scores": {field: new.get(field) for field in ANOMALY_FIELDS.values()},
+                "attendance_as_of": attendance_as_of,
+                # Held records and ones whose own aggregates step is still pending are not in the
+                # totals yet; they are counted at their current values when that happens.
+                "counted": settled and "aggregates" not in (old.get("pending_side_effects") or []),
+                "graphed": settled,
+                "pending_steps": list(ADJUSTMENT_STEPS),
+                "performed_by": performed_by,
+                "created_at": now
+            })
+        # Keyed by the mark, so only a batch interrupted before deleting its marks collides here,
+        # and the stored adjustment already carries any steps it left pending.
+        try:
+            await db.payroll_adjustments.insert_many(adjustments, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            adjustments = await db.payroll_adjustments.find(
+                {"_id": {"$in": [adjustment["_id"] for adjustment in adjustments]}}
+            ).to_list(None)
+        await apply_adjustment_steps(adjustments, performed_by)
+        summary["adjusted"] += len(changed)
+        summary["net_difference"] = round(
+            summary["net_difference"] + sum(adjustment["difference"]["net_salary"] for adjustment in adjustments), 2
         )
-    except Exception as e:
-        print("⚠️ Neo4j write failed:", e)
 
+    # A pair re-marked while this batch ran keeps its mark and is picked up again.
+    await db.payroll_dirty.bulk_write(
+        [DeleteOne({"_id": mark["_id"], "marked_at": mark["marked_at"]}) for mark in marks], ordered=False
+    )
+    summary["pairs"] += len(marks)
+
+async def recompute_dirty_payroll(performed_by="system", limit=None, progress=None):
+    """Recompute payroll records flagged in payroll_dirty from current attendance, oldest mark first.
+
+    Only overtime is re-derived; base salary, bonuses, deductions and review
+    status keep their processed values. Every changed record gets a
+    payroll_adjustments entry and an audit trail entry, and the aggregates and
+    graph are moved by the difference; held records are adjusted but stay out
+    of both until approved.
+    """
+    summary = {"pairs": 0, "adjusted": 0, "unchanged": 0, "missing": 0, "resumed": 0, "net_difference": 0.0}
+    async with payroll_recompute_lock:
+        # Adjustments an interrupted run stored but did not finish.
+        unfinished = await db.payroll_adjustments.find(
+            {"pending_steps": {"$in": list(ADJUSTMENT_STEPS)}}
+        ).to_list(None)
+        await apply_adjustment_steps(unfinished, performed_by)
+        summary["resumed"] = len(unfinished)
+        total = await db.payroll_dirty.count_documents({})
+        if limit:
+            total = min(total, limit)
+        if progress:
+            await progress(0, total, "Loaded payroll marked for recompute", force=True)
+        while summary["pairs"] < total:
+            batch_size = min(PAYROLL_RECOMPUTE_BATCH_SIZE, total - summary["pairs"])
+            marks = await db.payroll_dirty.find({}).sort("marked_at", ASCENDING).limit(batch_size).to_list(batch_size)
+            if not marks:
+                break
+            await recompute_payroll_batch(marks, performed_by, summary)
+            if progress:
+                await progress(summary["pairs"], total, "Recomputed payroll", force=summary["pairs"] >= total)
+    return summary
+
+@api_router.post("/admin/payroll/recompute")
+async def recompute_payroll_endpoint(
+    limit: Optional[int] = Query(None, gt=0),
+    background: bool = False,
+    current_user: dict = Depends(require_roles("admin"))
+):
+    if background:
+        return job_accepted(await submit_job("payroll_recompute", {"limit": limit}, current_user))
+    return await recompute_dirty_payroll(current_user["email"], limit)
+
+@api_router.get("/admin/payroll-recompute")
+async def get_payroll_recompute_stats(current_user: dict = Depends(require_roles("admin"))):
+    oldest = await db.payroll_dirty.find_one({}, {"_id": 0, "marked_at": 1}, sort=[("marked_at", ASCENDING)])
+    return {
+        "pending": await db.payroll_dirty.count_documents({}),
+        "oldest_marked_at": oldest["marked_at"] if oldest else None,
+        "running": payroll_recompute_lock.locked()
+    }
+
+@api_router.get("/payroll/adjustments")
+async def get_payroll_adjustments(
+    employee_id: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_LIMIT, ge=1, le=PAGE_SIZE_LIMIT),
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    query = {"employee_id": employee_id} if employee_id else {}
+    return await fetch_page(db.payroll_adjustments, query, ["created_at", "id"], limit, cursor, {"_id": 0})
+
+
+SIMULATION_SNAPSHOT_TTL = int(os.environ.get("SIMULATION_SNAPSHOT_TTL", "60"))
+simulation_snapshots = TTLCache(maxsize=32, ttl=SIMULATION_SNAPSHOT_TTL)
+
+async def load_payroll_snapshot(year, month, department=None):
+    """Active salaries and the period's overtime as arrays, cached briefly so successive what-ifs skip Mongo."""
+    key = (year, month, department)
+    snapshot = simulation_snapshots.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    employee_query = {"status": "active"}
+    if department:
+        employee_query["department"] = department
+    employees = await db.employees.find(
+        employee_query, {"_id": 0, "employee_id": 1, "base_salary": 1, "department": 1}
+    ).to_list(None)
+    employees = [emp for emp in employees if isinstance(emp.get("base_salary"), (int, float))]
+
+    month_start, month_end = month_date_range(year, month)
+    attendance_match = {"date": {"$gte": month_start, "$lt": month_end}}
+    if department:
+        attendance_match["employee_id"] = {"$in": [emp["employee_id"] for emp in employees]}
+    overtime_rows = await db.attendance_logs.aggregate([
+        {"$match": attendance_match},
+        {"$group": {"_id": "$employee_id", "hours": {"$sum": "$overtime_hours"}}}
+    ]).to_list(None)
+    overtime_by_employee = {row["_id"]: row["hours"] for row in overtime_rows}
+
+    departments = {}
+    department_index = [
+        departments.setdefault(emp.get("department") or "Unknown", len(departments)) for emp in employees
+    ]
+    snapshot = {
+        "base_salaries": [emp["base_salary"] for emp in employees],
+        "overtime_hours": [overtime_by_employee.get(emp["employee_id"], 0) or 0 for emp in employees],
+        "department_index": department_index,
+        "departments": list(departments),
+        "taken_at": datetime.now(timezone.utc).isoformat()
+    }
+    simulation_snapshots[key] = snapshot
+    return snapshot
 
-    return payroll_record
+@api_router.post("/payroll/simulate")
+async def simulate_payroll_rules(simulation: PayrollSimulation, current_user: dict = Depends(get_current_user)):
+    """What-if payroll for a period under overridden rules; computed in memory, nothing is written."""
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
 
+    snapshot = await load_payroll_snapshot(simulation.year, simulation.month, simulation.department)
+    result = simulate_payroll(
+        snapshot["base_salaries"],
+        snapshot["overtime_hours"],
+        snapshot["department_index"],
+        snapshot["departments"],
+        raises=simulation.department_raises,
+        overtime_divisor=simulation.overtime_divisor,
+        overtime_multiplier=simulation.overtime_multiplier,
+        tax_rate=simulation.tax_rate
+    )
+    unknown = sorted(set(simulation.department_raises) - set(snapshot["departments"]))
+    return {
+        "month": simulation.month,
+        "year": simulation.year,
+        "department": simulation.department,
+        "rules": simulation.model_dump(exclude={"month", "year", "department"}),
+        "snapshot_taken_at": snapshot["taken_at"],
+        "unknown_departments": unknown,
+        **result
+    }
 
 @api_router.get("/payroll", response_model=List[PayrollRecord])
 async def get_payroll(
     employee_id: Optional[str] = None,
+    status: Optional[str] = None,
+    period_from: Optional[str] = None,
+    period_to: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE_LIMIT, ge=1, le=PAGE_SIZE_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user)
 ):
     if current_user["role"] in ["admin", "hr"]:
@@ -546,40 +2326,254 @@ async def get_payroll(
 
         query = {"employee_id": employee["employee_id"]}
 
-    records = await db.payroll_records.find(query, {"_id": 0}).sort([
-        ("year", 1),
-        ("month", 1)
-    ]).to_list(1000)
+    if status:
+        query["status"] = status
+    period_clauses = payroll_period_filter(period_from, period_to)
+    if period_clauses:
+        query["$and"] = period_clauses
+
+    sort_keys = ["year", "month", "id"]
+    projection = parse_projection(fields, PayrollRecord, sort_keys)
+    return await fetch_page(db.payroll_records, query, sort_keys, limit, cursor, projection)
+
+
+EXPORT_CHUNK_SIZE = 500
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+async def stream_export(collection, query, columns, export_format, resume_token):
+    """Stream `query` ordered by _id; every row carries its _id as a resume token."""
+    if resume_token:
+        try:
+            query = {"$and": [query, {"_id": {"$gt": ObjectId(resume_token)}}]} if query else {"_id": {"$gt": ObjectId(resume_token)}}
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid resume token")
+
+    projection = {column: 1 for column in columns}
+    mongo_cursor = collection.find(query, projection).sort("_id", 1).batch_size(EXPORT_CHUNK_SIZE)
+
+    async def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == "csv" and not resume_token:
+            writer.writerow(columns + ["cursor"])
+        rows = 0
+        async for doc in mongo_cursor:
+            token = str(doc.pop("_id"))
+            if export_format == "csv":
+                writer.writerow([doc.get(column, "") for column in columns] + [token])
+            else:
+                row = {column: doc.get(column) for column in columns}
+                row["cursor"] = token
+                buffer.write(json.dumps(jsonable_encoder(row)) + "\n")
+            rows += 1
+            if rows % EXPORT_CHUNK_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    return StreamingResponse(
+        generate(),
+        media_type=EXPORT_FORMATS[export_format],
+        headers={"Content-Disposition": f"attachment; filename={collection.name}.{export_format}"}
+    )
 
-    for record in records:
-        if isinstance(record.get("created_at"), str):
-            record["created_at"] = datetime.fromisoformat(record["created_at"])
+@api_router.get("/export/payroll")
+async def export_payroll(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    employee_id: Optional[str] = None,
+    period_from: Optional[str] = None,
+    period_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
 
-    return records
+    query = {"employee_id": employee_id} if employee_id else {}
+    period_clauses = payroll_period_filter(period_from, period_to)
+    if period_clauses:
+        query["$and"] = period_clauses
+    return await stream_export(db.payroll_records, query, list(PayrollRecord.model_fields), format, cursor)
+
+@api_router.get("/export/attendance")
+async def export_attendance(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    employee_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
 
+    query = {"employee_id": employee_id} if employee_id else {}
+    if date_from or date_to:
+        query["date"] = {}
+        if date_from:
+            query["date"]["$gte"] = date_from
+        if date_to:
+            query["date"]["$lte"] = date_to
+    return await stream_export(db.attendance_logs, query, list(AttendanceLog.model_fields), format, cursor)
+
+def round_amounts(rows, fields=("net_salary", "overtime_pay", "tax", "gross_salary")):
+    for row in rows:
+        for field in fields:
+            if field in row:
+                row[field] = round(row[field], 2)
+    return rows
+
+def analytics_match(period_from=None, period_to=None, employee_id=None):
+    """Match settled payroll records, optionally narrowed to an employee and a period."""
+    match = dict(SETTLED_PAYROLL)
+    if employee_id:
+        match["employee_id"] = employee_id
+    period_clauses = payroll_period_filter(period_from, period_to)
+    if period_clauses:
+        match["$and"] = period_clauses
+    return match
+
+async def aggregate_cost_by_department(match):
+    pipeline = [{"$match": match}] + department_stages() + [
+        {"$group": {
+            "_id": "$department",
+            "net_salary": {"$sum": "$net_salary"},
+            "overtime_pay": {"$sum": "$overtime_pay"},
+            "tax": {"$sum": "$tax"},
+            "records": {"$sum": 1},
+            "employees": {"$addToSet": "$employee_id"}
+        }},
+        {"$project": {
+            "_id": 0,
+            "department": "$_id",
+            "net_salary": "$net_salary",
+            "overtime_pay": "$overtime_pay",
+            "tax": "$tax",
+            "records": 1,
+            "employees": {"$size": "$employees"}
+        }},
+        {"$sort": {"net_salary": -1}}
+    ]
+    return round_amounts(await db.payroll_records.aggregate(pipeline).to_list(None))
+
+async def aggregate_cost_by_month(match, department=None):
+    pipeline = [{"$match": match}]
+    if department:
+        pipeline += department_stages() + [{"$match": {"department": department}}]
+    pipeline += [
+        {"$group": {
+            "_id": {"year": "$year", "month": "$month"},
+            "net_salary": {"$sum": "$net_salary"},
+            "overtime_pay": {"$sum": "$overtime_pay"},
+            "tax": {"$sum": "$tax"},
+            "records": {"$sum": 1}
+        }},
+        {"$sort": {"_id.year": 1, "_id.month": 1}},
+        {"$project": {
+            "_id": 0,
+            "year": "$_id.year",
+            "month": "$_id.month",
+            "net_salary": "$net_salary",
+            "overtime_pay": "$overtime_pay",
+            "tax": "$tax",
+            "records": 1
+        }}
+    ]
+    return round_amounts(await db.payroll_records.aggregate(pipeline).to_list(None))
+
+async def aggregate_overtime_share(match, department=None, limit=100):
+    pipeline = [{"$match": match}]
+    if department:
+        pipeline += department_stages() + [{"$match": {"department": department}}]
+    pipeline += [
+        # $last needs an order: the name on the employee's latest period. Matches the
+        # (employee_id, year, month, id) index, so it can run without an in-memory sort.
+        {"$sort": {"employee_id": 1, "year": 1, "month": 1}},
+        {"$group": {
+            "_id": "$employee_id",
+            "employee_name": {"$last": "$employee_name"},
+            "overtime_pay": {"$sum": "$overtime_pay"},
+            "gross_salary": {"$sum": {"$add": ["$base_salary", "$overtime_pay", "$bonuses"]}},
+            "records": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "employee_id": "$_id",
+            "employee_name": 1,
+            "records": 1,
+            "overtime_pay": "$overtime_pay",
+            "gross_salary": "$gross_salary",
+            "overtime_share": {"$cond": [
+                {"$gt": ["$gross_salary", 0]},
+                {"$divide": ["$overtime_pay", "$gross_salary"]},
+                0
+            ]}
+        }},
+        {"$sort": {"overtime_share": -1, "employee_id": 1}},
+        {"$limit": limit}
+    ]
+    rows = round_amounts(await db.payroll_records.aggregate(pipeline).to_list(limit))
+    for row in rows:
+        row["overtime_share"] = round(row["overtime_share"], 4)
+    return rows
+
+async def aggregate_employee_totals(employee_id):
+    totals = await db.payroll_records.aggregate([
+        {"$match": analytics_match(employee_id=employee_id)},
+        {"$group": {
+            "_id": None,
+            "records": {"$sum": 1},
+            "overtime_pay": {"$sum": "$overtime_pay"},
+            "net_salary": {"$sum": "$net_salary"}
+        }}
+    ]).to_list(1)
+    return totals[0] if totals else {"records": 0, "overtime_pay": 0, "net_salary": 0}
+
+async def aggregate_monthly_series(match=None, group_by=None):
+    """Monthly net_salary totals ready for forecasting, plus the number of records behind them.
+
+    With `group_by` ("department" or "employee_id") each row's _id also carries the group value.
+    """
+    pipeline = [{"$match": {**(match or analytics_match()), "net_salary": {"$type": "number", "$ne": 0}}}]
+    group_key = {"year": "$year", "month": "$month"}
+    if group_by == "department":
+        pipeline += department_stages()
+    if group_by:
+        group_key["group"] = f"${group_by}"
+    pipeline += [
+        {"$group": {"_id": group_key, "y": {"$sum": "$net_salary"}, "records": {"$sum": 1}}},
+        {"$sort": {"_id.year": 1, "_id.month": 1}}
+    ]
+    return await db.payroll_records.aggregate(pipeline).to_list(None)
 
 @api_router.get("/analytics/dashboard")
 async def get_dashboard_analytics(current_user: dict = Depends(get_current_user)):
     if current_user["role"] in ["admin", "hr"]:
-        total_employees = await db.employees.count_documents({"status": "active"})
-        total_payroll = await db.payroll_records.count_documents({})
-
         current_month = datetime.now(timezone.utc).strftime("%m")
         current_year = datetime.now(timezone.utc).year
 
-        monthly_records = await db.payroll_records.find({
-            "month": current_month,
-            "year": current_year
-        }).to_list(1000)
-
-        total_cost = sum(record["net_salary"] for record in monthly_records)
-        total_overtime = sum(record["overtime_pay"] for record in monthly_records)
+        aggregates = await db.payroll_aggregates.find({"$or": [
+            {"kind": "payroll", "year": current_year, "month": current_month},
+            {"kind": {"$in": ["headcount", "totals"]}}
+        ]}).to_list(None)
 
-        employees = await db.employees.find({"status": "active"}, {"_id": 0}).to_list(1000)
+        total_employees = 0
+        total_payroll = 0
+        total_cost = 0
+        total_overtime = 0
         department_dist = {}
-        for emp in employees:
-            dept = emp.get("department", "Unknown")
-            department_dist[dept] = department_dist.get(dept, 0) + 1
+        for aggregate in aggregates:
+            if aggregate["kind"] == "payroll":
+                total_cost += aggregate["net_salary"]
+                total_overtime += aggregate["overtime_pay"]
+            elif aggregate["kind"] == "headcount":
+                if aggregate["active_employees"] > 0:
+                    department_dist[aggregate["department"]] = aggregate["active_employees"]
+                    total_employees += aggregate["active_employees"]
+            else:
+                total_payroll = aggregate["payroll_records"]
 
         return {
             "total_employees": total_employees,
@@ -593,13 +2587,10 @@ async def get_dashboard_analytics(current_user: dict = Depends(get_current_user)
         if not employee:
             raise HTTPException(status_code=404, detail="Employee record not found")
 
-        payrolls = await db.payroll_records.find(
-            {"employee_id": employee["employee_id"]}
-        ).to_list(None)
-
-        total_records = len(payrolls)
-        total_overtime = sum(p.get("overtime_pay", 0) for p in payrolls)
-        total_cost = sum(p.get("net_salary", 0) for p in payrolls)
+        totals = await aggregate_employee_totals(employee["employee_id"])
+        total_records = totals["records"]
+        total_overtime = totals["overtime_pay"]
+        total_cost = totals["net_salary"]
 
         return {
             "total_employees": 1,
@@ -611,167 +2602,564 @@ async def get_dashboard_analytics(current_user: dict = Depends(get_current_user)
     else:
         raise HTTPException(status_code=403, detail="Not authorized")
 
+@api_router.get("/analytics/cost-by-department")
+async def get_cost_by_department(
+    period_from: Optional[str] = None,
+    period_to: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {"departments": await aggregate_cost_by_department(analytics_match(period_from, period_to))}
 
+@api_router.get("/analytics/cost-by-month")
+async def get_cost_by_month(
+    period_from: Optional[str] = None,
+    period_to: Optional[str] = None,
+    department: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {"months": await aggregate_cost_by_month(analytics_match(period_from, period_to), department)}
+
+@api_router.get("/analytics/overtime-share")
+async def get_overtime_share(
+    period_from: Optional[str] = None,
+    period_to: Optional[str] = None,
+    department: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=PAGE_SIZE_LIMIT),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {"employees": await aggregate_overtime_share(analytics_match(period_from, period_to), department, limit)}
+
+FORECAST_PERIODS = 6
+FORECAST_MIN_RECORDS = 5
+FORECAST_GROUPS = ("department", "employee_id")
+
+cpu_executor = ProcessPoolExecutor(
+    max_workers=int(os.environ.get("CPU_WORKERS", os.cpu_count() or 2)),
+    mp_context=multiprocessing.get_context("spawn")
+)
+# Fitted forecasts by series key; entries evicted here are reloaded from forecast_results.
+forecast_cache = LRUCache(maxsize=int(os.environ.get("FORECAST_CACHE_SIZE", "2000")))
+forecast_refreshes = {}
+
+async def refresh_forecast(key, points, periods, fingerprint):
+    loop = asyncio.get_running_loop()
+    with span("cpu", "forecast_fit"):
+        result = await loop.run_in_executor(cpu_executor, fit_forecast, points, periods)
+    entry = {
+        "fingerprint": fingerprint,
+        "forecast": result,
+        "computed_at": datetime.now(timezone.utc).isoformat()
+    }
+    forecast_cache[key] = entry
+    await db.forecast_results.replace_one({"_id": key}, entry, upsert=True)
+    return entry
+
+def schedule_forecast_refresh(key, points, periods, fingerprint):
+    """Start (or join) a background refit of `key`; at most one refit per fingerprint runs at a time."""
+    running = forecast_refreshes.get(key)
+    if running and not running.done() and running.fingerprint == fingerprint:
+        return running
+
+    task = asyncio.create_task(refresh_forecast(key, points, periods, fingerprint))
+    task.fingerprint = fingerprint
+
+    def finished(done):
+        if forecast_refreshes.get(key) is done:
+            del forecast_refreshes[key]
+        if not done.cancelled() and done.exception():
+            logging.error(f"Forecast refresh for {key} failed: {done.exception()}")
+
+    task.add_done_callback(finished)
+    forecast_refreshes[key] = task
+    return task
+
+async def get_cached_forecasts(series_by_key, periods):
+    """Serve cached forecasts for many series at once.
+
+    Series whose fingerprint changed are refit in the background (all in parallel across the
+    process pool) and served stale; series never fitted before are awaited together.
+    """
+    cached_entries = {key: forecast_cache[key] for key in series_by_key if key in forecast_cache}
+    missing = [key for key in series_by_key if key not in cached_entries]
+    if missing:
+        async for entry in db.forecast_results.find({"_id": {"$in": missing}}):
+            key = entry.pop("_id")
+            forecast_cache[key] = cached_entries[key] = entry
+
+    results, first_fits = {}, {}
+    for key, points in series_by_key.items():
+        fingerprint = series_fingerprint(points, periods)
+        cached = cached_entries.get(key)
+        if cached and cached["fingerprint"] == fingerprint:
+            results[key] = {**cached, "stale": False}
+            continue
+        refresh = schedule_forecast_refresh(key, points, periods, fingerprint)
+        if cached:
+            results[key] = {**cached, "stale": True}
+        else:
+            first_fits[key] = refresh
+
+    if first_fits:
+        fitted = await asyncio.gather(*(asyncio.shield(task) for task in first_fits.values()), return_exceptions=True)
+        for key, entry in zip(first_fits, fitted):
+            if isinstance(entry, BaseException):
+                results[key] = {"error": str(entry) or type(entry).__name__, "forecast": [], "computed_at": None, "stale": False}
+            else:
+                results[key] = {**entry, "stale": False}
+    return results
 
 @api_router.get("/analytics/forecast")
-async def get_payroll_forecast(current_user: dict = Depends(get_current_user)):
+async def get_payroll_forecast(
+    group_by: Optional[str] = Query(None, pattern="^(department|employee_id)$"),
+    horizon: int = Query(FORECAST_PERIODS, ge=1, le=36),
+    max_groups: int = Query(50, ge=1, le=PAGE_SIZE_LIMIT),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user["role"] not in ["admin", "hr"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     try:
-        records = await db.payroll_records.find({}, {"_id": 0}).to_list(1000)
-        
-        if len(records) < 5:
-            return {"message": "Not enough data for forecasting. Need at least 5 records.", "forecast": []}
+        series = await aggregate_monthly_series(group_by=group_by)
         
-        df_data = []
-        for record in records:
-            if not record.get("net_salary"):
-                continue
-            try:
-                y_value = float(record["net_salary"])
-            except (ValueError, TypeError):
+        if not group_by:
+            if sum(point["records"] for point in series) < FORECAST_MIN_RECORDS:
+                return {"message": "Not enough data for forecasting. Need at least 5 records.", "forecast": []}
+            
+            points = monthly_points(series)
+            if not points or sum(y for _, y in points) == 0:
+                return {"message": "No valid numeric payroll data found", "forecast": []}
+
+            key = f"company::{horizon}"
+            cached = (await get_cached_forecasts({key: points}, horizon))[key]
+            if "error" in cached:
+                raise RuntimeError(cached["error"])
+            return {"forecast": cached["forecast"], "computed_at": cached["computed_at"], "stale": cached["stale"]}
+
+        groups = {}
+        for point in series:
+            groups.setdefault(point["_id"].get("group") or "Unknown", []).append(point)
+
+        eligible, skipped = {}, []
+        for group, group_series in groups.items():
+            if sum(point["records"] for point in group_series) < FORECAST_MIN_RECORDS:
+                skipped.append(group)
                 continue
+            eligible[group] = monthly_points(group_series)
+        largest = sorted(eligible, key=lambda group: sum(y for _, y in eligible[group]), reverse=True)[:max_groups]
+        skipped += [group for group in eligible if group not in largest]
 
-            date_str = f"{record['year']}-{str(record['month']).zfill(2)}-01"
-            df_data.append({
-                "ds": pd.to_datetime(date_str),
-                "y": y_value
+        cached = await get_cached_forecasts(
+            {f"{group_by}:{group}::{horizon}": eligible[group] for group in largest}, horizon
+        )
+        forecasts = []
+        for group in largest:
+            entry = cached[f"{group_by}:{group}::{horizon}"]
+            forecasts.append({
+                "group": group,
+                "forecast": entry["forecast"],
+                "computed_at": entry["computed_at"],
+                "stale": entry["stale"],
+                **({"error": entry["error"]} if "error" in entry else {})
             })
-        
-        df = pd.DataFrame(df_data)
-        if df.empty or df["y"].sum() == 0:
-            return {"message": "No valid numeric payroll data found", "forecast": []}
-
-        df = pd.DataFrame(df_data)
-        df = df.groupby('ds')['y'].sum().reset_index()
-
-        df = df.set_index('ds').asfreq('MS')
-        df['y'] = df['y'].interpolate(method='linear')
-        df['y'] = df['y'].bfill().ffill()
-
-        df = df.reset_index()
-        print("Prophet input preview:")
-        print(df.head(10))
-
-        model = Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False,changepoint_prior_scale=1.5, interval_width=0.95, seasonality_mode="additive")
-        model.add_seasonality(name='quarterly', period=90, fourier_order=3)
-        model.fit(df)
-
-        future = model.make_future_dataframe(periods=6, freq='MS')
-        forecast = model.predict(future)
-
-        forecast_data = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].tail(12).to_dict("records")
-
-        result = []
-        for item in forecast_data:
-            yhat = max(0, item['yhat'])  
-            lower = max(0, item['yhat_lower'])
-            upper = max(0, item['yhat_upper'])
-
-            if upper > yhat * 2:
-                upper = yhat * 1.5
-
-            result.append({
-                "date": item['ds'].strftime('%Y-%m'),
-                "predicted_cost": round(yhat, 2),
-                "lower_bound": round(lower, 2),
-                "upper_bound": round(upper, 2)})
-
-        return {"forecast": result}
+        return {"group_by": group_by, "horizon": horizon, "forecasts": forecasts, "skipped": sorted(skipped, key=str)}
     except Exception as e:
         logging.error(f"Forecast error: {str(e)}")
         return {"message": f"Error generating forecast: {str(e)}", "forecast": []}
 
+ANOMALY_MIN_RECORDS = 10
+ANOMALY_MODEL_PATH = Path(os.environ.get("ANOMALY_MODEL_PATH", ROOT_DIR / "models" / "payroll_anomaly.joblib"))
+ANOMALY_COLUMNS = ["base_salary", "overtime_pay", "bonuses", "deductions", "net_salary", "department"]
+ANOMALY_FIELDS = {
+    "anomaly_score": "anomaly_score",
+    "is_anomaly": "is_anomaly",
+    "deviation_percent": "anomaly_deviation",
+    "reason": "anomaly_reason",
+}
+
+anomaly_state = {"model": None}
+anomaly_fit_lock = asyncio.Lock()
+
+async def load_payroll_columns():
+    """Stream the whole payroll history into columns for the anomaly detector."""
+    columns = {column: [] for column in ["id"] + ANOMALY_COLUMNS}
+    history = db.payroll_records.aggregate(department_stages() + [
+        {"$project": {"_id": 0, "id": 1, **{column: 1 for column in ANOMALY_COLUMNS}}}
+    ], batchSize=5000)
+    async for doc in history:
+        columns["id"].append(doc.get("id"))
+        columns["department"].append(doc.get("department") or "Unknown")
+        for column in ANOMALY_COLUMNS[:-1]:
+            columns[column].append(doc.get(column) or 0)
+    return columns
+
+async def write_anomaly_scores(ids, scored):
+    operations = [
+        UpdateOne({"id": record_id}, {"$set": {field: scored[key][i] for key, field in ANOMALY_FIELDS.items()}})
+        for i, record_id in enumerate(ids) if record_id
+    ]
+    for start in range(0, len(operations), INGEST_BATCH_SIZE):
+        await db.payroll_records.bulk_write(operations[start:start + INGEST_BATCH_SIZE], ordered=False)
+
+async def fit_anomaly_model():
+    """Refit on the full history in the CPU pool, persist the model and rescore every record."""
+    async with anomaly_fit_lock:
+        columns = await load_payroll_columns()
+        if len(columns["id"]) < ANOMALY_MIN_RECORDS:
+            return None
+        ANOMALY_MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
+        loop = asyncio.get_running_loop()
+        with span("cpu", "anomaly_fit"):
+            scored = await loop.run_in_executor(
+                cpu_executor,
+                anomaly.fit_and_save,
+                {column: columns[column] for column in ANOMALY_COLUMNS},
+                str(ANOMALY_MODEL_PATH)
+            )
+        await write_anomaly_scores(columns["id"], scored)
+        anomaly_state["model"] = await asyncio.to_thread(anomaly.load_model, ANOMALY_MODEL_PATH)
+        return anomaly_state["model"]
+
+async def get_anomaly_model():
+    if anomaly_state["model"] is None and ANOMALY_MODEL_PATH.exists():
+        anomaly_state["model"] = await asyncio.to_thread(anomaly.load_model, ANOMALY_MODEL_PATH)
+    return anomaly_state["model"]
+
+async def score_payroll_docs(docs):
+    """Score freshly computed payroll docs in place against the persisted model, if there is one."""
+    model = await get_anomaly_model()
+    if model is None or not docs:
+        return
+    columns = {column: [doc.get(column) or (0 if column != "department" else "Unknown") for doc in docs] for column in ANOMALY_COLUMNS}
+    try:
+        with span("cpu", "anomaly_score"):
+            scored = await asyncio.to_thread(anomaly.score_records, model, columns)
+    except Exception as e:
+        logging.error(f"Anomaly scoring failed: {str(e)}")
+        return
+    for i, doc in enumerate(docs):
+        for key, field in ANOMALY_FIELDS.items():
+            doc[field] = scored[key][i]
+
+REVIEW_BASELINE_MONTHS = 12
+
+payroll_baseline = anomaly.DepartmentBaseline(
+    alpha=float(os.environ.get("REVIEW_BASELINE_ALPHA", "0.05")),
+    threshold=float(os.environ.get("REVIEW_HOLD_ZSCORE", "4.0")),
+    min_relative_std=float(os.environ.get("REVIEW_MIN_RELATIVE_STD", "0.05"))
+)
+
+async def seed_payroll_baseline():
+    """Load per-department net salary statistics for the last REVIEW_BASELINE_MONTHS months."""
+    now = datetime.now(timezone.utc)
+    start_year, start_month = divmod(now.year * 12 + now.month - 1 - REVIEW_BASELINE_MONTHS, 12)
+    match = analytics_match(period_from=f"{start_year}-{start_month + 1:02d}")
+    try:
+        groups = await db.payroll_records.aggregate([{"$match": match}] + department_stages() + [
+            {"$group": {
+                "_id": "$department",
+                "count": {"$sum": 1},
+                "mean": {"$avg": "$net_salary"},
+                "mean_square": {"$avg": {"$multiply": ["$net_salary", "$net_salary"]}}
+            }}
+        ]).to_list(None)
+    except Exception as e:
+        logging.error(f"Could not seed payroll review baseline: {str(e)}")
+        return
+    for group in groups:
+        variance = max(group["mean_square"] - group["mean"] ** 2, 0.0)
+        payroll_baseline.seed(group["_id"], group["count"], group["mean"], variance ** 0.5)
+
+def hold_for_review(docs):
+    """Flag records whose net salary is far outside their department's rolling baseline.
+
+    Only scores; apply_payroll_side_effects folds a record into the baseline once it is stored.
+    """
+    for doc in docs:
+        z, held = payroll_baseline.check(doc.get("department") or "Unknown", doc["net_salary"])
+        doc["review_score"] = None if z is None else round(min(z, 1e6), 2)
+        if held:
+            doc["status"] = "held_for_review"
+
+@api_router.post("/payroll/{record_id}/review", response_model=PayrollRecord)
+async def review_payroll(record_id: str, review: PayrollReview, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    if review.approve:
+        record = await db.payroll_records.find_one_and_update(
+            {"id": record_id, "status": "held_for_review"},
+            {"$set": {
+                "status": "processed",
+                "pending_side_effects": list(PAYROLL_SIDE_EFFECTS),
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }},
+            return_document=ReturnDocument.AFTER
+        )
+        if record is None:
+            # A retried approval finishes whatever the first attempt left pending.
+            record = await db.payroll_records.find_one(
+                {"id": record_id, "status": "processed", "pending_side_effects.0": {"$exists": True}}
+            )
+    else:
+        # Rejected records leave payroll_records so the period can be processed again with corrected data.
+        record = await db.payroll_records.find_one_and_delete({"id": record_id, "status": "held_for_review"})
+    if record is None:
+        raise HTTPException(status_code=404, detail="No held payroll record with this id")
+    record.pop("_id", None)
+
+    if review.approve:
+        await apply_payroll_side_effects([record], current_user["email"])
+    else:
+        record["status"] = "rejected"
+        await db.rejected_payroll.insert_one({
+            **record,
+            "rejected_by": current_user["email"],
+            "rejected_at": datetime.now(timezone.utc).isoformat(),
+            "note": review.note
+        })
+        record.pop("_id", None)
+    await db.audit_trail.insert_one({
+        "id": str(uuid.uuid4()),
+        "action": "payroll_review_approved" if review.approve else "payroll_review_rejected",
+        "employee_id": record["employee_id"],
+        "performed_by": current_user["email"],
+        "details": {"month": record["month"], "year": record["year"], "net_salary": record["net_salary"], "note": review.note},
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+    return record
+
 @api_router.get("/analytics/anomalies")
-async def detect_anomalies(current_user: dict = Depends(get_current_user)):
+async def detect_anomalies(
+    limit: int = Query(100, ge=1, le=PAGE_SIZE_LIMIT),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user["role"] not in ["admin", "hr"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     try:
-        records = await db.payroll_records.find({}, {"_id": 0}).to_list(1000)
-        
-        if len(records) < 10:
+        if await db.payroll_records.count_documents({}) < ANOMALY_MIN_RECORDS:
             return {"message": "Not enough data for anomaly detection. Need at least 10 records.", "anomalies": []}
         
-        salaries = np.array([record["net_salary"] for record in records]).reshape(-1, 1)
-        
-        clf = KNN(contamination=0.1)  
-        clf.fit(salaries)
-        
-        predictions = clf.labels_ 
-        scores = clf.decision_scores_
-        mean_salary = float(np.mean(salaries))
+        model = await get_anomaly_model() or await fit_anomaly_model()
+
+        records = await db.payroll_records.find(
+            {"is_anomaly": True},
+            {"_id": 0, "employee_id": 1, "employee_name": 1, "month": 1, "year": 1, "net_salary": 1,
+             "anomaly_score": 1, "anomaly_deviation": 1, "anomaly_reason": 1}
+        ).sort("anomaly_score", -1).limit(limit).to_list(limit)
 
-        
         anomalies = []
-        for i, (record, is_anomaly, score) in enumerate(zip(records, predictions, scores)):
-            if is_anomaly == 1:
-                formatted_score = round(float(score) / 1000, 2)
-                deviation = round(((record["net_salary"] - mean_salary) / mean_salary) * 100, 2)
-
-                anomalies.append({
-                    "employee_id": record["employee_id"],
-                    "employee_name": record["employee_name"],
-                    "month": record["month"],
-                    "year": record["year"],
-                    "net_salary": record["net_salary"],
-                    "anomaly_score": formatted_score,
-                    "deviation_percent": deviation,
-                    "reason": "Unusual salary amount detected"
-                })
+        for record in records:
+            anomalies.append({
+                "employee_id": record["employee_id"],
+                "employee_name": record["employee_name"],
+                "month": record["month"],
+                "year": record["year"],
+                "net_salary": record["net_salary"],
+                "anomaly_score": round(record["anomaly_score"], 2),
+                "deviation_percent": round(record.get("anomaly_deviation", 0), 2),
+                "reason": record.get("anomaly_reason", "Unusual salary amount detected")
+            })
         
-        return {"note": "All numeric values are rounded off to 2 decimal places.","anomalies": anomalies}
+        return {
+            "note": "All numeric values are rounded off to 2 decimal places.",
+            "model": {"fitted_at": model["fitted_at"], "n_samples": model["n_samples"]},
+            "anomalies": anomalies
+        }
     except Exception as e:
         logging.error(f"Anomaly detection error: {str(e)}")
         return {"message": "Error detecting anomalies", "anomalies": []}
 
-import httpx
+@api_router.post("/analytics/anomalies/refit")
+async def refit_anomaly_model(background: bool = False, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if background:
+        return job_accepted(await submit_job("anomaly_refit", {}, current_user))
+    return await refit_anomaly_summary()
 
-from datetime import datetime
+async def refit_anomaly_summary():
+    model = await fit_anomaly_model()
+    if model is None:
+        return {"message": "Not enough data for anomaly detection. Need at least 10 records."}
+    return {"fitted_at": model["fitted_at"], "n_samples": model["n_samples"], "threshold": model["threshold"]}
 
-@api_router.post("/chatbot")
-async def chat_with_bot(chat_data: ChatMessage, current_user: dict = Depends(get_current_user)):
-    try:
-        user_id = str(current_user.get("_id") or current_user.get("id") or current_user.get("username") or current_user.get("email", "anonymous_user"))
-        total_employees = await db.employees.count_documents({"status": "active"})
-        recent_payroll = await db.payroll_records.find().sort("created_at", -1).limit(5).to_list(5)
+import httpx
 
-        history_cursor = db.chat_history.find({"user_id": user_id}).sort("timestamp", -1).limit(10)
-        previous_chats = await history_cursor.to_list(10)
-        previous_chats = list(reversed(previous_chats))
+from datetime import datetime
 
-        conversation_history = []
-        for chat in previous_chats:
-            conversation_history.append({"role": "user", "content": chat["user_message"]})
-            conversation_history.append({"role": "assistant", "content": chat["bot_reply"]})
+CHAT_HISTORY_TURNS = 10
+CHAT_CONTEXT_TTL = int(os.environ.get("CHAT_CONTEXT_TTL", "30"))
+CHAT_FALLBACK_REPLY = "I'm having trouble processing your request right now. Please try again later."
+chat_context_cache = TTLCache(maxsize=1, ttl=CHAT_CONTEXT_TTL)
+llm_state = {"client": None}
+
+def get_llm_client():
+    """Shared client for the OpenAI-compatible backend, so chats reuse pooled keep-alive connections."""
+    if llm_state["client"] is None:
+        llm_state["client"] = httpx.AsyncClient(
+            base_url=os.environ['OPENROUTER_BASE_URL'],
+            headers={"Authorization": f"Bearer {os.environ['OPENROUTER_API_KEY']}"},
+            timeout=httpx.Timeout(60.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", "20")),
+                max_keepalive_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", "20"))
+            )
+        )
+    return llm_state["client"]
 
-        context = f"System context: {total_employees} active employees. Recent payrolls processed: {len(recent_payroll)}."
-        system_message = f"""
+async def get_chat_context():
+    context = chat_context_cache.get("stats")
+    if context is None:
+        total_employees = await db.employees.count_documents({"status": "active"})
+        recent_payroll = await db.payroll_records.count_documents({}, limit=5)
+        context = f"System context: {total_employees} active employees. Recent payrolls processed: {recent_payroll}."
+        chat_context_cache["stats"] = context
+    return context
+
+CHAT_KEYS = ["timestamp", "_id"]
+CHAT_HISTORY_PAGE_LIMIT = 200
+CHAT_SUMMARY_ENABLED = os.environ.get("CHAT_SUMMARY_ENABLED", "true").lower() != "false"
+CHAT_SUMMARY_TRIGGER = int(os.environ.get("CHAT_SUMMARY_TRIGGER", "20"))
+CHAT_SUMMARY_BATCH = 50
+chat_summary_cache = TTLCache(maxsize=int(os.environ.get("USER_CACHE_SIZE", "10000")), ttl=600)
+chat_compactions = {}
+
+def chat_user_id(current_user):
+    """One string key per user for chat_history and chat_summaries, so lookups hit the (user_id, timestamp) index."""
+    return str(current_user.get("id") or current_user["email"])
+
+def turns_after(user_id, summary):
+    if not summary.get("covered_until"):
+        return {"user_id": user_id}
+    return {"$and": [
+        {"user_id": user_id},
+        keyset_filter(CHAT_KEYS, [summary["covered_until"], summary["covered_id"]])
+    ]}
+
+async def get_chat_summary(user_id):
+    summary = chat_summary_cache.get(user_id)
+    if summary is None:
+        summary = await db.chat_summaries.find_one({"_id": user_id}) or {}
+        chat_summary_cache[user_id] = summary
+    return summary
+
+async def build_chat_messages(user_id, message):
+    """System context, the rolling summary of older turns and at most CHAT_HISTORY_TURNS raw turns."""
+    summary = await get_chat_summary(user_id)
+    previous_chats = await db.chat_history.find(
+        turns_after(user_id, summary), {"_id": 0, "user_message": 1, "bot_reply": 1}
+    ).sort([(key, DESCENDING) for key in CHAT_KEYS]).limit(CHAT_HISTORY_TURNS).to_list(CHAT_HISTORY_TURNS)
+    previous_chats = list(reversed(previous_chats))
+
+    conversation_history = []
+    for chat in previous_chats:
+        conversation_history.append({"role": "user", "content": chat["user_message"]})
+        conversation_history.append({"role": "assistant", "content": chat["bot_reply"]})
+
+    context = await get_chat_context()
+    system_message = f"""
         You are an HR assistant for an Intelligent Payroll Management System.
         {context}
         Maintain context between chats, refer to past replies and respond accurately with payroll, HR and compliance logic.
         """
-
-        messages = [{"role": "system", "content": system_message}] + conversation_history + [
-            {"role": "user", "content": chat_data.message}
-        ]
-
-        payload = {
+    if summary.get("summary"):
+        system_message += f"\n        Summary of the earlier conversation with this user: {summary['summary']}\n"
+
+    return [{"role": "system", "content": system_message}] + conversation_history + [
+        {"role": "user", "content": message}
+    ]
+
+async def summarize_turns(previous_summary, turns):
+    transcript = "\n".join(f"User: {turn['user_message']}\nAssistant: {turn['bot_reply']}" for turn in turns)
+    prompt = (
+        f"Existing summary:\n{previous_summary or '(none)'}\n\nNew conversation turns:\n{transcript}\n\n"
+        "Rewrite the summary so it covers both, in at most 200 words. Keep names, figures, "
+        "decisions and open questions; drop greetings and small talk."
+    )
+    with span("llm", "summarize"):
+        response = await get_llm_client().post("/chat/completions", json={
             "model": os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            "messages": messages
+            "messages": [
+                {"role": "system", "content": "You condense HR assistant conversations into running summaries."},
+                {"role": "user", "content": prompt}
+            ]
+        })
+    response.raise_for_status()
+    text = response.json().get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+    if not text:
+        raise ValueError("Empty summary from chatbot backend")
+    return text
+
+async def compact_chat_history(user_id):
+    """Fold every turn but the newest CHAT_HISTORY_TURNS into the user's rolling summary.
+
+    Raw turns stay in chat_history for the history endpoint; only the prompt stops reading them.
+    """
+    summary = await db.chat_summaries.find_one({"_id": user_id}) or {}
+    pending = await db.chat_history.count_documents(turns_after(user_id, summary))
+    folded = 0
+    while pending > CHAT_HISTORY_TURNS:
+        take = min(CHAT_SUMMARY_BATCH, pending - CHAT_HISTORY_TURNS)
+        turns = await db.chat_history.find(
+            turns_after(user_id, summary), {"user_message": 1, "bot_reply": 1, "timestamp": 1}
+        ).sort([(key, ASCENDING) for key in CHAT_KEYS]).limit(take).to_list(take)
+        summary = {
+            "summary": await summarize_turns(summary.get("summary"), turns),
+            "covered_until": turns[-1]["timestamp"],
+            "covered_id": turns[-1]["_id"],
+            "turns_summarized": summary.get("turns_summarized", 0) + len(turns),
+            "updated_at": datetime.now(timezone.utc).isoformat()
         }
+        await db.chat_summaries.update_one({"_id": user_id}, {"$set": summary}, upsert=True)
+        chat_summary_cache.pop(user_id, None)
+        folded += len(turns)
+        pending -= len(turns)
+    return folded
+
+def schedule_chat_compaction(user_id):
+    if not CHAT_SUMMARY_ENABLED or user_id in chat_compactions:
+        return
+
+    async def compact():
+        summary = await get_chat_summary(user_id)
+        if await db.chat_history.count_documents(turns_after(user_id, summary)) > CHAT_SUMMARY_TRIGGER:
+            await compact_chat_history(user_id)
+
+    def finished(task):
+        chat_compactions.pop(user_id, None)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Chat compaction failed for {user_id}: {task.exception()}")
+
+    task = asyncio.create_task(compact())
+    chat_compactions[user_id] = task
+    task.add_done_callback(finished)
+
+async def save_chat(user_id, message, reply):
+    await db.chat_history.insert_one({
+        "user_id": user_id,
+        "user_message": message,
+        "bot_reply": reply,
+        "timestamp": datetime.utcnow()
+    })
+    schedule_chat_compaction(user_id)
 
-        headers = {
-            "Authorization": f"Bearer {os.environ['OPENROUTER_API_KEY']}",
-            "Content-Type": "application/json"
-        }
+@api_router.post("/chatbot")
+async def chat_with_bot(chat_data: ChatMessage, current_user: dict = Depends(get_current_user)):
+    try:
+        user_id = chat_user_id(current_user)
+        messages = await build_chat_messages(user_id, chat_data.message)
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{os.environ['OPENROUTER_BASE_URL']}/chat/completions",
-                headers=headers,
-                json=payload
+        with span("llm", "chat_completion"):
+            response = await get_llm_client().post(
+                "/chat/completions",
+                json={"model": os.getenv("OPENAI_MODEL", "gpt-4o-mini"), "messages": messages}
             )
 
         if response.status_code != 200:
@@ -788,13 +3176,8 @@ async def chat_with_bot(chat_data: ChatMessage, current_user: dict = Depends(get
 
         if not reply.strip():
             logging.warning(f"No content in chatbot reply: {data}")
-            reply = "I'm having trouble processing your request right now. Please try again later."
-        await db.chat_history.insert_one({
-            "user_id": user_id,
-            "user_message": chat_data.message,
-            "bot_reply": reply,
-            "timestamp": datetime.utcnow()
-        })
+            reply = CHAT_FALLBACK_REPLY
+        await save_chat(user_id, chat_data.message, reply)
 
         return {"response": reply.strip()}
 
@@ -802,6 +3185,486 @@ async def chat_with_bot(chat_data: ChatMessage, current_user: dict = Depends(get
         logging.error(f"Chatbot error: {str(e)}")
         return {"response": "I'm having trouble processing your request. Please try again."}
 
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@api_router.post("/chatbot/stream")
+async def stream_chat_with_bot(chat_data: ChatMessage, current_user: dict = Depends(get_current_user)):
+    """Same as /chatbot, but relays the completion as server-sent events while the model generates it.
+
+    Emits `data: {"delta": ...}` per token, then `event: done` with the full reply,
+    or `event: error` if the backend fails.
+    """
+    user_id = chat_user_id(current_user)
+    messages = await build_chat_messages(user_id, chat_data.message)
+    payload = {"model": os.getenv("OPENAI_MODEL", "gpt-4o-mini"), "messages": messages, "stream": True}
+
+    async def generate():
+        parts = []
+        started = time.perf_counter()
+        try:
+            async with get_llm_client().stream("POST", "/chat/completions", json=payload) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    logging.error(f"OpenRouter API error: {body.decode(errors='replace')}")
+                    yield sse_event({"message": "Chatbot service error. Please try again later."}, "error")
+                    return
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    choice = (json.loads(data).get("choices") or [{}])[0]
+                    delta = choice.get("delta", {}).get("content") or choice.get("text") or ""
+                    if delta:
+                        if not parts:
+                            record_span("llm", "chat_stream_first_token", time.perf_counter() - started)
+                        parts.append(delta)
+                        yield sse_event({"delta": delta})
+            record_span("llm", "chat_stream", time.perf_counter() - started)
+        except Exception as e:
+            logging.error(f"Chatbot stream error: {str(e)}")
+            yield sse_event({"message": "I'm having trouble processing your request. Please try again."}, "error")
+            return
+
+        reply = "".join(parts)
+        if not reply.strip():
+            reply = CHAT_FALLBACK_REPLY
+            yield sse_event({"delta": reply})
+        await save_chat(user_id, chat_data.message, reply)
+        yield sse_event({"response": reply.strip()}, "done")
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/chatbot/history")
+async def get_chat_history(
+    limit: int = Query(50, ge=1, le=CHAT_HISTORY_PAGE_LIMIT),
+    before: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Newest `limit` turns (oldest first within the page); X-Next-Cursor pages further back via `before`."""
+    query = {"user_id": chat_user_id(current_user)}
+    if before:
+        timestamp, chat_id = decode_cursor(before, CHAT_KEYS)
+        try:
+            values = [datetime.fromisoformat(timestamp), ObjectId(chat_id)]
+        except Exception:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = {"$and": [query, keyset_filter(CHAT_KEYS, values, op="$lt")]}
+
+    chats = await db.chat_history.find(query).sort(
+        [(key, DESCENDING) for key in CHAT_KEYS]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    headers = {}
+    if len(chats) > limit:
+        chats = chats[:limit]
+        headers["X-Next-Cursor"] = encode_cursor([chats[-1]["timestamp"].isoformat(), str(chats[-1]["_id"])])
+    chats = [serialize_doc(chat) for chat in reversed(chats)]
+    return JSONResponse(content=jsonable_encoder(chats), headers=headers)
+
+JOB_WORKERS = {
+    "cpu": int(os.environ.get("JOB_CPU_WORKERS", "1")),
+    "io": int(os.environ.get("JOB_IO_WORKERS", "4")),
+}
+JOB_HEARTBEAT_SECONDS = 10
+JOB_LEASE_SECONDS = 60
+JOB_MAX_ATTEMPTS = 3
+JOB_PAGE_LIMIT = 200
+job_wakeups = {pool: asyncio.Event() for pool in JOB_WORKERS}
+job_state = {"workers": [], "running": {}, "cancelling": set()}
+
+class JobContext:
+    """Handed to job handlers for progress reporting; progress writes double as heartbeats."""
+
+    def __init__(self, job):
+        self.job = job
+        self.last_write = 0.0
+
+    async def progress(self, done, total=None, message=None, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_write < 1:
+            return
+        self.last_write = now
+        await db.jobs.update_one({"id": self.job["id"], "status": "running"}, {"$set": {
+            "progress": {"done": done, "total": total, "message": message},
+            "heartbeat_at": datetime.now(timezone.utc).isoformat()
+        }})
+
+async def payroll_run_job(context, params):
+    return await execute_payroll_run(
+        PayrollRun(**params), context.job["created_by"], context.progress, request_key=f"job:{context.job['id']}"
+    )
+
+async def anomaly_refit_job(context, params):
+    return await refit_anomaly_summary()
+
+async def aggregates_rebuild_job(context, params):
+    return await rebuild_payroll_aggregates()
+
+async def graph_reconcile_job(context, params):
+    return await reconcile_graph(full=params.get("full", False), dry_run=params.get("dry_run", False))
+
+async def payroll_recompute_job(context, params):
+    return await recompute_dirty_payroll(context.job["created_by"], params.get("limit"), context.progress)
+
+# Every handler must be safe to run again from the start: a job interrupted by a
+# restart is requeued. A requeued payroll run reports the records it created before
+# the restart as processed and finishes their pending side effects.
+JOB_TYPES = {
+    "payroll_run": (payroll_run_job, "io", PayrollRun),
+    "anomaly_refit": (anomaly_refit_job, "cpu", None),
+    "aggregates_rebuild": (aggregates_rebuild_job, "io", None),
+    "graph_reconcile": (graph_reconcile_job, "io", None),
+    "payroll_recompute": (payroll_recompute_job, "io", PayrollRecompute),
+}
+
+async def submit_job(job_type, params, current_user):
+    _, pool, _ = JOB_TYPES[job_type]
+    job = {
+        "id": str(uuid.uuid4()),
+        "type": job_type,
+        "pool": pool,
+        "params": params,
+        "status": "queued",
+        "progress": None,
+        "attempts": 0,
+        "cancel_requested": False,
+        "created_by": current_user["email"],
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.jobs.insert_one(job)
+    job.pop("_id", None)
+    job_wakeups[pool].set()
+    return job
+
+def job_accepted(job):
+    return JSONResponse(status_code=202, content={
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/api/jobs/{job['id']}"
+    })
+
+async def requeue_stale_jobs():
+    """Requeue running jobs whose worker stopped heartbeating (e.g. the process restarted)."""
+    stale_before = (datetime.now(timezone.utc) - timedelta(seconds=JOB_LEASE_SECONDS)).isoformat()
+    stale = {"status": "running", "heartbeat_at": {"$lt": stale_before}}
+    now = datetime.now(timezone.utc).isoformat()
+    await db.jobs.update_many({**stale, "cancel_requested": True}, {"$set": {"status": "cancelled", "finished_at": now}})
+    await db.jobs.update_many({**stale, "attempts": {"$gte": JOB_MAX_ATTEMPTS}}, {"$set": {
+        "status": "failed", "error": "Interrupted too many times", "finished_at": now
+    }})
+    await db.jobs.update_many(stale, {"$set": {"status": "queued"}})
+
+async def claim_job(pool):
+    now = datetime.now(timezone.utc).isoformat()
+    job = await db.jobs.find_one_and_update(
+        {"status": "queued", "pool": pool},
+        {"$set": {"status": "running", "started_at": now, "heartbeat_at": now}, "$inc": {"attempts": 1}},
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+    if job is not None:
+        job.pop("_id", None)
+    return job
+
+async def job_heartbeat(job_id, task):
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        job = await db.jobs.find_one_and_update(
+            {"id": job_id, "status": "running"},
+            {"$set": {"heartbeat_at": datetime.now(timezone.utc).isoformat()}},
+            return_document=ReturnDocument.AFTER
+        )
+        # Cancellation requested through another process.
+        if job is not None and job.get("cancel_requested"):
+            job_state["cancelling"].add(job_id)
+            task.cancel()
+
+async def run_job(job):
+    handler, _, _ = JOB_TYPES[job["type"]]
+    task = asyncio.create_task(handler(JobContext(job), job.get("params") or {}))
+    job_state["running"][job["id"]] = task
+    heartbeat = asyncio.create_task(job_heartbeat(job["id"], task))
+    try:
+        result = await task
+        update = {"status": "succeeded", "result": jsonable_encoder(result)}
+    except asyncio.CancelledError:
+        if job["id"] not in job_state["cancelling"]:
+            raise
+        update = {"status": "cancelled"}
+    except Exception as e:
+        logging.error(f"Job {job['id']} ({job['type']}) failed: {str(e)}")
+        update = {"status": "failed", "error": str(e)}
+    finally:
+        heartbeat.cancel()
+        job_state["running"].pop(job["id"], None)
+        job_state["cancelling"].discard(job["id"])
+
+    update["finished_at"] = datetime.now(timezone.utc).isoformat()
+    await db.jobs.update_one({"id": job["id"], "status": "running"}, {"$set": update})
+
+async def drain_jobs(pool):
+    await requeue_stale_jobs()
+    job = await claim_job(pool)
+    if job is None:
+        return False
+    await run_job(job)
+    return True
+
+def start_job_workers():
+    for pool, count in JOB_WORKERS.items():
+        for _ in range(count):
+            job_state["workers"].append(asyncio.create_task(
+                run_queue_worker(f"{pool} job", job_wakeups[pool], lambda pool=pool: drain_jobs(pool))
+            ))
+
+@api_router.post("/jobs", status_code=202)
+async def create_job(job_data: JobCreate, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    if job_data.type not in JOB_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unknown job type. Expected one of: {', '.join(JOB_TYPES)}")
+    _, _, params_model = JOB_TYPES[job_data.type]
+    params = job_data.params
+    if params_model is not None:
+        try:
+            params = params_model(**params).model_dump()
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+    return job_accepted(await submit_job(job_data.type, params, current_user))
+
+@api_router.get("/jobs")
+async def list_jobs(
+    status: Optional[str] = None,
+    type: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=JOB_PAGE_LIMIT),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    query = {}
+    if status:
+        query["status"] = status
+    if type:
+        query["type"] = type
+    return await db.jobs.find(query, {"_id": 0, "result": 0}).sort("created_at", DESCENDING).to_list(limit)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user["role"] not in ["admin", "hr"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    now = datetime.now(timezone.utc).isoformat()
+    queued = await db.jobs.update_one(
+        {"id": job_id, "status": "queued"},
+        {"$set": {"status": "cancelled", "cancel_requested": True, "finished_at": now}}
+    )
+    if not queued.modified_count:
+        running = await db.jobs.update_one({"id": job_id, "status": "running"}, {"$set": {"cancel_requested": True}})
+        if running.modified_count and job_id in job_state["running"]:
+            job_state["cancelling"].add(job_id)
+            job_state["running"][job_id].cancel()
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0, "result": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+MONGO_INDEXES = [
+    ("employees", [("employee_id", ASCENDING)], {}),
+    ("employees", [("email", ASCENDING)], {}),
+    ("employees", [("employee_id", ASCENDING), ("id", ASCENDING)], {}),
+    ("employees", [("department", ASCENDING), ("employee_id", ASCENDING), ("id", ASCENDING)], {}),
+    ("employees", [("status", ASCENDING), ("employee_id", ASCENDING), ("id", ASCENDING)], {}),
+    ("users", [("email", ASCENDING)], {}),
+    ("attendance_logs", [("employee_id", ASCENDING), ("date", ASCENDING)], {}),
+    ("attendance_logs", [("date", ASCENDING), ("id", ASCENDING)], {}),
+    ("attendance_logs", [("employee_id", ASCENDING), ("date", ASCENDING), ("id", ASCENDING)], {}),
+    ("payroll_records", [("employee_id", ASCENDING), ("month", ASCENDING), ("year", ASCENDING)], {"unique": True}),
+    ("payroll_records", [("created_at", DESCENDING)], {}),
+    ("payroll_records", [("id", ASCENDING)], {}),
+    ("payroll_records", [("year", ASCENDING), ("month", ASCENDING), ("id", ASCENDING)], {}),
+    ("payroll_records", [("employee_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING), ("id", ASCENDING)], {}),
+    ("payroll_records", [("is_anomaly", ASCENDING), ("anomaly_score", DESCENDING)], {}),
+    ("chat_history", [("user_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)], {}),
+    ("notifications", [("status", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+    ("notifications", [("claim_id", ASCENDING)], {"sparse": True}),
+    ("graph_outbox", [("status", ASCENDING), ("next_attempt_at", ASCENDING)], {}),
+    ("graph_outbox", [("status", ASCENDING), ("created_at", ASCENDING)], {}),
+    ("graph_outbox", [("claim_id", ASCENDING)], {"sparse": True}),
+    ("employees", [("updated_at", ASCENDING)], {}),
+    ("jobs", [("id", ASCENDING)], {"unique": True}),
+    ("jobs", [("status", ASCENDING), ("pool", ASCENDING), ("created_at", ASCENDING)], {}),
+    ("jobs", [("status", ASCENDING), ("heartbeat_at", ASCENDING)], {}),
+    ("jobs", [("created_at", DESCENDING)], {}),
+    ("payroll_records", [("updated_at", ASCENDING)], {}),
+    ("idempotency_keys", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+    ("payroll_dirty", [("marked_at", ASCENDING)], {}),
+    ("payroll_adjustments", [("created_at", ASCENDING), ("id", ASCENDING)], {}),
+    ("payroll_adjustments", [("employee_id", ASCENDING), ("created_at", ASCENDING)], {}),
+    ("payroll_adjustments", [("pending_steps", ASCENDING)], {}),
+]
+
+HOT_QUERIES = [
+    {"name": "employee_by_id", "collection": "employees", "filter": {"employee_id": "EMP001"}},
+    {"name": "employee_by_email", "collection": "employees", "filter": {"email": "user@example.com"}},
+    {"name": "user_by_email", "collection": "users", "filter": {"email": "user@example.com"}},
+    {
+        "name": "attendance_for_month",
+        "collection": "attendance_logs",
+        "filter": {"employee_id": "EMP001", "date": {"$gte": "2024-01-01", "$lt": "2024-02-01"}},
+    },
+    {
+        "name": "payroll_duplicate_check",
+        "collection": "payroll_records",
+        "filter": {"employee_id": "EMP001", "month": "01", "year": 2024},
+    },
+    {
+        "name": "recent_payroll",
+        "collection": "payroll_records",
+        "filter": {},
+        "sort": [("created_at", DESCENDING)],
+        "limit": 5,
+    },
+    {
+        "name": "employee_page",
+        "collection": "employees",
+        "filter": {"$or": [{"employee_id": {"$gt": "EMP001"}}, {"employee_id": "EMP001", "id": {"$gt": "id"}}]},
+        "sort": [("employee_id", ASCENDING), ("id", ASCENDING)],
+        "limit": 101,
+    },
+    {
+        "name": "employee_page_for_department",
+        "collection": "employees",
+        "filter": {"department": "Engineering"},
+        "sort": [("employee_id", ASCENDING), ("id", ASCENDING)],
+        "limit": 101,
+    },
+    {
+        "name": "employee_page_for_status",
+        "collection": "employees",
+        "filter": {"status": "active"},
+        "sort": [("employee_id", ASCENDING), ("id", ASCENDING)],
+        "limit": 101,
+    },
+    {
+        "name": "attendance_page",
+        "collection": "attendance_logs",
+        "filter": {"$or": [{"date": {"$gt": "2024-01-01"}}, {"date": "2024-01-01", "id": {"$gt": "id"}}]},
+        "sort": [("date", ASCENDING), ("id", ASCENDING)],
+        "limit": 101,
+    },
+    {
+        "name": "attendance_page_for_employee",
+        "collection": "attendance_logs",
+        "filter": {"employee_id": "EMP001", "date": {"$gte": "2024-01-01", "$lte": "2024-01-31"}},
+        "sort": [("date", ASCENDING), ("id", ASCENDING)],
+        "limit": 101,
+    },
+    {
+        "name": "payroll_page",
+        "collection": "payroll_records",
+        "filter": {"$or": [{"year": {"$gt": 2024}}, {"year": 2024, "month": {"$gt": "01"}}]},
+        "sort": [("year", ASCENDING), ("month", ASCENDING), ("id", ASCENDING)],
+        "limit": 101,
+    },
+    {
+        "name": "payroll_page_for_employee",
+        "collection": "payroll_records",
+        "filter": {"employee_id": "EMP001"},
+        "sort": [("year", ASCENDING), ("month", ASCENDING), ("id", ASCENDING)],
+        "limit": 101,
+    },
+    {
+        "name": "chat_history_for_user",
+        "collection": "chat_history",
+        "filter": {"user_id": "user-id"},
+        "sort": [("timestamp", ASCENDING)],
+    },
+]
+
+async def ensure_indexes():
+    for collection, keys, options in MONGO_INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            # Typically a unique index blocked by existing duplicates; the app still works without it.
+            logging.error(f"Could not create index {keys} on {collection}: {str(e)}")
+
+def collect_plan_stages(plan, stages, index_names):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan:
+            index_names.append(plan["indexName"])
+        for value in plan.values():
+            collect_plan_stages(value, stages, index_names)
+    elif isinstance(plan, list):
+        for item in plan:
+            collect_plan_stages(item, stages, index_names)
+
+@api_router.get("/admin/query-plans")
+async def get_query_plans(current_user: dict = Depends(require_roles("admin"))):
+    reports = []
+    for query in HOT_QUERIES:
+        cursor = db[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        if query.get("limit"):
+            cursor = cursor.limit(query["limit"])
+        try:
+            explanation = await cursor.explain()
+        except Exception as e:
+            reports.append({"name": query["name"], "collection": query["collection"], "error": str(e), "uses_index": False})
+            continue
+
+        stages, index_names = [], []
+        collect_plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}), stages, index_names)
+        reports.append({
+            "name": query["name"],
+            "collection": query["collection"],
+            "stages": stages,
+            "indexes": sorted(set(index_names)),
+            "uses_index": "COLLSCAN" not in stages and bool(index_names or "IDHACK" in stages)
+        })
+
+    return {
+        "queries": reports,
+        "unindexed": [report["name"] for report in reports if not report["uses_index"]]
+    }
+
+@api_router.get("/metrics")
+async def get_metrics(current_user: dict = Depends(require_roles("admin"))):
+    """Prometheus text exposition: request and dependency latency histograms plus in-process cache and queue gauges."""
+    families = [
+        REQUEST_LATENCY.render(),
+        DEPENDENCY_LATENCY.render(),
+        render_gauges("auth_user_cache_events_total", "Authenticated-user cache hits, misses and invalidations", user_cache_stats, "event"),
+        render_gauges("auth_user_cache_size", "Entries in the authenticated-user cache", len(user_cache)),
+        render_gauges("password_hashing_in_flight", "bcrypt operations queued or running", password_queue_stats["in_flight"]),
+        render_gauges("password_hashing_completed_total", "bcrypt operations completed", password_queue_stats["completed"]),
+        render_gauges("password_hashing_queue_depth", "bcrypt operations waiting for a worker thread", password_queue_depth()),
+        render_gauges("graph_sync_flushed_total", "Graph outbox entries applied to Neo4j", graph_sync_state["flushed"]),
+        render_gauges("jobs_running", "Background jobs running in this process", len(job_state["running"])),
+        render_gauges("forecast_cache_size", "Cached forecast results", len(forecast_cache)),
+        render_gauges("simulation_snapshot_cache_size", "Cached payroll simulation snapshots", len(simulation_snapshots)),
+    ]
+    return Response(content="\n".join(families) + "\n", media_type="text/plain; version=0.0.4")
+
 app.include_router(api_router)
 
 app.add_middleware(
@@ -810,7 +3673,9 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
+app.add_middleware(RequestTimingMiddleware, slow_request_ms=float(os.environ.get("SLOW_REQUEST_MS", "1000")))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -818,7 +3683,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def startup_db_client():
+    await ensure_indexes()
+    await seed_payroll_baseline()
+    start_notification_worker()
+    await ensure_graph_schema()
+    start_graph_sync_worker()
+    start_job_workers()
+    # Built before the app takes traffic rather than alongside it.
+    if await db.payroll_aggregates.find_one({"_id": "totals"}) is None:
+        await rebuild_payroll_aggregates()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for state in (notification_state, graph_sync_state):
+        if state["worker"] is not None:
+            state["worker"].cancel()
+    for worker in job_state["workers"]:
+        worker.cancel()
     client.close()
     await neo4j_driver.close()
+    if llm_state["client"] is not None:
+        await llm_state["client"].aclose()
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
+    password_executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,304 @@
+"""Throughput and latency of the main API paths over synthetic data.
+
+In-process (default): seeds mongomock, or a real MongoDB with --mongo-url,
+replaces the Neo4j driver with a stub, delivers email to a local SMTP sink
+and drives the app through httpx's ASGI transport:
+
+    python benchmarks/api_suite.py --scale 10k --output results-10k.json
+    python benchmarks/api_suite.py --scale 100k --mongo-url mongodb://localhost:27017
+
+Against a live backend seeded with benchmarks/seed.py (same --scale and
+--history-months):
+
+    python benchmarks/api_suite.py --base-url http://localhost:8001 --output live.json
+
+Each scenario sends one cold request first (empty caches, model fits),
+reported as first_ms and left out of the percentiles and throughput. In
+process, the time each scenario spent per dependency (mongo, neo4j, bcrypt,
+cpu, smtp) is included from the app's span histogram. Compare result files
+with benchmarks/compare.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+import httpx
+
+from common import summarize
+from seed import (
+    ADMIN_EMAIL, ADMIN_PASSWORD, DEPARTMENTS, SCALES, add_seed_arguments, benchmark_periods, employee_code,
+    seed_database
+)
+from standins import SmtpSink, StubNeo4jDriver
+
+
+def paged(path, filters):
+    """GET `path` walking X-Next-Cursor, one cursor per filter set, starting over when a walk ends."""
+    cursors = [None] * len(filters)
+
+    async def call(client, i):
+        slot = i % len(filters)
+        params = dict(filters[slot], limit=100)
+        if cursors[slot]:
+            params["cursor"] = cursors[slot]
+        response = await client.get(path, params=params)
+        cursors[slot] = response.headers.get("X-Next-Cursor")
+        return response
+
+    return call
+
+
+def rotating_get(requests):
+    async def call(client, i):
+        path, params = requests[i % len(requests)]
+        return await client.get(path, params=params)
+
+    return call
+
+
+def build_scenarios(periods):
+    history = [f"{year}-{month}" for year, month in periods["history"]]
+    process_year, process_month = periods["process"]
+    run_year, run_month = periods["run"]
+
+    async def login(client, i):
+        return await client.post("/api/auth/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+
+    async def payroll_process(client, i):
+        return await client.post("/api/payroll/process", json={
+            "employee_id": employee_code(i), "month": process_month, "year": process_year
+        })
+
+    async def payroll_run(client, i):
+        return await client.post("/api/payroll/run", json={
+            "month": run_month, "year": run_year, "department": DEPARTMENTS[i % len(DEPARTMENTS)]
+        })
+
+    # name -> (request, default request count, items per response for items_per_second)
+    return {
+        "login": (login, 50, None),
+        "list_employees": (paged("/api/employees", [{"department": dept} for dept in DEPARTMENTS]), 200, None),
+        "list_payroll": (paged("/api/payroll", [{"period_from": p, "period_to": p} for p in history]), 200, None),
+        "list_attendance": (paged("/api/attendance", [{}]), 200, None),
+        "dashboard": (rotating_get([("/api/analytics/dashboard", {})]), 60, None),
+        "cost_analytics": (rotating_get([
+            ("/api/analytics/cost-by-department", {}),
+            ("/api/analytics/cost-by-month", {}),
+            ("/api/analytics/overtime-share", {}),
+        ]), 60, None),
+        "forecast": (rotating_get([
+            ("/api/analytics/forecast", {}),
+            ("/api/analytics/forecast", {"group_by": "department"}),
+        ]), 20, None),
+        "anomalies": (rotating_get([("/api/analytics/anomalies", {})]), 50, None),
+        "payroll_process": (payroll_process, 200, None),
+        "payroll_run": (payroll_run, len(DEPARTMENTS), lambda body: body.get("processed", 0)),
+    }
+
+
+def dependency_snapshot(app_module):
+    if app_module is None:
+        return {}
+    return {
+        f"{dependency}:{operation}": (count, total)
+        for (dependency, operation), (_, total, count) in app_module.DEPENDENCY_LATENCY.series.items()
+    }
+
+
+def dependency_delta(before, after, top=10):
+    delta = {}
+    for key, (count, total) in after.items():
+        old_count, old_total = before.get(key, (0, 0.0))
+        if count > old_count:
+            delta[key] = {"count": count - old_count, "total_ms": round((total - old_total) * 1000, 2)}
+    return dict(sorted(delta.items(), key=lambda item: item[1]["total_ms"], reverse=True)[:top])
+
+
+async def run_scenario(client, call, count, concurrency, items=None, app_module=None):
+    before = dependency_snapshot(app_module)
+    statuses = {}
+    latencies = []
+    processed_items = [0]
+
+    async def send(i):
+        started = time.perf_counter()
+        response = await call(client, i)
+        elapsed = time.perf_counter() - started
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if items and response.status_code < 400:
+            processed_items[0] += items(response.json())
+        return elapsed
+
+    first = await send(0)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def measured(i):
+        async with semaphore:
+            latencies.append(await send(i))
+
+    processed_items[0] = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(measured(i) for i in range(1, count)))
+    seconds = time.perf_counter() - started
+
+    result = {
+        "requests": count,
+        "errors": sum(n for code, n in statuses.items() if code >= 400),
+        "status_codes": {str(code): n for code, n in sorted(statuses.items())},
+        "first_ms": round(first * 1000, 2),
+        "seconds": round(seconds, 3),
+        "throughput_rps": round(len(latencies) / seconds, 2) if latencies and seconds else None,
+        "latency": summarize(latencies),
+    }
+    if items:
+        result["items_per_second"] = round(processed_items[0] / seconds, 2) if seconds else None
+    if app_module is not None:
+        result["dependencies"] = dependency_delta(before, dependency_snapshot(app_module))
+    return result
+
+
+def load_app(args, smtp_port, state_dir):
+    """Import the backend configured for the benchmark, with stubbed Neo4j and, unless --mongo-url, mongomock.
+
+    The anomaly model is kept under `state_dir`, so the cold fit is measured and the backend's own model is left alone.
+    """
+    os.environ.update({
+        "MONGO_URL": args.mongo_url or "mongodb://localhost:27017",
+        "DB_NAME": args.db_name,
+        "NEO4J_URI": "bolt://localhost:7687",
+        "NEO4J_USERNAME": "neo4j",
+        "NEO4J_PASSWORD": "benchmark",
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_USE_TLS": "false",
+        "SMTP_EMAIL": "payroll@example.com",
+        "SMTP_PASSWORD": "",
+        "ANOMALY_MODEL_PATH": str(Path(state_dir) / "payroll_anomaly.joblib"),
+    })
+    os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+    os.environ.setdefault("SLOW_REQUEST_MS", "60000")
+    import app as app_module
+
+    if not args.mongo_url:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("mongomock-motor is not installed; pip install mongomock-motor or pass --mongo-url")
+        app_module.client = AsyncMongoMockClient()
+        app_module.db = app_module.client[args.db_name]
+    app_module.neo4j_driver = StubNeo4jDriver()
+    return app_module
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_suite(args, client, names, periods, employees, app_module=None):
+    scenarios = build_scenarios(periods)
+    response = await client.post("/api/auth/login", json={"email": ADMIN_EMAIL, "password": ADMIN_PASSWORD})
+    response.raise_for_status()
+    client.headers["Authorization"] = f"Bearer {response.json()['token']}"
+
+    results = {}
+    for name in names:
+        call, default_count, items = scenarios[name]
+        count = default_count if name == "payroll_run" else args.requests or default_count
+        if name == "payroll_process":
+            count = min(count, employees)
+        results[name] = await run_scenario(client, call, count, args.concurrency, items, app_module)
+        latency = results[name]["latency"]
+        print(
+            f"{name:<16} first {results[name]['first_ms']:>9}ms  p50 {latency['p50_ms']}ms  "
+            f"p95 {latency['p95_ms']}ms  p99 {latency['p99_ms']}ms  {results[name]['throughput_rps']} req/s  "
+            f"errors {results[name]['errors']}",
+            file=sys.stderr
+        )
+    return results
+
+
+async def main(args):
+    employees = args.employees or SCALES[args.scale]
+    names = args.scenarios.split(",") if args.scenarios else list(build_scenarios(benchmark_periods(0)))
+    unknown = set(names) - set(build_scenarios(benchmark_periods(0)))
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    meta = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "mode": "live" if args.base_url else "in-process",
+        "mongo": "live" if args.base_url else ("mongodb" if args.mongo_url else "mongomock"),
+        "employees": employees,
+        "history_months": args.history_months,
+        "attendance_days": args.attendance_days,
+        "concurrency": args.concurrency,
+    }
+
+    if args.base_url:
+        periods = benchmark_periods(args.history_months)
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=600) as client:
+            results = await run_suite(args, client, names, periods, employees)
+    else:
+        sink = SmtpSink()
+        smtp_server = await sink.start("127.0.0.1", 0)
+        state_dir = tempfile.TemporaryDirectory(prefix="ipay-benchmark-")
+        app_module = load_app(args, smtp_server.sockets[0].getsockname()[1], state_dir.name)
+        started = time.perf_counter()
+        if args.mongo_url:
+            await app_module.client.drop_database(args.db_name)
+        seeded = await seed_database(
+            app_module.db, employees, args.history_months, args.attendance_days, args.seed
+        )
+        await app_module.rebuild_payroll_aggregates()
+        meta["seed_seconds"] = round(time.perf_counter() - started, 2)
+        meta["seeded"] = seeded["counts"]
+        print(f"Seeded {seeded['counts']} in {meta['seed_seconds']}s", file=sys.stderr)
+
+        await app_module.startup_db_client()
+        try:
+            transport = httpx.ASGITransport(app=app_module.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=600) as client:
+                results = await run_suite(args, client, names, seeded["periods"], employees, app_module)
+            meta["smtp_messages"] = len(sink.messages)
+            meta["neo4j_statements"] = app_module.neo4j_driver.statements
+        finally:
+            await app_module.shutdown_db_client()
+            smtp_server.close()
+            state_dir.cleanup()
+
+    report = {"meta": meta, "scenarios": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="Benchmark a live backend instead of an in-process app")
+    parser.add_argument("--mongo-url", help="In-process against this MongoDB (the --db-name database is dropped first)")
+    parser.add_argument("--db-name", default="ipay_benchmark")
+    add_seed_arguments(parser)
+    parser.add_argument("--scenarios", help="Comma-separated subset, in order (default: all)")
+    parser.add_argument("--requests", type=int, help="Requests per scenario (default: per-scenario; payroll_run is one per department)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    asyncio.run(main(parser.parse_args()))
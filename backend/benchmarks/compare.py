@@ -0,0 +1,72 @@
+"""Compare two api_suite.py result files scenario by scenario.
+
+    python benchmarks/compare.py baseline.json candidate.json [--fail-over 10]
+
+Prints p50/p95/p99 and throughput for both runs with the relative change.
+With --fail-over, exits non-zero if any scenario's p95 got worse by more
+than that percentage.
+"""
+import argparse
+import json
+import sys
+
+METRICS = (("p50_ms", "latency"), ("p95_ms", "latency"), ("p99_ms", "latency"), ("throughput_rps", None))
+
+
+def change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def compare(baseline, candidate):
+    rows = []
+    for name, new in candidate["scenarios"].items():
+        old = baseline["scenarios"].get(name)
+        if old is None:
+            continue
+        row = {"scenario": name}
+        for metric, section in METRICS:
+            old_value = (old[section] if section else old).get(metric)
+            new_value = (new[section] if section else new).get(metric)
+            row[metric] = (old_value, new_value, change(old_value, new_value))
+        rows.append(row)
+    return rows
+
+
+def main(args):
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.candidate) as fh:
+        candidate = json.load(fh)
+
+    for label, report in (("baseline", baseline), ("candidate", candidate)):
+        meta = report["meta"]
+        print(f"{label:<10} {meta.get('git_commit')} {meta['mode']}/{meta['mongo']} "
+              f"{meta['employees']} employees, concurrency {meta['concurrency']}")
+    if baseline["meta"]["employees"] != candidate["meta"]["employees"]:
+        print("warning: runs used different data scales")
+
+    regressions = []
+    print(f"\n{'scenario':<16}" + "".join(f"{metric:>30}" for metric, _ in METRICS))
+    for row in compare(baseline, candidate):
+        cells = []
+        for metric, _ in METRICS:
+            old_value, new_value, pct = row[metric]
+            cells.append(f"{old_value} -> {new_value} ({'n/a' if pct is None else f'{pct:+}%'})".rjust(30))
+        print(f"{row['scenario']:<16}" + "".join(cells))
+        pct = row["p95_ms"][2]
+        if args.fail_over is not None and pct is not None and pct > args.fail_over:
+            regressions.append(row["scenario"])
+
+    if regressions:
+        print(f"\np95 regressed by more than {args.fail_over}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--fail-over", type=float, help="Exit 1 if any p95 regresses by more than this percentage")
+    main(parser.parse_args())
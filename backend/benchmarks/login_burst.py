@@ -0,0 +1,107 @@
+"""Measure how a burst of logins affects the latency of unrelated endpoints.
+
+Run against a live backend (e.g. `uvicorn app:app --port 8001`):
+
+    python benchmarks/login_burst.py --base-url http://localhost:8001 --logins 200 --concurrency 50
+
+A probe request (GET /api/auth/me by default) is sent every --probe-interval
+seconds, first on an idle server and then while the login burst runs. The
+script prints p50/p95/p99 of the probe in both phases, plus login latency,
+and writes them as JSON when --output is given.
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+
+from common import summarize
+
+
+async def ensure_user(client, email, password):
+    response = await client.post("/api/auth/register", json={
+        "email": email, "password": password, "full_name": "Load Test", "role": "employee"
+    })
+    if response.status_code == 400:
+        response = await client.post("/api/auth/login", json={"email": email, "password": password})
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+async def probe(client, path, token, interval, stop):
+    latencies = []
+    headers = {"Authorization": f"Bearer {token}"}
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get(path, headers=headers)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def login_burst(client, email, password, logins, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def login():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post("/api/auth/login", json={"email": email, "password": password})
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    await asyncio.gather(*(login() for _ in range(logins)))
+    return latencies
+
+
+async def main(args):
+    email = args.email or f"loadtest-{uuid.uuid4().hex[:8]}@example.com"
+    limits = httpx.Limits(max_connections=args.concurrency + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120, limits=limits) as client:
+        token = await ensure_user(client, email, args.password)
+
+        stop = asyncio.Event()
+        idle_probe = asyncio.create_task(probe(client, args.probe_path, token, args.probe_interval, stop))
+        await asyncio.sleep(args.idle_seconds)
+        stop.set()
+        idle = await idle_probe
+
+        stop = asyncio.Event()
+        burst_probe = asyncio.create_task(probe(client, args.probe_path, token, args.probe_interval, stop))
+        started = time.perf_counter()
+        logins = await login_burst(client, email, args.password, args.logins, args.concurrency)
+        burst_seconds = time.perf_counter() - started
+        stop.set()
+        during_burst = await burst_probe
+
+    results = {
+        "base_url": args.base_url,
+        "probe_path": args.probe_path,
+        "logins": args.logins,
+        "concurrency": args.concurrency,
+        "burst_seconds": round(burst_seconds, 3),
+        "logins_per_second": round(args.logins / burst_seconds, 2),
+        "login_latency": summarize(logins),
+        "probe_idle": summarize(idle),
+        "probe_during_burst": summarize(during_burst),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8001")
+    parser.add_argument("--email", help="Existing account to log in with (a throwaway one is registered by default)")
+    parser.add_argument("--password", default="load-test-password")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--probe-path", default="/api/auth/me")
+    parser.add_argument("--probe-interval", type=float, default=0.02)
+    parser.add_argument("--idle-seconds", type=float, default=2.0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,207 @@
+"""Seed synthetic employees, attendance and payroll history for benchmarks.
+
+    python benchmarks/seed.py --mongo-url mongodb://localhost:27017 --db-name ipay_benchmark --scale 10k
+
+drops and refills the database. Start the backend against it afterwards so
+the dashboard aggregates are rebuilt on startup, then point
+benchmarks/api_suite.py at it with --base-url and the same --scale and
+--history-months. Data is deterministic for a given --seed.
+
+Periods are relative to the current month: payroll history covers the
+--history-months before it, the current month is left open for
+/api/payroll/process and the next month for /api/payroll/run. Attendance
+is only generated for the two open months.
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from passlib.context import CryptContext
+
+from payroll_engine import compute_payroll_columns
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+DEPARTMENTS = ("Engineering", "Sales", "Finance", "Operations", "Marketing", "HR")
+DESIGNATIONS = ("Associate", "Analyst", "Engineer", "Senior Engineer", "Manager", "Director")
+ADMIN_EMAIL = "bench-admin@example.com"
+ADMIN_PASSWORD = "benchmark-password"
+INSERT_BATCH_SIZE = 5_000
+OUTLIER_RATE = 0.005
+
+
+def shift_month(year, month, offset):
+    year, month = divmod(year * 12 + month - 1 + offset, 12)
+    return year, month + 1
+
+
+def benchmark_periods(history_months, today=None):
+    """Return {"history": [(year, "MM"), ...], "process": (year, "MM"), "run": (year, "MM")}."""
+    today = today or datetime.now(timezone.utc)
+
+    def period(offset):
+        year, month = shift_month(today.year, today.month, offset)
+        return year, f"{month:02d}"
+
+    return {
+        "history": [period(offset) for offset in range(-history_months, 0)],
+        "process": period(0),
+        "run": period(1),
+    }
+
+
+def employee_code(index):
+    return f"BENCH{index:06d}"
+
+
+def make_employees(count, rng, created_at):
+    return [
+        {
+            "id": f"bench-{index:06d}",
+            "employee_id": employee_code(index),
+            "name": f"Bench Employee {index}",
+            "email": f"bench{index:06d}@example.com",
+            "department": DEPARTMENTS[index % len(DEPARTMENTS)],
+            "designation": rng.choice(DESIGNATIONS),
+            "base_salary": round(rng.uniform(2_500, 12_000), 2),
+            "joining_date": f"{rng.randint(2015, 2023)}-{rng.randint(1, 12):02d}-01",
+            "status": "active",
+            "created_at": created_at,
+            "updated_at": created_at,
+        }
+        for index in range(count)
+    ]
+
+
+def make_attendance(employees, period, days, rng, created_at):
+    year, month = period
+    for employee in employees:
+        for day in range(1, days + 1):
+            yield {
+                "id": f"{employee['employee_id']}-{year}{month}{day:02d}",
+                "employee_id": employee["employee_id"],
+                "date": f"{year}-{month}-{day:02d}",
+                "hours_worked": 8.0,
+                "overtime_hours": rng.choice((0.0, 0.0, 0.0, 0.5, 1.0, 1.5, 2.0)),
+                "leaves": 0,
+                "created_at": created_at,
+            }
+
+
+def make_payroll(employees, period, rng, created_at):
+    """One processed record per employee, with a small share of outsized bonuses for the anomaly model."""
+    year, month = period
+    overtime = [rng.choice((0.0, 0.0, 2.0, 4.0, 8.0, 12.0)) for _ in employees]
+    bonuses = [round(rng.uniform(20_000, 60_000), 2) if rng.random() < OUTLIER_RATE else 0.0 for _ in employees]
+    columns = compute_payroll_columns([emp["base_salary"] for emp in employees], overtime, bonuses, 0.0)
+    overtime_pay = columns["overtime_pay"].tolist()
+    tax = columns["tax"].tolist()
+    net_salary = columns["net_salary"].tolist()
+    return [
+        {
+            "id": f"{employee['employee_id']}-{year}{month}",
+            "employee_id": employee["employee_id"],
+            "employee_name": employee["name"],
+            "month": month,
+            "year": year,
+            "base_salary": employee["base_salary"],
+            "overtime_pay": overtime_pay[i],
+            "bonuses": bonuses[i],
+            "deductions": 0.0,
+            "tax": tax[i],
+            "net_salary": net_salary[i],
+            "department": employee["department"],
+            "anomaly_score": None,
+            "is_anomaly": None,
+            "anomaly_deviation": None,
+            "anomaly_reason": None,
+            "review_score": None,
+            "status": "processed",
+            "created_at": created_at,
+        }
+        for i, employee in enumerate(employees)
+    ]
+
+
+async def insert_batches(collection, docs):
+    inserted = 0
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == INSERT_BATCH_SIZE:
+            await collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+async def seed_database(db, employees, history_months=6, attendance_days=5, seed=0):
+    """Fill an empty database; returns document counts and the periods used."""
+    rng = random.Random(seed)
+    created_at = datetime.now(timezone.utc).isoformat()
+    periods = benchmark_periods(history_months)
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+    await db.users.insert_one({
+        "id": "bench-admin",
+        "email": ADMIN_EMAIL,
+        "password": pwd_context.hash(ADMIN_PASSWORD),
+        "full_name": "Benchmark Admin",
+        "role": "admin",
+        "created_at": created_at,
+    })
+    employee_docs = make_employees(employees, rng, created_at)
+    counts = {"users": 1, "employees": await insert_batches(db.employees, employee_docs)}
+
+    counts["attendance_logs"] = 0
+    for period in (periods["process"], periods["run"]):
+        counts["attendance_logs"] += await insert_batches(
+            db.attendance_logs, make_attendance(employee_docs, period, attendance_days, rng, created_at)
+        )
+
+    counts["payroll_records"] = 0
+    for period in periods["history"]:
+        counts["payroll_records"] += await insert_batches(
+            db.payroll_records, make_payroll(employee_docs, period, rng, created_at)
+        )
+    return {"counts": counts, "periods": periods}
+
+
+async def main(args):
+    employees = args.employees or SCALES[args.scale]
+    client = AsyncIOMotorClient(args.mongo_url)
+    try:
+        await client.drop_database(args.db_name)
+        started = time.perf_counter()
+        seeded = await seed_database(
+            client[args.db_name], employees, args.history_months, args.attendance_days, args.seed
+        )
+        print(f"Seeded {args.db_name} in {time.perf_counter() - started:.1f}s: {seeded['counts']}")
+        print(f"Log in as {ADMIN_EMAIL} / {ADMIN_PASSWORD}")
+    finally:
+        client.close()
+
+
+def add_seed_arguments(parser):
+    parser.add_argument("--scale", choices=sorted(SCALES), default="1k")
+    parser.add_argument("--employees", type=int, help="Exact employee count (overrides --scale)")
+    parser.add_argument("--history-months", type=int, default=6, help="Months of processed payroll before the current one")
+    parser.add_argument("--attendance-days", type=int, default=5, help="Attendance logs per employee in each open month")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="ipay_benchmark")
+    add_seed_arguments(parser)
+    asyncio.run(main(parser.parse_args()))
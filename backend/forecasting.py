@@ -0,0 +1,61 @@
+import hashlib
+import json
+import logging
+
+import pandas as pd
+from prophet import Prophet
+
+
+def monthly_points(series):
+    """Turn aggregate_monthly_series rows into sorted (YYYY-MM-01, total) pairs."""
+    points = {}
+    for point in series:
+        date_str = f"{point['_id']['year']}-{str(point['_id']['month']).zfill(2)}-01"
+        points[date_str] = points.get(date_str, 0) + point["y"]
+    return sorted(points.items())
+
+
+def series_fingerprint(points, periods):
+    payload = json.dumps({"points": points, "periods": periods}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def fit_forecast(points, periods=6):
+    """Fit Prophet on monthly totals and return the last `2 * periods` months of predictions.
+
+    Runs in a worker process, so it only takes and returns plain data.
+    """
+    df = pd.DataFrame({"ds": pd.to_datetime([ds for ds, _ in points]), "y": [y for _, y in points]})
+
+    df = df.set_index('ds').asfreq('MS')
+    df['y'] = df['y'].interpolate(method='linear')
+    df['y'] = df['y'].bfill().ffill()
+
+    df = df.reset_index()
+    logging.debug(f"Prophet input preview:\n{df.head(10)}")
+
+    model = Prophet(yearly_seasonality=True, weekly_seasonality=False, daily_seasonality=False, changepoint_prior_scale=1.5, interval_width=0.95, seasonality_mode="additive")
+    model.add_seasonality(name='quarterly', period=90, fourier_order=3)
+    model.fit(df)
+
+    future = model.make_future_dataframe(periods=periods, freq='MS')
+    forecast = model.predict(future)
+
+    forecast_data = forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].tail(periods * 2).to_dict("records")
+
+    result = []
+    for item in forecast_data:
+        yhat = max(0, item['yhat'])
+        lower = max(0, item['yhat_lower'])
+        upper = max(0, item['yhat_upper'])
+
+        if upper > yhat * 2:
+            upper = yhat * 1.5
+
+        result.append({
+            "date": item['ds'].strftime('%Y-%m'),
+            "predicted_cost": round(yhat, 2),
+            "lower_bound": round(lower, 2),
+            "upper_bound": round(upper, 2)})
+
+    return result
@@ -0,0 +1,69 @@
+"""Maintenance commands, run from the backend directory: python manage.py <command>"""
+import argparse
+import asyncio
+import json
+
+import app
+
+
+async def rebuild_aggregates(args):
+    return await app.rebuild_payroll_aggregates()
+
+
+async def reconcile_graph(args):
+    return await app.reconcile_graph(full=args.full, dry_run=args.dry_run)
+
+
+async def compact_chats(args):
+    user_ids = [args.user_id] if args.user_id else await app.db.chat_history.distinct("user_id")
+    folded = {}
+    for user_id in user_ids:
+        count = await app.compact_chat_history(str(user_id))
+        if count:
+            folded[str(user_id)] = count
+    return {"users": len(user_ids), "turns_summarized": folded}
+
+
+async def recompute_payroll(args):
+    return await app.recompute_dirty_payroll(limit=args.limit)
+
+
+COMMANDS = {
+    "rebuild-aggregates": (rebuild_aggregates, "Recompute payroll_aggregates from raw payroll and employee records", []),
+    "reconcile-graph": (reconcile_graph, "Diff Neo4j against MongoDB and apply MERGE/DELETE corrections", [
+        ("--full", {"action": "store_true", "help": "Rescan everything instead of changes since the last run"}),
+        ("--dry-run", {"action": "store_true", "help": "Report drift without writing to Neo4j"}),
+    ]),
+    "compact-chats": (compact_chats, "Fold older chatbot turns into per-user rolling summaries", [
+        ("--user-id", {"help": "Only compact this user's history"}),
+    ]),
+    "recompute-payroll": (recompute_payroll, "Recompute payroll whose attendance changed after processing", [
+        ("--limit", {"type": int, "help": "Recompute at most this many (employee, month) pairs"}),
+    ]),
+}
+
+
+async def run(args):
+    handler, _, _ = COMMANDS[args.command]
+    try:
+        result = await handler(args)
+        print(json.dumps(result, indent=2, default=str))
+    finally:
+        if app.llm_state["client"] is not None:
+            await app.llm_state["client"].aclose()
+        app.client.close()
+        await app.neo4j_driver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payroll system maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text, arguments) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        for flag, options in arguments:
+            subparser.add_argument(flag, **options)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
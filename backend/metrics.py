@@ -0,0 +1,171 @@
+"""In-process latency histograms, per-request timing spans and Prometheus text exposition.
+
+Spans are recorded into a list held in a context variable for the current
+request, so a slow request can be logged with its breakdown; every span is
+also folded into the dependency histogram whether or not a request is active.
+"""
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+request_spans = ContextVar("request_spans", default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = f"{label_text}," if label_text else ""
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_gauges(name, help_text, values, label_name=None):
+    """Render a gauge family; `values` is a number, or a dict of label value -> number."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    if isinstance(values, dict):
+        for label, value in sorted(values.items()):
+            lines.append(f'{name}{{{label_name}="{_escape(label)}"}} {value}')
+    else:
+        lines.append(f"{name} {values}")
+    return "\n".join(lines)
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+DEPENDENCY_LATENCY = Histogram(
+    "dependency_duration_seconds", "Time spent in MongoDB, Neo4j, bcrypt, LLM, SMTP and CPU-pool work",
+    ("dependency", "operation")
+)
+
+
+def record_span(dependency, operation, seconds):
+    DEPENDENCY_LATENCY.observe((dependency, operation), seconds)
+    spans = request_spans.get()
+    if spans is not None:
+        spans.append((dependency, operation, seconds))
+
+
+@contextmanager
+def span(dependency, operation):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(dependency, operation, time.perf_counter() - started)
+
+
+def summarize_spans(spans):
+    """Collapse spans into `dependency:operation xN total_ms`, slowest first."""
+    totals = {}
+    for dependency, operation, seconds in spans:
+        entry = totals.setdefault(f"{dependency}:{operation}", [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+    return [
+        f"{key} x{count} {total * 1000:.1f}ms"
+        for key, (count, total) in sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+    ]
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Times every MongoDB command. Motor runs these in executor threads that inherit the request context."""
+
+    def __init__(self):
+        self.collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self.collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event):
+        collection = self.collections.pop((event.connection_id, event.request_id), "")
+        operation = f"{event.command_name}:{collection}" if collection else event.command_name
+        record_span("mongo", operation, event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+class RequestTimingMiddleware:
+    """Pure ASGI middleware: per-route latency histogram and slow-request logging with span breakdown."""
+
+    def __init__(self, app, slow_request_ms=1000):
+        self.app = app
+        self.slow_request_seconds = slow_request_ms / 1000
+        self.route_paths = {}
+
+    def route_label(self, scope):
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self.route_paths.get(endpoint)
+        if path is None:
+            router = scope["app"].router
+            self.route_paths = {route.endpoint: route.path for route in router.routes if hasattr(route, "endpoint")}
+            path = self.route_paths.get(endpoint, "unmatched")
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        spans = []
+        token = request_spans.set(spans)
+        status = [500]
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_spans.reset(token)
+            route = self.route_label(scope)
+            REQUEST_LATENCY.observe((scope["method"], route, str(status[0])), elapsed)
+            if elapsed >= self.slow_request_seconds:
+                logging.warning(
+                    f"Slow request {scope['method']} {scope['path']} ({route}) -> {status[0]} "
+                    f"in {elapsed * 1000:.1f}ms; spans: {', '.join(summarize_spans(spans)) or 'none'}"
+                )
@@ -0,0 +1,109 @@
+import html
+import smtplib
+from datetime import timedelta
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from string import Template
+
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+EMAIL_LAYOUT = Template("""
+        <html>
+            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+                <div style="max-width: 600px; margin: 0 auto; padding: 20px; border: 1px solid #ddd; border-radius: 10px;">
+                    <h2 style="color: #2563eb;">$subject</h2>
+                    <p>$greeting</p>
+                    <p>$main_text</p>
+                    <p><strong>Login/Action Time:</strong><br>
+                       $time_ist<br>
+                       $time_utc</p>
+                    <p>If you did not perform this action, please contact your administrator immediately.</p>
+                    <br>
+                    <p>Best regards,<br>Payroll System Team</p>
+                </div>
+            </body>
+        </html>
+        """)
+
+EVENT_TEMPLATES = {
+    "register": {
+        "subject": "Welcome to Intelligent Payroll System",
+        "greeting": "Welcome <strong>$role, $full_name</strong>!",
+        "main_text": (
+            "Your registration to the <strong>Intelligent Payroll Management System</strong> "
+            "was successful. You can now securely access your HR and payroll dashboard."
+        ),
+    },
+    "login": {
+        "subject": "Login Notification — Intelligent Payroll System",
+        "greeting": "Hello <strong>$role, $full_name</strong>,",
+        "main_text": (
+            "You have successfully logged in to your account on the "
+            "<strong>Intelligent Payroll Management System</strong>."
+        ),
+    },
+}
+
+
+def _compile_templates():
+    """Fill the static parts of each event into the layout once, leaving only per-recipient fields."""
+    compiled = {}
+    for event_type, parts in EVENT_TEMPLATES.items():
+        body = EMAIL_LAYOUT.safe_substitute(
+            subject=parts["subject"], greeting=parts["greeting"], main_text=parts["main_text"]
+        )
+        compiled[event_type] = (parts["subject"], Template(body))
+    return compiled
+
+
+COMPILED_TEMPLATES = _compile_templates()
+
+
+def render_notification(notification):
+    """Return (subject, html) for a queued notification document."""
+    subject, body = COMPILED_TEMPLATES.get(notification["type"], COMPILED_TEMPLATES["login"])
+    created_at = notification["created_at_dt"]
+    return subject, body.substitute(
+        role=html.escape(notification["role"].title()),
+        full_name=html.escape(notification["full_name"]),
+        time_ist=(created_at + IST_OFFSET).strftime("%B %d, %Y at %I:%M %p (IST)"),
+        time_utc=created_at.strftime("%B %d, %Y at %I:%M %p UTC"),
+    )
+
+
+def build_message(sender, recipient, subject, html_content):
+    message = MIMEMultipart("alternative")
+    message["Subject"] = subject
+    message["From"] = sender
+    message["To"] = recipient
+    message.attach(MIMEText(html_content, "html"))
+    return message
+
+
+def send_batch(settings, notifications, timeout=30):
+    """Deliver a batch over one SMTP connection and return {id: error or None}.
+
+    Blocking; call it from a worker thread. A connection-level failure marks
+    every unsent notification in the batch with that error.
+    """
+    results = {}
+    try:
+        with smtplib.SMTP(settings["host"], settings["port"], timeout=timeout) as server:
+            if settings["use_tls"]:
+                server.starttls()
+            if settings["password"]:
+                server.login(settings["email"], settings["password"])
+            for notification in notifications:
+                subject, html_content = render_notification(notification)
+                message = build_message(settings["email"], notification["email"], subject, html_content)
+                try:
+                    server.sendmail(settings["email"], notification["email"], message.as_string())
+                    results[notification["id"]] = None
+                except smtplib.SMTPServerDisconnected:
+                    raise
+                except smtplib.SMTPException as e:
+                    results[notification["id"]] = str(e)
+    except (smtplib.SMTPException, OSError) as e:
+        for notification in notifications:
+            results.setdefault(notification["id"], str(e))
+    return results
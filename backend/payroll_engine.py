@@ -0,0 +1,165 @@
+import numpy as np
+
+OVERTIME_DIVISOR = 160
+OVERTIME_MULTIPLIER = 1.5
+TAX_RATE = 0.15
+
+# x * 100 needs at most 60 significant bits, so it is exact in x87 extended
+# precision and rint() then rounds the true value just like Python's round().
+_EXACT_CENTS = np.finfo(np.longdouble).nmant >= 63
+
+
+def calculate_payroll(base_salary, total_overtime, bonuses, deductions,
+                      overtime_divisor=OVERTIME_DIVISOR,
+                      overtime_multiplier=OVERTIME_MULTIPLIER,
+                      tax_rate=TAX_RATE):
+    """Overtime is paid at 1.5x the hourly rate (base / 160 hours); tax is a flat 15% of gross."""
+    if total_overtime > 0:
+        overtime_rate = base_salary / overtime_divisor
+        overtime_pay = round(total_overtime * overtime_rate * overtime_multiplier, 2)
+    else:
+        overtime_pay = 0
+
+    gross_salary = base_salary + overtime_pay + bonuses
+    tax = gross_salary * tax_rate
+    net_salary = gross_salary - tax - deductions
+    return {"overtime_pay": overtime_pay, "tax": tax, "net_salary": net_salary}
+
+
+def round_cents(values):
+    """Vectorized round(x, 2) that agrees with the builtin bit for bit."""
+    values = np.asarray(values, dtype=np.float64)
+    if not _EXACT_CENTS:
+        # Where longdouble is just a double, x * 100 can round onto a half cent
+        # (4839.005 gives 4839.0 instead of 4839.01), so defer to the builtin itself.
+        return np.array([round(value, 2) for value in values.ravel().tolist()]).reshape(values.shape)
+    cents = np.rint(values.astype(np.longdouble) * 100).astype(np.float64)
+    return cents / 100
+
+
+def compute_payroll_columns(base_salaries, overtime_hours, bonuses=0.0, deductions=0.0,
+                            overtime_divisor=OVERTIME_DIVISOR,
+                            overtime_multiplier=OVERTIME_MULTIPLIER,
+                            tax_rate=TAX_RATE):
+    """Columnar version of calculate_payroll.
+
+    Accepts arrays, pandas Series or scalars (broadcast against base_salaries)
+    and returns a dict of float64 arrays. The arithmetic is performed in the
+    same order as calculate_payroll, so every element is identical to the
+    per-record result.
+    """
+    base = np.asarray(base_salaries, dtype=np.float64)
+    hours = np.broadcast_to(np.asarray(overtime_hours, dtype=np.float64), base.shape)
+    bonuses = np.broadcast_to(np.asarray(bonuses, dtype=np.float64), base.shape)
+    deductions = np.broadcast_to(np.asarray(deductions, dtype=np.float64), base.shape)
+    overtime_divisor = np.broadcast_to(np.asarray(overtime_divisor, dtype=np.float64), base.shape)
+    overtime_multiplier = np.broadcast_to(np.asarray(overtime_multiplier, dtype=np.float64), base.shape)
+    tax_rate = np.broadcast_to(np.asarray(tax_rate, dtype=np.float64), base.shape)
+
+    overtime_rate = base / overtime_divisor
+    overtime_pay = np.where(hours > 0, round_cents(hours * overtime_rate * overtime_multiplier), 0.0)
+
+    gross_salary = base + overtime_pay + bonuses
+    tax = gross_salary * tax_rate
+    net_salary = gross_salary - tax - deductions
+    return {
+        "overtime_pay": overtime_pay,
+        "gross_salary": gross_salary,
+        "tax": tax,
+        "net_salary": net_salary,
+    }
+
+
+def _distribution(values, bins):
+    if not len(values):
+        return {"percentiles": {}, "histogram": []}
+    percentiles = np.percentile(values, [10, 25, 50, 75, 90])
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        "percentiles": {f"p{p}": round(float(v), 2) for p, v in zip((10, 25, 50, 75, 90), percentiles)},
+        "histogram": [
+            {"from": round(float(edges[i]), 2), "to": round(float(edges[i + 1]), 2), "count": int(counts[i])}
+            for i in range(len(counts))
+        ],
+    }
+
+
+def _totals(base, columns):
+    return {
+        "base_salary": round(float(base.sum()), 2),
+        "overtime_pay": round(float(columns["overtime_pay"].sum()), 2),
+        "gross_salary": round(float(columns["gross_salary"].sum()), 2),
+        "tax": round(float(columns["tax"].sum()), 2),
+        "net_salary": round(float(columns["net_salary"].sum()), 2),
+    }
+
+
+def simulate_payroll(base_salaries, overtime_hours, department_index, departments, raises=None,
+                     overtime_divisor=OVERTIME_DIVISOR,
+                     overtime_multiplier=OVERTIME_MULTIPLIER,
+                     tax_rate=TAX_RATE,
+                     bins=10):
+    """Evaluate a what-if rule set against the current rules over a workforce snapshot.
+
+    `department_index[i]` points into `departments` for employee i and `raises`
+    maps department to a percentage raise of base salary. Bonuses and deductions
+    are left out since they are per-run inputs. Returns baseline and scenario
+    totals, the difference, a per-department breakdown and distributions of net
+    salary and of each employee's change.
+    """
+    base = np.asarray(base_salaries, dtype=np.float64)
+    index = np.asarray(department_index, dtype=np.intp)
+    raises = raises or {}
+    factors = np.array([1 + raises.get(department, 0.0) / 100 for department in departments], dtype=np.float64)
+    scenario_base = base * factors[index] if len(departments) else base
+
+    baseline = compute_payroll_columns(base, overtime_hours)
+    scenario = compute_payroll_columns(
+        scenario_base, overtime_hours,
+        overtime_divisor=overtime_divisor,
+        overtime_multiplier=overtime_multiplier,
+        tax_rate=tax_rate,
+    )
+
+    baseline_totals = _totals(base, baseline)
+    scenario_totals = _totals(scenario_base, scenario)
+    difference = {
+        key: {
+            "amount": round(scenario_totals[key] - baseline_totals[key], 2),
+            "percent": round((scenario_totals[key] - baseline_totals[key]) / baseline_totals[key] * 100, 2)
+            if baseline_totals[key] else None,
+        }
+        for key in baseline_totals
+    }
+
+    count = len(departments)
+    baseline_gross = np.bincount(index, weights=baseline["gross_salary"], minlength=count)
+    scenario_gross = np.bincount(index, weights=scenario["gross_salary"], minlength=count)
+    scenario_net = np.bincount(index, weights=scenario["net_salary"], minlength=count)
+    headcount = np.bincount(index, minlength=count)
+    by_department = sorted((
+        {
+            "department": departments[i],
+            "employees": int(headcount[i]),
+            "raise_percent": raises.get(departments[i], 0.0),
+            "baseline_gross": round(float(baseline_gross[i]), 2),
+            "scenario_gross": round(float(scenario_gross[i]), 2),
+            "scenario_net": round(float(scenario_net[i]), 2),
+            "gross_change": round(float(scenario_gross[i] - baseline_gross[i]), 2),
+        }
+        for i in range(count)
+    ), key=lambda row: row["scenario_gross"], reverse=True)
+
+    net_change = np.divide(
+        scenario["net_salary"] - baseline["net_salary"], np.abs(baseline["net_salary"]),
+        out=np.zeros_like(base), where=baseline["net_salary"] != 0
+    ) * 100
+    return {
+        "employees": int(len(base)),
+        "baseline": baseline_totals,
+        "scenario": scenario_totals,
+        "difference": difference,
+        "by_department": by_department,
+        "net_salary_distribution": _distribution(scenario["net_salary"], bins),
+        "net_change_percent_distribution": _distribution(net_change, bins),
+    }
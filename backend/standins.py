@@ -0,0 +1,251 @@
+"""Local stand-ins for external services, for development and load tests.
+
+    python standins.py smtp --port 1025 [--output sent.jsonl]
+    python standins.py openai --port 8081 [--token-delay 0.02]
+
+then run the backend with SMTP_HOST=localhost SMTP_PORT=1025 SMTP_USE_TLS=false,
+and OPENROUTER_BASE_URL=http://localhost:8081/v1 OPENROUTER_API_KEY=test.
+StubNeo4jDriver replaces the Neo4j driver in-process (see benchmarks/api_suite.py).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+class SmtpSink:
+    """Minimal SMTP server that accepts every message and records it.
+
+    Speaks just enough of RFC 5321 for smtplib: EHLO/HELO, AUTH (any
+    credentials), MAIL, RCPT, DATA, RSET, NOOP and QUIT. No STARTTLS.
+    """
+
+    def __init__(self, output=None):
+        self.output = output
+        self.messages = []
+        self.connections = 0
+
+    def record(self, sender, recipients, data):
+        entry = {
+            "received_at": datetime.now(timezone.utc).isoformat(),
+            "from": sender,
+            "to": recipients,
+            "size": len(data),
+        }
+        self.messages.append(entry)
+        if self.output:
+            with open(self.output, "a") as fh:
+                fh.write(json.dumps(entry) + "\n")
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        sender, recipients = None, []
+
+        async def reply(line):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 localhost SMTP sink ready")
+        try:
+            while True:
+                raw = await reader.readline()
+                if not raw:
+                    break
+                line = raw.decode(errors="replace").rstrip("\r\n")
+                verb = line.split(" ", 1)[0].upper()
+                if verb == "EHLO":
+                    await reply("250-localhost")
+                    await reply("250-AUTH PLAIN LOGIN")
+                    await reply("250 8BITMIME")
+                elif verb == "HELO":
+                    await reply("250 localhost")
+                elif verb == "AUTH":
+                    await reply("235 Authentication successful")
+                elif verb == "MAIL":
+                    sender, recipients = line.split(":", 1)[1].strip().strip("<>"), []
+                    await reply("250 OK")
+                elif verb == "RCPT":
+                    recipients.append(line.split(":", 1)[1].strip().strip("<>"))
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    chunks = []
+                    while True:
+                        chunk = await reader.readline()
+                        if not chunk or chunk in (b".\r\n", b".\n"):
+                            break
+                        chunks.append(chunk)
+                    self.record(sender, recipients, b"".join(chunks))
+                    sender, recipients = None, []
+                    await reply("250 OK: queued")
+                elif verb == "RSET":
+                    sender, recipients = None, []
+                    await reply("250 OK")
+                elif verb == "NOOP":
+                    await reply("250 OK")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=1025):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve_smtp(args):
+    sink = SmtpSink(args.output)
+    server = await sink.start(args.host, args.port)
+    logging.info(f"SMTP sink listening on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+class _StubResult:
+    async def data(self):
+        return []
+
+    async def single(self):
+        return None
+
+    async def consume(self):
+        return None
+
+
+class _StubTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def run(self, statement, parameters=None, **kwargs):
+        self.driver.statements += 1
+        rows = (parameters or kwargs).get("rows")
+        self.driver.rows += len(rows) if isinstance(rows, list) else 0
+        return _StubResult()
+
+
+class _StubSession(_StubTransaction):
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute_write(self, work, *args, **kwargs):
+        return await work(_StubTransaction(self.driver), *args, **kwargs)
+
+    async def execute_read(self, work, *args, **kwargs):
+        return await work(_StubTransaction(self.driver), *args, **kwargs)
+
+
+class StubNeo4jDriver:
+    """Accepts every Cypher statement and returns no rows; counts statements and UNWIND rows written."""
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+
+    def session(self, **kwargs):
+        return _StubSession(self)
+
+    async def close(self):
+        pass
+
+
+MOCK_REPLY = (
+    "This is a canned reply from the local OpenAI-compatible stand-in. "
+    "Payroll is processed monthly; net salary is gross pay minus tax and deductions."
+)
+
+
+def create_openai_app(token_delay=0.02, first_token_delay=0.2, reply=MOCK_REPLY):
+    """OpenAI-compatible /v1/chat/completions that answers every prompt with `reply`.
+
+    Streaming requests get one chunk per word after `first_token_delay`, spaced by
+    `token_delay`; plain requests wait for the whole simulated generation.
+    """
+    mock = FastAPI()
+    tokens = [word + " " for word in reply.split(" ")]
+
+    def completion_id():
+        return f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+    @mock.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        created = int(time.time())
+
+        if not body.get("stream"):
+            await asyncio.sleep(first_token_delay + token_delay * len(tokens))
+            return {
+                "id": completion_id(),
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            }
+
+        async def events():
+            chunk_id = completion_id()
+            await asyncio.sleep(first_token_delay)
+            for token in tokens:
+                chunk = {
+                    "id": chunk_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(token_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return mock
+
+
+async def serve_openai(args):
+    mock = create_openai_app(token_delay=args.token_delay, first_token_delay=args.first_token_delay)
+    server = uvicorn.Server(uvicorn.Config(mock, host=args.host, port=args.port, log_level="warning"))
+    logging.info(f"OpenAI stand-in listening on {args.host}:{args.port} (base URL http://{args.host}:{args.port}/v1)")
+    await server.serve()
+
+
+STANDINS = {
+    "smtp": (serve_smtp, "Accept and record outgoing email", [
+        ("--output", {"help": "Append received messages as JSON lines to this file"}),
+    ]),
+    "openai": (serve_openai, "Answer OpenAI-compatible chat completions with a canned, optionally streamed reply", [
+        ("--token-delay", {"type": float, "default": 0.02, "help": "Seconds between streamed tokens"}),
+        ("--first-token-delay", {"type": float, "default": 0.2, "help": "Seconds before the first token"}),
+    ]),
+}
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Local stand-ins for external services")
+    subparsers = parser.add_subparsers(dest="service", required=True)
+    for name, (_, help_text, arguments) in STANDINS.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("--host", default="127.0.0.1")
+        subparser.add_argument("--port", type=int, default=1025 if name == "smtp" else 8081)
+        for flag, options in arguments:
+            subparser.add_argument(flag, **options)
+    args = parser.parse_args()
+    handler, _, _ = STANDINS[args.service]
+    asyncio.run(handler(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import app
+
+
+@pytest.fixture
+def payroll_db(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(app, "db", db)
+
+    async def seed():
+        await db.employees.insert_many([
+            {"id": "e1", "employee_id": "E001", "name": "Ada", "department": "Eng"},
+            {"id": "e2", "employee_id": "E002", "name": "Bob", "department": "Eng"},
+        ])
+        await db.payroll_records.insert_many([
+            {"id": "p1", "employee_id": "E001", "employee_name": "Ada", "department": "Eng", "month": "03", "year": 2024,
+             "gross_salary": 5000.0, "overtime_pay": 100.0, "tax": 1000.0, "net_salary": 4000.0, "status": "processed"},
+            {"id": "p2", "employee_id": "E002", "employee_name": "Bob", "department": "Eng", "month": "03", "year": 2024,
+             "gross_salary": 5000.0, "overtime_pay": 0.0, "tax": 1000.0, "net_salary": 4000.0},
+            {"id": "p3", "employee_id": "E001", "employee_name": "Ada", "department": "Eng", "month": "04", "year": 2024,
+             "gross_salary": 90000.0, "overtime_pay": 50000.0, "tax": 18000.0, "net_salary": 72000.0,
+             "status": "held_for_review"},
+        ])
+
+    asyncio.run(seed())
+    return db
+
+
+def test_cost_by_department_skips_held_records(payroll_db):
+    rows = asyncio.run(app.aggregate_cost_by_department(app.analytics_match()))
+    assert [(row["department"], row["net_salary"], row["records"]) for row in rows] == [("Eng", 8000.0, 2)]
+
+
+def test_cost_by_month_skips_held_records(payroll_db):
+    rows = asyncio.run(app.aggregate_cost_by_month(app.analytics_match()))
+    assert [row["month"] for row in rows] == ["03"]
+
+
+def test_employee_totals_skip_held_records(payroll_db):
+    totals = asyncio.run(app.aggregate_employee_totals("E001"))
+    assert totals["records"] == 1
+    assert totals["overtime_pay"] == 100.0
+
+
+def test_monthly_series_skips_held_records(payroll_db):
+    series = asyncio.run(app.aggregate_monthly_series())
+    assert [(row["_id"]["month"], row["y"]) for row in series] == [("03", 8000.0)]
+
+
+def test_forecast_cache_is_bounded(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(app, "db", db)
+    monkeypatch.setattr(app, "forecast_cache", app.LRUCache(maxsize=2))
+    series = {f"department:D{i}::6": [[f"2024-0{month}", 1000.0 * (i + 1)] for month in range(1, 7)] for i in range(5)}
+
+    async def serve():
+        await db.forecast_results.insert_many([
+            {"_id": key, "fingerprint": app.series_fingerprint(points, 6), "forecast": [key], "computed_at": "2024-07-01"}
+            for key, points in series.items()
+        ])
+        return await app.get_cached_forecasts(series, 6)
+
+    results = asyncio.run(serve())
+    assert {key: entry["forecast"] for key, entry in results.items()} == {key: [key] for key in series}
+    assert not any(entry["stale"] for entry in results.values())
+    assert len(app.forecast_cache) == 2
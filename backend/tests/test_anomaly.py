@@ -0,0 +1,36 @@
+from anomaly import DepartmentBaseline
+
+
+def uniform_baseline(salary=5000.0, count=20):
+    baseline = DepartmentBaseline()
+    for _ in range(count):
+        baseline.update("Ops", salary)
+    return baseline
+
+
+def test_uniform_department_keeps_small_changes():
+    baseline = uniform_baseline()
+    # One hour of overtime on a uniform 5000 department.
+    z, held = baseline.check("Ops", 5045.0)
+    assert not held
+    assert z < 1
+
+
+def test_uniform_department_still_holds_outliers():
+    baseline = uniform_baseline()
+    z, held = baseline.check("Ops", 25000.0)
+    assert held
+    assert z > baseline.threshold
+
+
+def test_seeded_zero_std_uses_floor():
+    baseline = DepartmentBaseline()
+    baseline.seed("HR", 50, 4000.0, 0.0)
+    assert baseline.score("HR", 4000.0) == 0.0
+    assert baseline.score("HR", 4040.0) == 0.2
+
+
+def test_thin_baseline_is_not_scored():
+    baseline = DepartmentBaseline()
+    baseline.seed("Eng", 3, 6000.0, 100.0)
+    assert baseline.check("Eng", 60000.0) == (None, False)
@@ -0,0 +1,67 @@
+import asyncio
+
+import app
+
+
+def parse(parser, *chunks):
+    async def text_chunks():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [
+            (row_number, str(row) if isinstance(row, Exception) else row)
+            async for row_number, row in parser(text_chunks())
+        ]
+
+    return asyncio.run(collect())
+
+
+def test_csv_quoted_field_spans_lines_and_chunks():
+    rows = parse(app.iter_csv_rows, 'employee_id,note\nE001,"two\n', 'lines"\nE002,plain\n')
+    assert rows == [(1, {"employee_id": "E001", "note": "two\nlines"}), (2, {"employee_id": "E002", "note": "plain"})]
+
+
+def test_csv_unbalanced_quote_at_eof_costs_one_row():
+    rows = parse(app.iter_csv_rows, 'employee_id,date\nE001,"2024-03-01\nE002,2024-03-02\nE003,2024-03-03\n')
+    assert rows == [
+        (1, "Unterminated quoted field"),
+        (2, {"employee_id": "E002", "date": "2024-03-02"}),
+        (3, {"employee_id": "E003", "date": "2024-03-03"}),
+    ]
+
+
+def test_csv_unbalanced_quote_stops_buffering_at_the_cap(monkeypatch):
+    monkeypatch.setattr(app, "INGEST_MAX_LINE", 40)
+    chunks = ["employee_id,date\n", 'E001,"2024-03-01\n'] + [f"E{i:03d},2024-03-01\n" for i in range(2, 100)]
+    read = []
+
+    async def text_chunks():
+        for chunk in chunks:
+            read.append(chunk)
+            yield chunk
+
+    async def first_rows():
+        rows = app.iter_csv_rows(text_chunks())
+        return [await anext(rows), await anext(rows)], len(read)
+
+    rows, chunks_read = asyncio.run(first_rows())
+    assert (rows[0][0], str(rows[0][1])) == (1, "Unterminated quoted field")
+    assert rows[1] == (2, {"employee_id": "E002", "date": "2024-03-01"})
+    assert chunks_read < 10
+
+
+def test_long_line_without_newlines_is_reported(monkeypatch):
+    monkeypatch.setattr(app, "INGEST_MAX_LINE", 25)
+    rows = parse(app.iter_ndjson_rows, '{"employee_id": "' + "x" * 30, "y" * 30, '"}\n{"employee_id": "E002"}\n')
+    assert rows == [(1, "Line longer than 25 characters"), (2, {"employee_id": "E002"})]
+
+
+def test_csv_long_line_inside_quotes(monkeypatch):
+    monkeypatch.setattr(app, "INGEST_MAX_LINE", 30)
+    rows = parse(app.iter_csv_rows, 'employee_id,note\nE001,"open\n' + "z" * 50 + "\nE002,ok\n")
+    assert rows == [
+        (1, "Unterminated quoted field"),
+        (2, "Line longer than 30 characters"),
+        (3, {"employee_id": "E002", "note": "ok"}),
+    ]
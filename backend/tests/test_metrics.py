@@ -0,0 +1,48 @@
+import asyncio
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import app
+
+
+@pytest.fixture
+def users_db(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(app, "db", db)
+    app.user_cache.clear()
+    asyncio.run(db.users.insert_many([
+        {"id": f"u-{role}", "email": f"{role}@example.com", "password": "", "full_name": role, "role": role,
+         "created_at": "2024-01-01T00:00:00+00:00"}
+        for role in ("admin", "employee")
+    ]))
+    yield db
+    app.user_cache.clear()
+
+
+def get_metrics(role=None):
+    headers = {}
+    if role:
+        headers["Authorization"] = f"Bearer {app.create_access_token({'sub': f'{role}@example.com', 'role': role})}"
+
+    async def request():
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/api/metrics", headers=headers)
+
+    return asyncio.run(request())
+
+
+def test_metrics_require_a_token(users_db):
+    assert get_metrics().status_code in (401, 403)
+
+
+def test_metrics_reject_non_admins(users_db):
+    assert get_metrics("employee").status_code == 403
+
+
+def test_metrics_served_to_admins(users_db):
+    response = get_metrics("admin")
+    assert response.status_code == 200
+    assert "http_request_duration_seconds" in response.text
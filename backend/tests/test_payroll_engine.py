@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import payroll_engine
+
+HALF_CENT_VALUES = [4839.005, 3054.435, 0.125, 1.005, 2.675, -1.005, 1234567.895]
+
+
+def random_amounts():
+    rng = np.random.default_rng(7)
+    cents = rng.integers(0, 2_000_000, 5000) + 0.5
+    return np.concatenate([cents / 100, rng.uniform(0, 50_000, 5000), HALF_CENT_VALUES])
+
+
+@pytest.mark.parametrize("exact_cents", [True, False])
+def test_round_cents_matches_builtin(monkeypatch, exact_cents):
+    if exact_cents and not payroll_engine._EXACT_CENTS:
+        pytest.skip("longdouble has no extended precision here")
+    monkeypatch.setattr(payroll_engine, "_EXACT_CENTS", exact_cents)
+    values = random_amounts()
+    assert payroll_engine.round_cents(values).tolist() == [round(value, 2) for value in values.tolist()]
+
+
+def test_round_cents_keeps_shape(monkeypatch):
+    monkeypatch.setattr(payroll_engine, "_EXACT_CENTS", False)
+    values = np.array([[4839.005, 3054.435], [1.005, 2.675]])
+    assert payroll_engine.round_cents(values).shape == (2, 2)
+
+
+def test_columns_match_calculate_payroll():
+    base = np.array([3000.0, 4321.37, 5000.0, 7777.77])
+    hours = np.array([0.0, 1.25, 2.3, 17.5])
+    columns = payroll_engine.compute_payroll_columns(base, hours, 100.0, 50.0)
+    for i in range(len(base)):
+        expected = payroll_engine.calculate_payroll(base[i], hours[i], 100.0, 50.0)
+        assert {key: columns[key][i] for key in expected} == expected
@@ -0,0 +1,49 @@
+import asyncio
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pydantic import ValidationError
+
+import app
+from app import PayrollSimulation
+
+
+def test_department_raises_accept_cuts_and_raises():
+    simulation = PayrollSimulation(month="03", year=2024, department_raises={"Eng": 4, "Ops": -10, "HR": 100})
+    assert simulation.department_raises == {"Eng": 4.0, "Ops": -10.0, "HR": 100.0}
+
+
+@pytest.mark.parametrize("raise_percent", [-100, -250, 100.5, 4000, float("nan"), float("inf")])
+def test_department_raises_out_of_bounds_are_rejected(raise_percent):
+    with pytest.raises(ValidationError):
+        PayrollSimulation(month="03", year=2024, department_raises={"Eng": raise_percent})
+
+
+@pytest.mark.parametrize("rules", [{"tax_rate": 1.5}, {"overtime_divisor": 0}, {"overtime_multiplier": -1}])
+def test_rule_overrides_out_of_bounds_are_rejected(rules):
+    with pytest.raises(ValidationError):
+        PayrollSimulation(month="03", year=2024, **rules)
+
+
+def test_simulate_endpoint_rejects_bad_raise(monkeypatch):
+    db = AsyncMongoMockClient()["test"]
+    monkeypatch.setattr(app, "db", db)
+    app.user_cache.clear()
+    token = app.create_access_token({"sub": "hr@example.com", "role": "hr"})
+
+    async def request():
+        await db.users.insert_one({"id": "u-hr", "email": "hr@example.com", "password": "", "full_name": "HR",
+                                   "role": "hr", "created_at": "2024-01-01T00:00:00+00:00"})
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                "/api/payroll/simulate",
+                json={"month": "03", "year": 2024, "department_raises": {"Eng": -150}},
+                headers={"Authorization": f"Bearer {token}"}
+            )
+
+    response = asyncio.run(request())
+    app.user_cache.clear()
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "department_raises", "Eng"]
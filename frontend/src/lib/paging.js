@@ -0,0 +1,25 @@
+import axios from 'axios';
+
+export const PAGE_SIZE = 100;
+const PAGE_SIZE_LIMIT = 1000;
+
+// One page of a keyset-paginated list; nextCursor is null on the last page.
+export async function fetchPage(url, { cursor, limit = PAGE_SIZE, params = {}, ...config } = {}) {
+  const response = await axios.get(url, {
+    ...config,
+    params: { ...params, limit, ...(cursor ? { cursor } : {}) },
+  });
+  return { items: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+}
+
+// Follows X-Next-Cursor to the end, for pickers that need every entry.
+export async function fetchAllPages(url, config = {}) {
+  const items = [];
+  let cursor = null;
+  do {
+    const page = await fetchPage(url, { ...config, cursor, limit: PAGE_SIZE_LIMIT });
+    items.push(...page.items);
+    cursor = page.nextCursor;
+  } while (cursor);
+  return items;
+}
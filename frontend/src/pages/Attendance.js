@@ -8,6 +8,7 @@ import { Label } from '../components/ui/label';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../components/ui/select';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '../components/ui/dialog';
 import { toast } from 'sonner';
+import { fetchAllPages, fetchPage } from '../lib/paging';
 import { Plus, Calendar, Clock } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -17,6 +18,8 @@ export default function Attendance({ user, onLogout }) {
   const [attendance, setAttendance] = useState([]);
   const [employees, setEmployees] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [isDialogOpen, setIsDialogOpen] = useState(false);
   const [formData, setFormData] = useState({
     employee_id: '',
@@ -33,12 +36,13 @@ export default function Attendance({ user, onLogout }) {
   const fetchData = async () => {
     try {
       const token = localStorage.getItem('token');
-      const [attendanceRes, employeesRes] = await Promise.all([
-        axios.get(`${API}/attendance`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${API}/employees`, { headers: { Authorization: `Bearer ${token}` } }),
+      const [attendancePage, allEmployees] = await Promise.all([
+        fetchPage(`${API}/attendance`, { headers: { Authorization: `Bearer ${token}` } }),
+        fetchAllPages(`${API}/employees`, { headers: { Authorization: `Bearer ${token}` } }),
       ]);
-      setAttendance(attendanceRes.data);
-      setEmployees(employeesRes.data);
+      setAttendance(attendancePage.items);
+      setNextCursor(attendancePage.nextCursor);
+      setEmployees(allEmployees);
     } catch (error) {
       toast.error('Failed to fetch data');
     } finally {
@@ -46,6 +50,23 @@ export default function Attendance({ user, onLogout }) {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const token = localStorage.getItem('token');
+      const page = await fetchPage(`${API}/attendance`, {
+        cursor: nextCursor,
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      setAttendance((records) => [...records, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      toast.error('Failed to fetch more attendance records');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     const token = localStorage.getItem('token');
@@ -232,6 +253,13 @@ export default function Attendance({ user, onLogout }) {
             </CardContent>
           </Card>
         )}
+        {nextCursor && (
+          <div className="flex justify-center">
+            <Button variant="outline" onClick={loadMore} disabled={loadingMore} data-testid="attendance-load-more">
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </Button>
+          </div>
+        )}
       </div>
     </Layout>
   );
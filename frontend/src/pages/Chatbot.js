@@ -105,14 +105,60 @@ useEffect(() => {
 
     try {
       const token = localStorage.getItem('token');
-      const response = await axios.post(`${API}/chatbot`, {
-        message: userMessage,
-        session_id: sessionId,
-      }, {
-        headers: { Authorization: `Bearer ${token}` },
+      const response = await fetch(`${API}/chatbot/stream`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          Authorization: `Bearer ${token}`,
+        },
+        body: JSON.stringify({ message: userMessage, session_id: sessionId }),
       });
+      if (!response.ok || !response.body) {
+        throw new Error(`Chatbot request failed with status ${response.status}`);
+      }
+
+      // Server-sent events: append each delta to the bot message as it arrives.
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let started = false;
+      const appendToReply = (text) => {
+        const first = !started;
+        started = true;
+        setMessages(prev => {
+          if (first) {
+            return [...prev, { role: 'bot', content: text }];
+          }
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+        });
+      };
 
-      setMessages(prev => [...prev, { role: 'bot', content: response.data.response }]);
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const rawEvent of events) {
+          let eventType = 'message';
+          let data = '';
+          for (const line of rawEvent.split('\n')) {
+            if (line.startsWith('event:')) eventType = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          }
+          if (!data) continue;
+          const payload = JSON.parse(data);
+          if (eventType === 'error') throw new Error(payload.message);
+          if (payload.delta) {
+            setLoading(false);
+            appendToReply(payload.delta);
+          }
+        }
+      }
+      if (!started) {
+        throw new Error('Empty chatbot response');
+      }
     } catch (error) {
       toast.error('Failed to get response from chatbot');
       setMessages(prev => [...prev, { 
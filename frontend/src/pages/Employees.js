@@ -7,6 +7,7 @@ import { Input } from '../components/ui/input';
 import { Label } from '../components/ui/label';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '../components/ui/dialog';
 import { toast } from 'sonner';
+import { fetchPage } from '../lib/paging';
 import { Plus, Edit, Trash2, Mail, Briefcase,Users } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -15,6 +16,8 @@ const API = `${BACKEND_URL}/api`;
 export default function Employees({ user, onLogout }) {
   const [employees, setEmployees] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [isDialogOpen, setIsDialogOpen] = useState(false);
   const [editingEmployee, setEditingEmployee] = useState(null);
   const [formData, setFormData] = useState({
@@ -34,10 +37,11 @@ export default function Employees({ user, onLogout }) {
   const fetchEmployees = async () => {
     try {
       const token = localStorage.getItem('token');
-      const response = await axios.get(`${API}/employees`, {
+      const page = await fetchPage(`${API}/employees`, {
         headers: { Authorization: `Bearer ${token}` },
       });
-      setEmployees(response.data);
+      setEmployees(page.items);
+      setNextCursor(page.nextCursor);
     } catch (error) {
       toast.error('Failed to fetch employees');
     } finally {
@@ -45,6 +49,23 @@ export default function Employees({ user, onLogout }) {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const token = localStorage.getItem('token');
+      const page = await fetchPage(`${API}/employees`, {
+        cursor: nextCursor,
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      setEmployees((current) => [...current, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      toast.error('Failed to fetch more employees');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     const token = localStorage.getItem('token');
@@ -297,6 +318,13 @@ export default function Employees({ user, onLogout }) {
             ))}
           </div>
         )}
+        {nextCursor && (
+          <div className="flex justify-center">
+            <Button variant="outline" onClick={loadMore} disabled={loadingMore} data-testid="employees-load-more">
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </Button>
+          </div>
+        )}
       </div>
     </Layout>
   );
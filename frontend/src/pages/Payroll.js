@@ -8,6 +8,7 @@ import { Label } from '../components/ui/label';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '../components/ui/select';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from '../components/ui/dialog';
 import { toast } from 'sonner';
+import { fetchAllPages, fetchPage } from '../lib/paging';
 import { Plus, DollarSign } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -17,6 +18,8 @@ export default function Payroll({ user, onLogout }) {
   const [payrollRecords, setPayrollRecords] = useState([]);
   const [employees, setEmployees] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [isDialogOpen, setIsDialogOpen] = useState(false);
   const [formData, setFormData] = useState({
     employee_id: '',
@@ -33,12 +36,13 @@ export default function Payroll({ user, onLogout }) {
   const fetchData = async () => {
     try {
       const token = localStorage.getItem('token');
-      const [payrollRes, employeesRes] = await Promise.all([
-        axios.get(`${API}/payroll`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${API}/employees`, { headers: { Authorization: `Bearer ${token}` } }),
+      const [payrollPage, allEmployees] = await Promise.all([
+        fetchPage(`${API}/payroll`, { headers: { Authorization: `Bearer ${token}` } }),
+        fetchAllPages(`${API}/employees`, { headers: { Authorization: `Bearer ${token}` } }),
       ]);
-      setPayrollRecords(payrollRes.data);
-      setEmployees(employeesRes.data);
+      setPayrollRecords(payrollPage.items);
+      setNextCursor(payrollPage.nextCursor);
+      setEmployees(allEmployees);
     } catch (error) {
       toast.error('Failed to fetch data');
     } finally {
@@ -46,6 +50,23 @@ export default function Payroll({ user, onLogout }) {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const token = localStorage.getItem('token');
+      const page = await fetchPage(`${API}/payroll`, {
+        cursor: nextCursor,
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      setPayrollRecords((records) => [...records, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (error) {
+      toast.error('Failed to fetch more payroll records');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     const token = localStorage.getItem('token');
@@ -254,6 +275,13 @@ export default function Payroll({ user, onLogout }) {
             ))}
           </div>
         )}
+        {nextCursor && (
+          <div className="flex justify-center">
+            <Button variant="outline" onClick={loadMore} disabled={loadingMore} data-testid="payroll-load-more">
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </Button>
+          </div>
+        )}
       </div>
     </Layout>
   );